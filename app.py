@@ -6,20 +6,33 @@
 ブラウザで http://localhost:5000 にアクセス
 """
 
+import atexit
 import cv2
+import numpy as np
 import time
 import threading
 import logging
 import logging.handlers
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
+from urllib.parse import urlsplit
 
-from flask import Flask, Response, render_template, jsonify, request
+from flask import Flask, Response, redirect, render_template, jsonify, request
 
 from config import Config
-from face_engine import FaceEngine
+from recognition_types import RecognitionResult, encoding_profile
+from engine_warmup import EngineWarmup
 from attendance_manager import AttendanceManager
 from slack_notifier import SlackNotifier
+from image_writer import ImageWriter
+from unknown_clusters import UnknownClusterer, quality_score
+from recognition_pool import RecognitionPool
+from recognition_scheduler import RecognitionScheduler
+from decision_fusion import DecisionFusion
+import metrics
+from tracing import Trace, TraceBuffer
+from frame_source import open_source
+from stream_server import STREAM_CLIENTS, SharedEncoder, StreamServer, parse_variant
 
 app = Flask(__name__)
 
@@ -56,24 +69,91 @@ logger = setup_logger()
 # ══════════════════════════════════════════════
 config = Config("config.json")
 
-face_engine = FaceEngine(
-    pkl_path  = config.get("paths",    "encodings_pkl"),
-    tolerance = config.get("settings", "face_tolerance")
-)
+ENGINE_KWARGS = {
+    "pkl_path":  config.get("paths",    "encodings_pkl"),
+    "tolerance": config.get("settings", "face_tolerance"),
+    "quality":   config.get("quality"),
+    "detector":  config.get("detector"),
+    "encoding":  encoding_profile(config.get("encoding"), "live"),
+}
+
+def _on_engine_ready(engine):
+    what = "登録名の読み込み" if warmup.names_only else "顔認識エンジンの準備"
+    logger.info(f"{what}完了 ({len(engine.unique_names)} 人)")
+    if engine.profile_mismatch:
+        logger.warning(f"登録データのエンコード設定 {engine.gallery_profile} が "
+                       f"認識側 {engine.profile} と一致しません")
+
+# dlib の import・encodings.pkl の読み込み・初回推論は __main__ でバックグラウンドに回す。
+# Flask とカメラは先に動かし、準備ができるまで認識は飛ばす（warmup.engine が None の間）。
+# recognition_workers > 0 なら認識はワーカーが行うので、親は登録名だけを読む
+warmup = EngineWarmup(ENGINE_KWARGS, on_ready=_on_engine_ready,
+                      names_only=bool(config.get("settings", "recognition_workers")))
+
 attendance = AttendanceManager(
-    log_csv = config.get("paths", "log_csv")
+    log_csv            = config.get("paths", "log_csv"),
+    durability         = config.get("attendance", "durability"),
+    fsync_interval_sec = config.get("attendance", "fsync_interval_sec"),
+    backend            = config.get("attendance", "backend"),
+    db_path            = config.get("attendance", "db_path"),
+    cached_days        = config.get("attendance", "cached_days"),
+    on_error           = lambda msg: notifier.notify_alert(msg),
 )
+atexit.register(attendance.close)   # buffered / flush モードの未 fsync 分を書き切る
+# recognition_workers > 0 のときは別プロセスで認識する（__main__ で起動）
+recognition_pool: RecognitionPool | None = None
+
+scheduler = RecognitionScheduler(
+    base_interval_ms   = config.get("settings", "recognition_interval_ms"),
+    active_interval_ms = config.get("settings", "recognition_active_interval_ms"),
+    idle_max_ms        = config.get("settings", "recognition_idle_max_ms"),
+    motion_threshold   = config.get("settings", "motion_threshold"),
+    motion_min_interval_ms = config.get("settings", "motion_min_interval_ms"),
+)
+# 複数フレームの判定（fusion.enabled = false なら1フレームごとに判定する）
+fusion = DecisionFusion(
+    tolerance         = config.get("settings", "face_tolerance"),
+    early_margin      = config.get("fusion", "early_margin"),
+    margin            = config.get("fusion", "margin"),
+    unknown_margin    = config.get("fusion", "unknown_margin"),
+    early_unknown_margin = config.get("fusion", "early_unknown_margin"),
+    max_frames        = config.get("fusion", "max_frames"),
+    track_iou         = config.get("fusion", "track_iou"),
+    track_timeout_sec = config.get("fusion", "track_timeout_sec"),
+    reverify_sec      = config.get("fusion", "reverify_sec"),
+) if config.get("fusion", "enabled") else None
+
 notifier = SlackNotifier(
-    user_webhooks = config.get("slack", "user_webhooks") or {},
-    alert_webhook = config.get("slack", "alert_webhook") or "",
+    user_webhooks    = config.get("slack", "user_webhooks") or {},
+    alert_webhook    = config.get("slack", "alert_webhook") or "",
+    queue_size       = config.get("slack", "queue_size"),
+    workers          = config.get("slack", "workers"),
+    max_retries      = config.get("slack", "max_retries"),
+    dead_letter_path = config.get("slack", "dead_letter"),
+    coalesce_ms      = config.get("slack", "coalesce_ms"),
+    image_writer     = ImageWriter(
+        base_dir       = config.get("images", "dir"),
+        crop_only      = config.get("images", "crop_only"),
+        crop_padding   = config.get("images", "crop_padding"),
+        jpeg_quality   = config.get("images", "jpeg_quality"),
+        queue_size     = config.get("images", "queue_size"),
+        retention_days = config.get("images", "retention_days"),
+        max_total_mb   = config.get("images", "max_total_mb"),
+    ),
 )
 
 # ══════════════════════════════════════════════
 # 共有状態
 # ══════════════════════════════════════════════
 frame_lock    = threading.Lock()
+frame_cond    = threading.Condition(frame_lock)   # 新しいフレームの到着通知
 raw_frame     = None   # 認識処理用（生フレーム）
 display_frame = None   # MJPEG配信用（顔枠描画済み）
+raw_seq       = 0      # raw_frame の通し番号（新しいフレームの判定用）
+raw_time      = 0.0    # raw_frame の取得時刻（time.time）
+raw_trace     = None   # raw_frame のトレース（撮影時刻・通し番号・各段階の span）
+
+traces = TraceBuffer(capacity=config.get("tracing", "capacity"))
 
 face_lock   = threading.Lock()
 latest_face = {"name": None, "loc": None}
@@ -86,10 +166,24 @@ status = {
     "pending_exit": None,    # 退室確認待ちのユーザー名
 }
 
+# 品質ゲートの集計（どれだけエンコードを省けたか）
+quality_lock  = threading.Lock()
+quality_stats = {"detected": 0, "encoded": 0, "encode_sec": 0.0, "rejected": {}}
+last_reject   = {"reason": None}   # 同じ理由の不採用ログを連続で出さない
+
 cooldown_sec  = config.get("settings", "cooldown_sec")
 last_rec_lock = threading.Lock()
 last_rec_times: dict[str, datetime] = {}
 
+# 未登録人物のクラスタ（同じ人の画像を何枚も保存しない）
+unknown_clusters = UnknownClusterer(
+    window_sec       = config.get("unknown", "window_sec"),
+    cluster_distance = config.get("unknown", "cluster_distance"),
+    better_ratio     = config.get("unknown", "better_ratio"),
+    cooldown_sec     = cooldown_sec,
+    image_dir        = config.get("images", "dir"),
+)
+
 # ウォッチドッグ用ハートビート（各スレッドが定期更新）
 heartbeat_lock = threading.Lock()
 heartbeat: dict[str, float] = {
@@ -98,31 +192,63 @@ heartbeat: dict[str, float] = {
 }
 
 
+# ══════════════════════════════════════════════
+# メトリクス（/metrics で Prometheus 形式）
+# ══════════════════════════════════════════════
+CAMERA_FPS      = metrics.RateGauge("camera_fps", "カメラから読めたフレームレート（直近5秒）")
+CAMERA_FRAMES   = metrics.counter("camera_frames_total", "カメラから読めたフレーム数")
+CAMERA_FAILURES = metrics.counter("camera_read_failures_total", "cap.read() の失敗回数")
+FRAME_AGE       = metrics.histogram("recognition_frame_age_seconds",
+                                    "撮影から認識開始までの時間")
+STAGE_SECONDS   = metrics.histogram("recognition_stage_seconds",
+                                    "認識の段階別処理時間（detect / quality / encode / match）",
+                                    labels=("stage",))
+RECOGNIZE_SECONDS = metrics.histogram("recognition_seconds",
+                                      "1フレームの認識全体の時間（プール時は投入から結果まで）")
+RESULTS         = metrics.counter("recognition_results_total", "認識結果の件数",
+                                  labels=("result",))
+# stream_clients は stream_server.STREAM_CLIENTS を Flask の配信でも使う
+
+
 # ══════════════════════════════════════════════
 # カメラスレッド
 # ══════════════════════════════════════════════
 def camera_worker():
-    global raw_frame, display_frame
+    global raw_frame, display_frame, raw_seq, raw_time, raw_trace
+
+    idx    = config.get("settings", "camera_index")
+    source = config.get("settings", "camera_source")
+    cap    = open_source(source)
+    if cap is not None:
+        # カメラの代わり（合成フレーム・動画・画像フォルダ）
+        if not cap.isOpened():
+            logger.error(f"フレームソース {source} を開けませんでした")
+            return
+        logger.info(f"フレームソース起動 ({source}, 15fps)")
+    else:
+        cap = cv2.VideoCapture(idx, cv2.CAP_V4L2)
+        cap.set(cv2.CAP_PROP_FOURCC,       cv2.VideoWriter_fourcc(*"MJPG"))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH,  640)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        cap.set(cv2.CAP_PROP_FPS,          15)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE,   1)
 
-    idx = config.get("settings", "camera_index")
-    cap = cv2.VideoCapture(idx, cv2.CAP_V4L2)
-    cap.set(cv2.CAP_PROP_FOURCC,       cv2.VideoWriter_fourcc(*"MJPG"))
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    cap.set(cv2.CAP_PROP_FPS,          15)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE,   1)
-
-    if not cap.isOpened():
-        logger.error(f"カメラ {idx} を開けませんでした")
-        return
+        if not cap.isOpened():
+            logger.error(f"カメラ {idx} を開けませんでした")
+            return
 
-    logger.info(f"カメラ起動 (index={idx}, MJPG, 640x480, 15fps)")
+        logger.info(f"カメラ起動 (index={idx}, MJPG, 640x480, 15fps)")
 
     while True:
+        read_start = time.time()
         ret, frame = cap.read()
+        captured   = time.time()
         if not ret:
+            CAMERA_FAILURES.inc()
             time.sleep(0.05)
             continue
+        CAMERA_FRAMES.inc()
+        CAMERA_FPS.tick()
 
         # ウォッチドッグ用ハートビート更新
         with heartbeat_lock:
@@ -143,107 +269,329 @@ def camera_worker():
                 cv2.putText(draw, name, (left, top - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.75, color, 2)
 
-        with frame_lock:
-            raw_frame     = frame.copy()
+        with frame_cond:
+            raw_frame     = frame
             display_frame = draw
+            raw_seq      += 1
+            raw_time      = captured
+            raw_trace     = Trace(raw_seq, captured)
+            raw_trace.add("camera_read", read_start, captured)
+            frame_cond.notify_all()
 
 
 # ══════════════════════════════════════════════
 # 顔認識スレッド
 # ══════════════════════════════════════════════
 def recognition_worker():
-    interval = config.get("settings", "recognition_interval_ms") / 1000.0
+    if recognition_pool is not None:
+        _recognition_pool_loop()
+        return
 
     while True:
-        time.sleep(interval)
-
         # ウォッチドッグ用ハートビート更新
         with heartbeat_lock:
             heartbeat["recognition"] = time.time()
 
+        # エンジンのウォームアップが終わるまでは認識しない
+        face_engine = warmup.engine
+        if face_engine is None:
+            warmup.ready.wait(timeout=SCHED_MAX_WAIT_SEC)
+            continue
+
+        # 次の認識時刻まで待つ（顔なしの待機中はフレームごとに動きを確認する）
+        delay = scheduler.time_until_due()
+        if delay > 0 and not scheduler.idle:
+            time.sleep(min(delay, SCHED_MAX_WAIT_SEC))
+            continue
+
+        frame, seq, captured, trace = _wait_new_frame()
+        if frame is None:
+            continue
+        scheduler.consume(seq)
+        moved = scheduler.motion_wake(frame)
+
         # 退室確認待ち中は認識しない
         with status_lock:
             if status["pending_exit"] is not None:
                 continue
 
-        with frame_lock:
-            if raw_frame is None:
-                continue
-            frame = raw_frame.copy()
+        if delay > 0 and not moved:
+            continue
 
-        name, face_loc = face_engine.recognize(frame)
+        started = time.monotonic()
+        started_wall = time.time()
+        scheduler.record("frame_age", started_wall - captured)
+        FRAME_AGE.observe(started_wall - captured)
+        trace.add("wait", captured, started_wall)
+        result = face_engine.recognize_detail(
+            frame, skip_box=fusion.skip_box() if fusion else None)
+        if fusion:
+            fusion.update(result)
+        recognized = time.monotonic()
+        scheduler.record("recognize", recognized - started)
+        RECOGNIZE_SECONDS.observe(recognized - started)
+        _trace_recognize(trace, result, started_wall, time.time())
+        handle_recognition(result, trace, frame)
+        scheduler.record("handle", time.monotonic() - recognized)
+        scheduler.update(result.name, result.location, started)
+
+
+# 新しいフレーム待ちの最大時間（ハートビート更新のため上限を設ける）
+SCHED_MAX_WAIT_SEC = 0.5
+
+def _wait_new_frame() -> tuple:
+    """
+    前回処理したものより新しいフレームを待って返す。
+    camera_worker は raw_frame を差し替えるだけなのでコピーせず参照を返す。
+
+    Returns:
+        (frame, seq, capture_time, trace)  タイムアウト時はすべて None
+    """
+    with frame_cond:
+        frame_cond.wait_for(lambda: scheduler.is_new(raw_seq), timeout=SCHED_MAX_WAIT_SEC)
+        if raw_frame is None or not scheduler.is_new(raw_seq):
+            return None, None, None, None
+        return raw_frame, raw_seq, raw_time, raw_trace
+
+
+def _trace_recognize(trace: Trace, result: RecognitionResult, start: float, end: float):
+    """FaceEngine の段階別時間を並べ、残りを recognize_other として記録する"""
+    stages_end = trace.add_sequence(start, result.timings)
+    if end > stages_end:
+        trace.add("recognize_other", stages_end, end)
+
+
+# 結果待ちの最大時間（この間隔で新しいフレームの投入も確認する）
+POOL_POLL_SEC = 0.05
+
+def _recognition_pool_loop():
+    """
+    プロセスプール版の認識ループ。
+    スケジューラが許可したら空いているワーカーに最新フレームを投入し、
+    届いた結果を順に処理する。ワーカー数に比例して認識レートが上がる。
+    """
+    last_handled = 0
+    # seq → (投入時刻, トレース, 投入したフレーム)。入室画像は認識したフレームから切り出す
+    submitted_at: dict[int, tuple[float, Trace, np.ndarray]] = {}
 
-        # 顔検出結果を保存（描画は camera_worker が毎フレーム行う）
-        with face_lock:
-            latest_face["name"] = name
-            latest_face["loc"]  = face_loc
-
-        if not name or name == "unknown":
-            # unknown の顔画像をクールダウン付きで保存
-            if name == "unknown" and face_loc is not None:
-                now = datetime.now()
-                with last_rec_lock:
-                    last = last_rec_times.get("unknown")
-                    if not last or (now - last).total_seconds() >= cooldown_sec:
-                        last_rec_times["unknown"] = now
-                        with frame_lock:
-                            unknown_frame = raw_frame.copy() if raw_frame is not None else None
-                        if unknown_frame is not None:
-                            notifier.save_unknown_image(unknown_frame, now)
+    while True:
+        with heartbeat_lock:
+            heartbeat["recognition"] = time.time()
+
+        with status_lock:
+            pending = status["pending_exit"] is not None
+
+        with frame_lock:
+            frame, seq, captured, trace = raw_frame, raw_seq, raw_time, raw_trace
+        if not pending and frame is not None and scheduler.is_new(seq):
+            due = scheduler.time_until_due() <= 0
+            if due or (scheduler.idle and scheduler.motion_wake(frame)):
+                skip_box = fusion.skip_box() if fusion else None
+                if recognition_pool.submit(frame, seq, skip_box):
+                    scheduler.consume(seq)
+                    now = time.time()
+                    scheduler.record("frame_age", now - captured)
+                    FRAME_AGE.observe(now - captured)
+                    trace.add("wait", captured, now)
+                    submitted_at[seq] = (time.monotonic(), trace, frame)
+
+        result = recognition_pool.get_result(timeout=POOL_POLL_SEC)
+        if result is None:
+            continue
+
+        seq, result = result
+        started, trace, frame = submitted_at.pop(seq, (time.monotonic(), None, None))
+        # 追い越して届いた古いフレームの結果は捨てる
+        if seq <= last_handled:
             continue
+        last_handled = seq
+        # ワーカー再起動で結果が返らなかった分を掃除
+        for old in [s for s in submitted_at if s < seq]:
+            del submitted_at[old]
 
-        # クールダウンチェック
-        now = datetime.now()
-        with last_rec_lock:
-            last = last_rec_times.get(name)
-            if last and (now - last).total_seconds() < cooldown_sec:
+        with status_lock:
+            if status["pending_exit"] is not None:
                 continue
-            last_rec_times[name] = now
-
-        # 出退勤判定
-        action = attendance.check_action(name)
-        logger.info(f"認識: {name} → {action}")
-
-        if action == "entry":
-            dt = attendance.record_entry(name)
-            with frame_lock:
-                entry_frame = raw_frame.copy() if raw_frame is not None else None
-            notifier.notify_entry(name, dt, face_frame=entry_frame)
-            with status_lock:
-                status.update({
-                    "user":         name,
-                    "action":       "entry",
-                    "time":         dt.strftime("%H:%M:%S"),
-                    "pending_exit": None,
-                })
-            logger.info(f"入室: {name} {dt.strftime('%H:%M:%S')}")
-
-        elif action == "exit_confirm":
-            with status_lock:
-                status["pending_exit"] = name
-            logger.info(f"退室確認待ち: {name}")
+
+        if fusion:
+            fusion.update(result)
+        recognized = time.monotonic()
+        scheduler.record("recognize", recognized - started)
+        RECOGNIZE_SECONDS.observe(recognized - started)
+        if trace is not None:
+            now = time.time()
+            _trace_recognize(trace, result, now - (recognized - started), now)
+        handle_recognition(result, trace, frame)
+        scheduler.record("handle", time.monotonic() - recognized)
+        scheduler.update(result.name, result.location, started)
+
+
+def _span(trace: Trace | None, stage: str, start: float) -> float:
+    """start から今までを span として記録し、今の時刻を返す"""
+    now = time.time()
+    if trace is not None:
+        trace.add(stage, start, now)
+    return now
+
+
+def handle_recognition(result: RecognitionResult, trace: Trace | None = None,
+                       frame: np.ndarray | None = None):
+    """
+    認識結果から枠表示・unknown 保存・入退室判定を行う。
+    frame は認識したフレーム（顔位置はこのフレーム上の座標）。
+    """
+    name, face_loc = result.name, result.location
+    _count_quality(result)
+    # 顔が写っていたフレームだけトレースを残す（以降の span は追記されていく）
+    if trace is not None and face_loc is not None:
+        trace.meta.update(name=name, outcome=result.reject_reason or name or result.decision)
+        if result.decision:
+            trace.meta.update(decision=result.decision, frames=result.frames)
+        traces.add(trace)
+    else:
+        trace = None
+    # 段階別の時間は FaceEngine（プール時はワーカープロセス側）が測って結果に載せてくる
+    for stage, sec in result.timings.items():
+        scheduler.record(stage, sec)
+        STAGE_SECONDS.observe(sec, stage=stage)
+    if result.location is not None:
+        RESULTS.inc(result=("rejected" if result.reject_reason
+                            else "pending" if result.decision == "pending"
+                            else "unknown" if result.name == "unknown" else "known"))
+
+    # 顔検出結果を保存（描画は camera_worker が毎フレーム行う）
+    with face_lock:
+        latest_face["name"] = name
+        latest_face["loc"]  = face_loc
+
+    if not name or name == "unknown":
+        # unknown は特徴ベクトルでクラスタリングし、新しい人物か
+        # より良い写りのときだけ保存する
+        if name == "unknown" and result.encoding is not None:
+            now = datetime.now()
+            score = quality_score(result.quality, face_loc)
+            cluster_id, should_save = unknown_clusters.observe(result.encoding, score, now)
+            if should_save and frame is not None:
+                # 顔位置は認識したフレームのものなので、今の raw_frame ではなくそれを保存する
+                notifier.save_unknown_image(frame, now, face_loc, cluster_id)
+        return
+
+    # クールダウンチェック
+    t = time.time()
+    now = datetime.now()
+    with last_rec_lock:
+        last = last_rec_times.get(name)
+        if last and (now - last).total_seconds() < cooldown_sec:
+            _span(trace, "cooldown", t)
+            if trace is not None:
+                trace.meta["outcome"] = "cooldown"
+            return
+        last_rec_times[name] = now
+    t = _span(trace, "cooldown", t)
+
+    # 出退勤判定
+    action = attendance.check_action(name)
+    logger.info(f"認識: {name} → {action}")
+    if trace is not None:
+        trace.meta["outcome"] = action
+
+    if action == "entry":
+        dt = attendance.record_entry(name)
+        t = _span(trace, "attendance_write", t)
+        # 顔位置は認識したフレームのものなので、今の raw_frame ではなくそれを切り出す
+        notifier.notify_entry(name, dt, face_frame=frame, face_loc=face_loc,
+                              on_done=_slack_span(trace))
+        t = _span(trace, "slack_enqueue", t)
+        with status_lock:
+            status.update({
+                "user":         name,
+                "action":       "entry",
+                "time":         dt.strftime("%H:%M:%S"),
+                "pending_exit": None,
+            })
+        _span(trace, "status_update", t)
+        logger.info(f"入室: {name} {dt.strftime('%H:%M:%S')}")
+
+    elif action == "exit_confirm":
+        with status_lock:
+            status["pending_exit"] = name
+        _span(trace, "status_update", t)
+        logger.info(f"退室確認待ち: {name}")
+
+
+def _slack_span(trace: Trace | None):
+    """Slack の送信完了（送信スレッドから呼ばれる）で slack_delivery を記録するコールバック"""
+    if trace is None:
+        return None
+    queued = time.time()
+    def on_done(ok: bool):
+        trace.add("slack_delivery", queued, time.time())
+        trace.meta["slack_ok"] = ok
+    return on_done
+
+
+def _count_quality(result: RecognitionResult):
+    """品質ゲートの通過/不採用を数える（プロセスプール時も親側で集計する）"""
+    if result.location is None:
+        return
+    with quality_lock:
+        quality_stats["detected"] += 1
+        if result.reject_reason:
+            rejected = quality_stats["rejected"]
+            rejected[result.reject_reason] = rejected.get(result.reject_reason, 0) + 1
+            if result.reject_reason != last_reject["reason"]:
+                logger.debug(f"品質ゲート不採用: {result.reject_reason} {result.quality}")
+        elif "encode" in result.timings:
+            quality_stats["encoded"]   += 1
+            quality_stats["encode_sec"] += result.timings["encode"]
+        last_reject["reason"] = result.reject_reason
 
 
 # ══════════════════════════════════════════════
 # MJPEG ストリーム
 # ══════════════════════════════════════════════
-def generate_frames():
-    while True:
-        with frame_lock:
-            frame = display_frame
+def _display_frame() -> tuple:
+    """StreamServer 用：(通し番号, 顔枠描画済みフレーム)"""
+    with frame_lock:
+        return raw_seq, display_frame
 
-        if frame is None:
-            time.sleep(0.05)
-            continue
 
-        ret, buf = cv2.imencode(
-            ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80]
-        )
-        if ret:
-            yield (b"--frame\r\n"
-                   b"Content-Type: image/jpeg\r\n\r\n"
-                   + buf.tobytes() + b"\r\n")
-        time.sleep(1 / 15)
+def _status_snapshot() -> dict:
+    """StreamServer 用：/api/status と同じ内容"""
+    with status_lock:
+        return status.copy()
+
+
+# stream.enabled のとき __main__ で起動し、/video_feed と状態のプッシュを受け持つ
+stream_server: StreamServer | None = None
+
+# stream.enabled = false のときの配信で、同じ（縮小率, 画質）のエンコードを共有する
+shared_encoder = SharedEncoder(max_variants=config.get("stream", "max_variants"))
+
+
+def generate_frames(scale: float = 1.0, quality: int = 80, fps: float = 15):
+    """
+    stream.enabled = false のときの配信。エンコードは shared_encoder で（縮小率, 画質）ごとに
+    1フレーム1回だけ行い、同じ組のクライアントで共有する。送ったフレームは送り直さない。
+    """
+    STREAM_CLIENTS.inc()
+    last = None
+    try:
+        while True:
+            started = time.monotonic()
+            seq, frame = _display_frame()
+            if frame is None:
+                time.sleep(0.05)
+                continue
+
+            sent_seq, part = shared_encoder.part(seq, frame, scale, quality)
+            if part is not None and sent_seq != last:
+                last = sent_seq
+                yield part
+            time.sleep(max(1 / fps - (time.monotonic() - started), 0.01))
+    finally:
+        # クライアントが切断すると GeneratorExit でここに来る
+        STREAM_CLIENTS.dec()
 
 
 # ══════════════════════════════════════════════
@@ -251,14 +599,46 @@ def generate_frames():
 # ══════════════════════════════════════════════
 @app.route("/")
 def index():
+    # ウォームアップ中は空のユーザー一覧で先にページを返す
+    engine = warmup.engine
     return render_template("index.html",
-                           users=face_engine.unique_names)
+                           users=engine.unique_names if engine else [],
+                           stream_base=_stream_base())
+
+
+def _stream_base() -> str:
+    """
+    ブラウザから StreamServer に繋ぐ先（使わないときは ""）。
+    stream.public_url（リバースプロキシで同じオリジンに出したパスや URL）があればそれを使う。
+    無ければ http で開かれたページに限り http://<host>:<port>。StreamServer は TLS を
+    話さないので、https のページでは Flask の /video_feed（同じオリジン）で配信する。
+    """
+    if stream_server is None:
+        return ""
+    public_url = config.get("stream", "public_url")
+    if public_url:
+        return public_url.rstrip("/")
+    if request.headers.get("X-Forwarded-Proto", request.scheme) != "http":
+        return ""
+    host = urlsplit(request.host_url).hostname
+    if ":" in host:
+        host = f"[{host}]"   # IPv6
+    return f"http://{host}:{stream_server.port}"
 
 
 @app.route("/video_feed")
 def video_feed():
+    base = _stream_base()
+    if base:
+        # 配信は StreamServer に任せ、Flask のスレッドを占有しない
+        query = f"?{request.query_string.decode()}" if request.query_string else ""
+        return redirect(f"{base}/video_feed{query}")
+    try:
+        scale, quality, fps = parse_variant(request.args)
+    except ValueError:
+        raise BadArgument("scale / quality / fps は数値で指定してください")
     return Response(
-        generate_frames(),
+        generate_frames(scale, quality, fps),
         mimetype="multipart/x-mixed-replace; boundary=frame"
     )
 
@@ -295,14 +675,226 @@ def api_exit_confirm():
     else:
         logger.info(f"退室キャンセル: {user}")
 
+    # 確認待ちの間は認識を止めていたので、すぐ再開させる
+    scheduler.wake()
+
     return jsonify({"ok": True})
 
 
+@app.route("/api/scheduler")
+def api_scheduler():
+    """認識スケジューラの状態と段階別レイテンシ"""
+    return jsonify(scheduler.snapshot())
+
+
+@app.route("/api/fusion")
+def api_fusion():
+    """複数フレーム判定の集計：確定の内訳・確定までのフレーム数と時間・省いたエンコード数"""
+    if fusion is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **fusion.snapshot()})
+
+
+@app.route("/api/quality")
+def api_quality():
+    """品質ゲートの集計：不採用の内訳と省けたエンコード時間の見積もり"""
+    with quality_lock:
+        stats = {**quality_stats, "rejected": dict(quality_stats["rejected"])}
+    rejected   = sum(stats["rejected"].values())
+    avg_encode = stats["encode_sec"] / stats["encoded"] if stats["encoded"] else 0.0
+    return jsonify({
+        "detected":        stats["detected"],
+        "encoded":         stats["encoded"],
+        "rejected":        stats["rejected"],
+        "rejected_ratio":  round(rejected / max(stats["detected"], 1), 3),
+        "avg_encode_ms":   round(avg_encode * 1000, 2),
+        "saved_encode_ms": round(rejected * avg_encode * 1000, 1),
+    })
+
+
+@app.route("/api/slack")
+def api_slack():
+    """Slack 送信キューの状態（送信済み・再送・断念・滞留）"""
+    return jsonify(notifier.stats())
+
+
+@app.route("/api/images")
+def api_images():
+    """顔画像の保存状況（書き込み数・破棄数・削除数）"""
+    return jsonify(notifier.image_writer.snapshot())
+
+
+@app.route("/api/unknowns")
+def api_unknowns():
+    """未登録人物のクラスタごとの検出回数・保存枚数"""
+    return jsonify(unknown_clusters.summary())
+
+
+# ──────────────────────────────────────────
+# 出退勤レポート API
+#   応答には ETag を付け、記録が増えていなければ 304 を返す。
+#   一覧は ?offset=&limit= でページ分割する。
+# ──────────────────────────────────────────
+PAGE_LIMIT_DEFAULT = 100
+PAGE_LIMIT_MAX     = 500
+SUMMARY_DAYS_DEFAULT = 30
+
+def _attendance_response(build):
+    """ETag が一致すれば 304、そうでなければ build() の結果を返す"""
+    etag = attendance.etag
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def _page_args() -> tuple[int, int]:
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit  = request.args.get("limit", PAGE_LIMIT_DEFAULT, type=int)
+    return offset, min(max(limit, 1), PAGE_LIMIT_MAX)
+
+class BadArgument(ValueError):
+    """クエリパラメータの誤り（400 で返す）"""
+
+def _date_arg(name: str, default: date) -> date:
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadArgument(f"{name} は YYYY-MM-DD 形式で指定してください: {value}")
+
+def _page(items: list, total: int, offset: int, limit: int) -> dict:
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
+
+@app.errorhandler(BadArgument)
+def handle_bad_argument(e):
+    return jsonify({"ok": False, "error": str(e)}), 400
+
+
+@app.route("/api/attendance/occupancy")
+def api_attendance_occupancy():
+    """現在入室中のユーザーと入室時刻"""
+    def build():
+        users = attendance.occupancy()
+        return {"date": str(date.today()), "count": len(users), "users": users}
+    return _attendance_response(build)
+
+
+@app.route("/api/attendance/dwell")
+def api_attendance_dwell():
+    """指定日（?date=YYYY-MM-DD、既定は今日）のユーザーごとの在室時間"""
+    day = _date_arg("date", date.today())
+    offset, limit = _page_args()
+    def build():
+        rows = attendance.dwell_on(day)
+        return {"date": str(day), **_page(rows[offset:offset + limit], len(rows), offset, limit)}
+    return _attendance_response(build)
+
+
+@app.route("/api/attendance/days")
+def api_attendance_days():
+    """日別サマリー（?start=&end=、既定は直近30日。新しい日から順に返す）"""
+    end   = _date_arg("end", date.today())
+    start = _date_arg("start", end - timedelta(days=SUMMARY_DAYS_DEFAULT - 1))
+    if start > end:
+        raise BadArgument("start は end 以前の日付にしてください")
+    offset, limit = _page_args()
+    def build():
+        total = (end - start).days + 1
+        # ページに載る日だけを集計する
+        days  = [end - timedelta(days=i) for i in range(offset, min(offset + limit, total))]
+        return _page(attendance.day_summaries(days), total, offset, limit)
+    return _attendance_response(build)
+
+
+@app.route("/api/traces")
+def api_traces():
+    """
+    直近のトレースと段階ごとのパーセンタイル。
+    ?limit=（既定 50）、?outcome=entry や ?name=<ユーザー> で絞り込める。
+    """
+    limit = min(max(request.args.get("limit", 50, type=int), 1), PAGE_LIMIT_MAX)
+    meta  = {k: request.args[k] for k in ("outcome", "name") if k in request.args}
+    return jsonify({**traces.summary(), "recent": traces.recent(limit, **meta)})
+
+
+@app.route("/api/stream")
+def api_stream():
+    """StreamServer の接続状況（クライアントごとの送信・間引きフレーム数）"""
+    if stream_server is None:
+        # Flask で配信している間は共有しているエンコードの組の数だけ
+        return jsonify({"enabled": False, "variants": shared_encoder.variants()})
+    return jsonify({"enabled": True, **stream_server.stats()})
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus 形式のメトリクス"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/api/reload_faces", methods=["POST"])
 def api_reload_faces():
     """encodings.pkl を再読込する"""
+    face_engine = warmup.engine
+    if face_engine is None:
+        return jsonify({"ok": False, "error": "顔認識エンジンの準備中です",
+                        "engine": warmup.snapshot()}), 503
     face_engine.load_faces()
-    return jsonify({"ok": True, "users": face_engine.unique_names})
+    if recognition_pool is not None:
+        recognition_pool.reload()
+    if fusion:
+        fusion.reset()
+    return jsonify({"ok": True, "users": face_engine.unique_names,
+                    "profile_mismatch": face_engine.profile_mismatch})
+
+
+# ──────────────────────────────────────────
+# 死活監視（systemd / 監視ツール用）
+# ──────────────────────────────────────────
+STARTED_AT = time.time()
+
+@app.route("/healthz")
+def healthz():
+    """プロセスが応答できるか（常に 200）。各スレッドのハートビートからの経過秒も返す"""
+    now = time.time()
+    with heartbeat_lock:
+        beats = heartbeat.copy()
+    return jsonify({
+        "ok":         True,
+        "uptime_sec": round(now - STARTED_AT, 1),
+        "heartbeat_age_sec": {name: round(now - last, 1) for name, last in beats.items()},
+    })
+
+
+@app.route("/readyz")
+def readyz():
+    """
+    認識まで含めて動いているか。エンジンの準備ができ、カメラからフレームが
+    届いているときだけ 200、それ以外は 503（何が未準備かを本文に載せる）。
+    プール時は親のエンジン（登録名だけ）ではなく、準備を終えたワーカーが
+    1つ以上あることを「エンジンの準備ができた」とみなす。
+    """
+    with frame_lock:
+        seq, last = raw_seq, raw_time
+    camera_ok = seq > 0 and time.time() - last < WATCHDOG_TIMEOUT_SEC
+    engine_ok = warmup.ready.is_set()
+    body = {
+        "engine": warmup.snapshot(),
+        "camera": {"ok": camera_ok, "frames": seq,
+                   "last_frame_age_sec": round(time.time() - last, 1) if seq else None},
+    }
+    if recognition_pool is not None:
+        ready_workers = recognition_pool.ready_workers()
+        engine_ok = engine_ok and ready_workers > 0
+        body["recognition_pool"] = {"ready_workers": ready_workers,
+                                    "workers": recognition_pool.num_workers}
+    body["ready"] = engine_ok and camera_ok
+    return jsonify(body), 200 if body["ready"] else 503
 
 
 # ══════════════════════════════════════════════
@@ -325,6 +917,12 @@ def watchdog_worker():
         with heartbeat_lock:
             beats = heartbeat.copy()
 
+        # 認識ワーカープロセスが落ちていれば再起動する
+        if recognition_pool is not None:
+            for msg in recognition_pool.check_workers():
+                logger.error(f"[Watchdog] {msg}")
+                notifier.notify_alert(msg)
+
         for name, last in beats.items():
             elapsed = now - last
             if elapsed > WATCHDOG_TIMEOUT_SEC:
@@ -349,6 +947,8 @@ USB_CHECK_INTERVAL_SEC = 10
 
 def usb_monitor_worker():
     """カメラデバイスファイルの存在を監視する"""
+    if config.get("settings", "camera_source"):
+        return   # カメラの代わりのフレームソースを使っているときは監視しない
     idx = config.get("settings", "camera_index")
     device_path = Path(f"/dev/video{idx}")
     was_present = device_path.exists()
@@ -374,9 +974,28 @@ def usb_monitor_worker():
 # エントリーポイント
 # ══════════════════════════════════════════════
 if __name__ == "__main__":
+    # ワーカーの起動を待たずに済むよう、他のスレッドより先に始めておく
+    num_workers = config.get("settings", "recognition_workers")
+    if num_workers:
+        recognition_pool = RecognitionPool(num_workers, engine_kwargs=ENGINE_KWARGS)
+
+    # 子プロセスは各自でエンジンを読み込む（プール時の親は登録名だけ）
+    warmup.start()
     threading.Thread(target=camera_worker,      daemon=True).start()
     threading.Thread(target=recognition_worker, daemon=True).start()
     threading.Thread(target=watchdog_worker,    daemon=True).start()
     threading.Thread(target=usb_monitor_worker, daemon=True).start()
+    if config.get("stream", "enabled"):
+        stream_server = StreamServer(
+            _display_frame, _status_snapshot,
+            port               = config.get("stream", "port"),
+            max_clients        = config.get("stream", "max_clients"),
+            max_per_ip         = config.get("stream", "max_per_ip"),
+            write_timeout_sec  = config.get("stream", "write_timeout_sec"),
+            header_timeout_sec = config.get("stream", "header_timeout_sec"),
+            max_buffer_kb      = config.get("stream", "max_buffer_kb"),
+            status_interval_ms = config.get("stream", "status_interval_ms"),
+            max_variants       = config.get("stream", "max_variants"),
+        ).start()
     logger.info("http://localhost:5000 で起動します")
     app.run(host="0.0.0.0", port=5000, threaded=True, debug=False)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+出退勤ログの SQLite バックエンド
+
+attendance.backend = "sqlite" のとき AttendanceManager が CSV の代わりに使う。
+WAL モードで開き、(date, user_name) と (user_name, date) にインデックスを張るので、
+何年分あっても日付・ユーザー指定の問い合わせはミリ秒で返る。
+
+書き込み:
+    append() はキューに積んですぐ戻る（認識スレッドを止めない）。
+    専用スレッドがまとめて1トランザクションで INSERT する。
+    durability = "fsync" のときは synchronous=FULL、それ以外は NORMAL。
+    INSERT が失敗したら（ロック待ちの時間切れ・ディスク不足など）間を空けて
+    WRITE_RETRIES 回までやり直し、それでも駄目なバッチは spill_path
+    （attendance.failed.csv、CSV と同じ形式）に追記して on_error で知らせる。
+    spill_path は次回起動時に migrate_csv() で取り込まれるので記録は失われない。
+    問い合わせは ts 順に並べるので、後から取り込んだ分も時刻の位置に入る。
+
+CSV からの移行:
+    migrate_csv() が attendance.csv を取り込む。取り込んだバイト位置を
+    meta テーブルに覚えておき、2回目以降は増えた分だけを取り込む。
+    起動時に自動で呼ばれるので、CSV 運用から切り替えるだけで移行できる。
+
+使い方（CLI）:
+    python attendance_db.py migrate logs/attendance.csv
+    python attendance_db.py inside
+    python attendance_db.py day 2025-04-01
+    python attendance_db.py user 山田 2025-04-01 2025-04-30
+"""
+
+import argparse
+import csv
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts        TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    action    TEXT NOT NULL,
+    date      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_date_user ON events(date, user_name);
+CREATE INDEX IF NOT EXISTS idx_events_user_date ON events(user_name, date);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+MIGRATE_BATCH = 5000
+
+# 書き込み失敗時のやり直し回数と、1回目の待ち時間（倍々に延ばす）
+WRITE_RETRIES   = 3
+RETRY_DELAY_SEC = 0.5
+
+
+class AttendanceDB:
+    def __init__(self, path: str = "logs/attendance.db", durability: str = "flush",
+                 queue_size: int = 1024, max_batch: int = 256, on_error=None):
+        self.path      = path
+        self.max_batch = max_batch
+        self.on_error  = on_error   # 書き込めずに spill_path へ逃がしたとき、メッセージを渡して呼ぶ
+        self.spill_path = os.path.splitext(path)[0] + ".failed.csv"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # 読み出し用（問い合わせはロックで直列化、1件数ミリ秒なので十分）
+        self._read_lock = threading.Lock()
+        self._reader    = self._connect(durability)
+        self._reader.executescript(SCHEMA)
+
+        self._writer = self._connect(durability)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stats = {"written": 0, "batches": 0, "retried": 0, "failed": 0}
+
+        self._worker = threading.Thread(target=self._write_worker, name="attendance-db",
+                                        daemon=True)
+        self._worker.start()
+
+    def _connect(self, durability: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=" + ("FULL" if durability == "fsync" else "NORMAL"))
+        return conn
+
+    # ──────────────────────────────────────────
+    # 書き込み
+    # ──────────────────────────────────────────
+    def append(self, dt: datetime, user: str, action: str):
+        """キューに積んですぐ戻る（一杯のときだけ空くまで待つ）"""
+        self._queue.put((dt.strftime(TS_FORMAT), user, action, dt.strftime("%Y-%m-%d")))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """キューに積んだ分が書き終わるまで待つ"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """積んである分を書き切ってから書き込みスレッドを止め、両方の接続を閉じる"""
+        if not self._worker.is_alive():
+            return
+        self._queue.put(None)
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            print("[AttendanceDB] ⚠️ 書き込みスレッドが終わらないまま閉じます")
+            return
+        self._writer.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def _write_worker(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.task_done()
+                    stopping = True   # このバッチを書いてから止まる
+                    break
+                batch.append(item)
+            try:
+                self._insert(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _insert(self, batch: list[tuple]):
+        """バッチを INSERT する。やり直しても駄目なら spill_path に逃がす"""
+        delay = RETRY_DELAY_SEC
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                with self._writer:
+                    self._writer.executemany(
+                        "INSERT INTO events (ts, user_name, action, date) VALUES (?, ?, ?, ?)",
+                        batch)
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                return
+            except sqlite3.Error as e:
+                error = e
+                if attempt < WRITE_RETRIES:
+                    self.stats["retried"] += 1
+                    print(f"[AttendanceDB] 書き込み失敗 ({len(batch)} 件): {e} → {delay:.1f} 秒後にやり直し")
+                    time.sleep(delay)
+                    delay *= 2
+
+        self.stats["failed"] += len(batch)
+        try:
+            self._spill(batch)
+            message = (f"出退勤 DB に書き込めませんでした ({len(batch)} 件): {error}。"
+                       f"{self.spill_path} に退避し、次回起動時に取り込みます")
+        except OSError as e:
+            message = (f"出退勤 DB に書き込めず、{self.spill_path} への退避にも失敗しました "
+                       f"({len(batch)} 件): {error} / {e}")
+        print(f"[AttendanceDB] ⚠️ {message}")
+        if self.on_error is not None:
+            self.on_error(message)
+
+    def _spill(self, batch: list[tuple]):
+        """attendance.csv と同じ形式で追記する（migrate_csv() でそのまま取り込める）"""
+        new = not os.path.exists(self.spill_path)
+        with open(self.spill_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(["timestamp", "user_name", "action", "date"])
+            writer.writerows(batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ──────────────────────────────────────────
+    # CSV からの移行
+    # ──────────────────────────────────────────
+    def migrate_csv(self, csv_path: str) -> int:
+        """
+        CSV の未取り込み分を取り込む。
+        Returns:
+            取り込んだ件数
+        """
+        if not os.path.exists(csv_path):
+            return 0
+        key    = "csv_offset:" + os.path.abspath(csv_path)
+        offset = int(self._meta(key) or 0)
+        size   = os.path.getsize(csv_path)
+        if offset > size:
+            print(f"[AttendanceDB] ⚠️ CSV が取り込み時より小さくなっています。移行をスキップ: {csv_path}")
+            return 0
+        if offset == size:
+            return 0
+
+        self.flush()
+        imported = 0
+        with open(csv_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # 書きかけの最終行は次回に回す
+        end  = data.rfind(b"\n") + 1
+        rows, skipped = [], 0
+        # 切れたマルチバイト文字は置き換えて読み、その行だけ捨てる（残りの取り込みと
+        # オフセットの更新は止めない）
+        for row in csv.reader(data[:end].decode("utf-8", errors="replace").splitlines()):
+            if len(row) < 4 or row[0] == "timestamp":
+                continue
+            try:
+                datetime.strptime(row[0], TS_FORMAT)
+            except ValueError:
+                skipped += 1   # 日時が読めない行は取り込まない（読み出しで落ちないように）
+                continue
+            if any("\ufffd" in c for c in row[:4]):
+                skipped += 1   # 文字化けした行
+                continue
+            rows.append((row[0], row[1], row[2], row[3]))
+        if skipped:
+            print(f"[AttendanceDB] 壊れた行を {skipped} 件読み飛ばしました: {csv_path}")
+
+        with self._writer:
+            for i in range(0, len(rows), MIGRATE_BATCH):
+                self._writer.executemany(
+                    "INSERT INTO events (ts, user_name, action, date) VALUES (?, ?, ?, ?)",
+                    rows[i:i + MIGRATE_BATCH])
+                imported += len(rows[i:i + MIGRATE_BATCH])
+            self._writer.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(offset + end)))
+        if imported:
+            print(f"[AttendanceDB] CSV から {imported} 件を取り込みました: {csv_path}")
+        return imported
+
+    def _meta(self, key: str) -> str | None:
+        with self._read_lock:
+            row = self._reader.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # ──────────────────────────────────────────
+    # 問い合わせ
+    # ──────────────────────────────────────────
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _events(rows: list[tuple]) -> list[tuple[datetime, str, str]]:
+        return [(datetime.strptime(ts, TS_FORMAT), user, action) for ts, user, action in rows]
+
+    def events_on(self, day: date) -> list[tuple[datetime, str, str]]:
+        """指定日のイベント（時系列順）"""
+        return self._events(self._query(
+            "SELECT ts, user_name, action FROM events WHERE date = ? ORDER BY ts, id",
+            (str(day),)))
+
+    def user_events(self, user: str, start: date, end: date) -> list[tuple[datetime, str, str]]:
+        """ユーザーの start〜end（両端含む）のイベント"""
+        return self._events(self._query(
+            "SELECT ts, user_name, action FROM events "
+            "WHERE user_name = ? AND date BETWEEN ? AND ? ORDER BY ts, id",
+            (user, str(start), str(end))))
+
+    def events_between(self, start: date, end: date) -> list[tuple[datetime, str, str]]:
+        """start〜end（両端含む）の全員分のイベント"""
+        return self._events(self._query(
+            "SELECT ts, user_name, action FROM events "
+            "WHERE date BETWEEN ? AND ? ORDER BY ts, id",
+            (str(start), str(end))))
+
+    def inside_users(self, day: date) -> list[str]:
+        """指定日の最後のアクションが「+」のユーザー"""
+        # SQLite では MAX() と同じ行の他の列が返る
+        rows = self._query(
+            "SELECT user_name, action, MAX(ts) FROM events WHERE date = ? GROUP BY user_name",
+            (str(day),))
+        return sorted(user for user, action, _ in rows if action == "+")
+
+    def count(self) -> int:
+        return self._query("SELECT COUNT(*) FROM events")[0][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="出退勤ログ（SQLite）の移行・問い合わせ")
+    parser.add_argument("--db", default="logs/attendance.db")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("migrate", help="CSV の未取り込み分を取り込む")
+    p.add_argument("csv", nargs="?", default="logs/attendance.csv")
+    p = sub.add_parser("inside", help="入室中のユーザー")
+    p.add_argument("day", nargs="?", default=str(date.today()))
+    p = sub.add_parser("day", help="指定日のイベント")
+    p.add_argument("day")
+    p = sub.add_parser("user", help="ユーザーの期間内のイベント")
+    p.add_argument("user")
+    p.add_argument("start")
+    p.add_argument("end")
+    args = parser.parse_args()
+
+    db = AttendanceDB(args.db)
+    t0 = time.perf_counter()
+    if args.cmd == "migrate":
+        db.migrate_csv(args.csv)
+        print(f"合計 {db.count()} 件")
+    elif args.cmd == "inside":
+        for user in db.inside_users(date.fromisoformat(args.day)):
+            print(user)
+    else:
+        if args.cmd == "day":
+            events = db.events_on(date.fromisoformat(args.day))
+        else:
+            events = db.user_events(args.user, date.fromisoformat(args.start),
+                                    date.fromisoformat(args.end))
+        for dt, user, action in events:
+            print(f"{dt:%Y-%m-%d %H:%M:%S}  {action}  {user}")
+    print(f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
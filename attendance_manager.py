@@ -12,44 +12,321 @@
 修正内容:
     再起動時に当日分の CSV を読み込み、入退室状態を復元する。
     これにより再起動前の「+」記録が引き継がれ、二重入室を防ぐ。
+
+書き込み:
+    CSV は AttendanceLog が開きっぱなしにして追記する（毎回 open/close しない）。
+    ロックで複数カメラ・複数スレッドからの同時書き込みを直列化する。
+    durability でディスクへの反映タイミングを選ぶ:
+        "fsync"     1件ごとに flush + fsync（最も安全・最も遅い）
+        "flush"     1件ごとに flush、fsync は fsync_interval_sec ごと（既定）
+        "buffered"  flush / fsync とも fsync_interval_sec ごと
+
+インデックス:
+    当日（最後に記録した日）のイベント一覧だけをメモリに持ち、状態の問い合わせでは
+    ファイルを読まない。日付が変わると前日分は捨て、過去の日は DB / CSV から引く
+    （常駐しても増え続けない）。
+
+壊れた行:
+    書き込み途中の停電などで日時が読めない行・文字が途中で切れた（UTF-8 として読めない）行は、
+    起動時の復元・過去分の読み出しとも読み飛ばして件数をログに出す
+    （1行のために起動できなくならないように）。
+
+起動時の復元（当日分だけ読む）:
+    attendance.checkpoint.json に「当日の最初の行のバイト位置」を持ち、
+    そこから末尾までだけを読む。チェックポイントが無い・古い・壊れている
+    ときは CSV を末尾から逆向きに読み、前日以前の行に当たった所で止める。
+    どちらも CSV 全体の行数ではなく当日の件数に比例する。
+
+SQLite バックエンド（backend = "sqlite"）:
+    CSV の代わりに attendance_db.AttendanceDB に書く。起動時に CSV の
+    未取り込み分を移行し、当日分は (date, user_name) インデックスで読む。
+    過去の日付・ユーザー別の問い合わせ（events_on / user_events /
+    events_between）も DB で引くので、何年分あってもミリ秒で返る。
+    CSV バックエンドでの過去分の問い合わせは CSV を全件読む。
+
+集計（/api/attendance 用）:
+    記録のたびに AttendanceAggregates を差分更新する。今日より前で手元に無い日は
+    問い合わせられたときに DB / CSV から組み立て、cached_days 日分まで持っておく。
+    etag は記録のたびに増える version と今日の日付から作る（日付が変われば
+    「今日」の応答も変わるため）。
 """
 
 import csv
+import json
+import os
+import threading
+import time
 from datetime import datetime, date
 from pathlib import Path
 
+import metrics
+from attendance_db import AttendanceDB
+from attendance_stats import AttendanceAggregates
+
+HEADER = ["timestamp", "user_name", "action", "date"]
+
+DURABILITY_MODES = ("fsync", "flush", "buffered")
+
+BACKENDS = ("csv", "sqlite")
+
+WRITE_SECONDS = metrics.histogram("attendance_write_seconds",
+                                  "出退勤1件の記録にかかった時間（SQLite はキュー投入まで）",
+                                  labels=("backend",))
+
+TAIL_BLOCK = 64 * 1024   # 逆向きに読むときの1回の読み込みサイズ
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _parse_row(timestamp: str, user: str, action: str) -> tuple[datetime, str, str] | None:
+    """
+    CSV の1行を (datetime, user, action) に。日時が読めない行・文字化けした行
+    （errors="replace" で読んだ U+FFFD を含む）は None
+    """
+    if "\ufffd" in (user or "") or "\ufffd" in (action or ""):
+        return None
+    try:
+        return datetime.strptime(timestamp, TIME_FORMAT), user, action
+    except (TypeError, ValueError):
+        return None
+
+
+class AttendanceLog:
+    """attendance.csv への追記専用ライター"""
+
+    def __init__(self, path: Path, durability: str = "flush", fsync_interval_sec: float = 5.0):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability は {DURABILITY_MODES} のいずれか: {durability}")
+        self.path = path
+        self.durability = durability
+        self.fsync_interval_sec = fsync_interval_sec
+
+        self._lock  = threading.Lock()
+        self._dirty = False   # flush / fsync 待ちのデータがあるか
+        new_file = not path.exists() or path.stat().st_size == 0
+        self._f = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._f)
+        if new_file:
+            self._writer.writerow(HEADER)
+            self._sync(fsync=True)
+
+        if durability != "fsync":
+            threading.Thread(target=self._sync_worker, name="attendance-sync",
+                             daemon=True).start()
+
+    def append(self, dt: datetime, user: str, action: str):
+        with self._lock:
+            self._writer.writerow([
+                dt.strftime(TIME_FORMAT),
+                user, action,
+                dt.strftime("%Y-%m-%d")
+            ])
+            if self.durability == "fsync":
+                self._sync(fsync=True)
+            elif self.durability == "flush":
+                self._f.flush()
+                self._dirty = True
+            else:
+                self._dirty = True
+
+    def size(self) -> int:
+        """書き込み済みのバイト数（バッファ分も flush してから数える）"""
+        with self._lock:
+            self._f.flush()
+            return os.fstat(self._f.fileno()).st_size
+
+    def flush(self):
+        """溜まっている分を fsync まで行う"""
+        with self._lock:
+            if self._dirty:
+                self._sync(fsync=True)
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._sync(fsync=True)
+                self._f.close()
+
+    def _sync(self, fsync: bool):
+        self._f.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+        self._dirty = False
+
+    def _sync_worker(self):
+        while not self._f.closed:
+            time.sleep(self.fsync_interval_sec)
+            try:
+                self.flush()
+            except (OSError, ValueError) as e:
+                print(f"[Attendance] fsync 失敗: {e}")
+
 
 class AttendanceManager:
-    def __init__(self, log_csv: str = "logs/attendance.csv"):
+    def __init__(self, log_csv: str = "logs/attendance.csv",
+                 durability: str = "flush", fsync_interval_sec: float = 5.0,
+                 backend: str = "csv", db_path: str = "logs/attendance.db",
+                 cached_days: int = 90, on_error=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend は {BACKENDS} のいずれか: {backend}")
         self.log_path = Path(log_csv)
         self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
         self._state: dict[str, dict] = {}
-        self._ensure_header()
-        self._restore_state_from_log()  # 再起動時に状態を復元
+        # 日付 → [(datetime, user, action), ...]（時系列順。最後に記録した日だけ持つ）
+        self._events: dict[date, list[tuple[datetime, str, str]]] = {}
+        self.aggregates  = AttendanceAggregates(max_past_days=cached_days)
+        self.version     = 0
+        self._boot_id    = f"{time.time_ns():x}"
+        self.checkpoint_path = self.log_path.with_name(self.log_path.stem + ".checkpoint.json")
+        self._day_start: tuple[date, int] | None = None   # (日付, その日の最初の行の位置)
 
-    def _ensure_header(self):
-        if not self.log_path.exists():
-            with open(self.log_path, "w", newline="", encoding="utf-8") as f:
-                csv.writer(f).writerow(["timestamp", "user_name", "action", "date"])
+        self.backend = backend
+        self.db: AttendanceDB | None = None
+        if backend == "sqlite":
+            self.db = AttendanceDB(db_path, durability, on_error=on_error)
+            self.db.migrate_csv(str(self.log_path))
+            self.db.migrate_csv(self.db.spill_path)   # 前回書き込めずに退避した分
+            self._restore_state_from_db()
+            self._log = self.db
+        else:
+            self._restore_state_from_log()  # 再起動時に状態を復元
+            self._log = AttendanceLog(self.log_path, durability, fsync_interval_sec)
+            self._save_checkpoint()
+
+    def _restore_state_from_db(self):
+        events = self.db.events_on(date.today())
+        for dt, user, action in events:
+            self._apply(dt, user, action)
+        print(f"[Attendance] 当日分 {len(events)} 件から状態を復元しました (SQLite)")
 
     def _restore_state_from_log(self):
         """
-        起動時に CSV を読み込み、当日分の最後のアクションで状態を復元する。
+        起動時に CSV の当日分だけを読み、最後のアクションで状態を復元する。
         + → entered: True
         - → entered: False
         """
         if not self.log_path.exists():
             return
         today = date.today()
-        with open(self.log_path, "r", encoding="utf-8") as f:
-            for row in csv.DictReader(f):
-                if row["date"] != str(today):
-                    continue
-                user = row["user_name"]
-                if user not in self._state or self._state[user]["date"] != today:
-                    self._state[user] = {"date": today, "entered": False}
-                # 最後のアクションで上書き（CSV は時系列順を前提）
-                self._state[user]["entered"] = (row["action"] == "+")
+        rows = self._rows_from_checkpoint(today)
+        if rows is None:
+            rows = self._tail_scan(today)
+        skipped = 0
+        for row in rows:
+            event = _parse_row(row[0], row[1], row[2])
+            if event is None:
+                skipped += 1
+                continue
+            self._apply(*event)
+        print(f"[Attendance] 当日分 {len(rows) - skipped} 件から状態を復元しました")
+        if skipped:
+            print(f"[Attendance] 壊れた行を {skipped} 件読み飛ばしました")
+
+    def _rows_from_checkpoint(self, today: date) -> list[list[str]] | None:
+        """チェックポイントの位置から末尾までを読む。使えなければ None"""
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                cp = json.load(f)
+            if cp["date"] != str(today):
+                return None
+            offset = int(cp["offset"])
+            with open(self.log_path, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                if offset > size:
+                    return None   # CSV が差し替えられた
+                if offset > 0:
+                    f.seek(offset - 1)
+                    if f.read(1) != b"\n":
+                        return None
+                f.seek(offset)
+                data = f.read()
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        # 書きかけで切れたマルチバイト文字があっても落ちないよう置き換えて読む（行は復元で捨てる）
+        rows = [r for r in csv.reader(data.decode("utf-8", errors="replace").splitlines())
+                if len(r) >= 4 and r != HEADER]
+        if rows and rows[0][3] != str(today):
+            return None
+        self._day_start = (today, offset)
+        return [r for r in rows if r[3] == str(today)]
+
+    def _tail_scan(self, today: date) -> list[list[str]]:
+        """
+        CSV を末尾からブロック単位で逆向きに読み、当日の行を集める。
+        前日以前の行に当たったら止める（CSV は時系列順に追記される前提）。
+        """
+        today_str = str(today)
+        rows: list[list[str]] = []
+        with open(self.log_path, "rb") as f:
+            end = pos = f.seek(0, os.SEEK_END)
+            start = end       # 当日の最初の行の位置（当日分が無ければ末尾）
+            rest = b""
+            while True:
+                step = min(TAIL_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                buf   = f.read(step) + rest
+                lines = buf.split(b"\n")
+                # 先頭の1行は途中から始まっている可能性があるので次の読み込みに回す
+                rest  = lines.pop(0) if pos > 0 else b""
+                cursor = pos + len(buf)
+                for line in reversed(lines):
+                    line_start = cursor - len(line)
+                    cursor = line_start - 1
+                    row = next(csv.reader([line.decode("utf-8", errors="replace").strip()]), None)
+                    if not row or len(row) < 4 or row == HEADER:
+                        continue
+                    if row[3] == today_str:
+                        rows.append(row)   # 壊れていれば復元で読み飛ばす
+                        start = line_start
+                    elif row[3] < today_str and row[0].startswith(row[3]) \
+                            and _parse_row(row[0], row[1], row[2]) is not None:
+                        # 前日以前の（壊れていない）行 → ここまでが当日分
+                        self._day_start = (today, start)
+                        rows.reverse()
+                        return rows
+                if pos == 0:
+                    break
+        self._day_start = (today, start)
+        rows.reverse()
+        return rows
+
+    def _save_checkpoint(self):
+        """当日の開始位置と入室中ユーザーを書き出す（一時ファイル経由で置き換え）"""
+        if self._day_start is None:
+            return
+        day, offset = self._day_start
+        data = {
+            "date":    str(day),
+            "offset":  offset,
+            "inside":  self.inside_users(),
+            "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.checkpoint_path)
+        except OSError as e:
+            print(f"[Attendance] チェックポイント保存失敗: {e}")
+
+    def _apply(self, dt: datetime, user: str, action: str):
+        """イベントを状態とインデックスに反映する（CSV は時系列順を前提）"""
+        day = dt.date()
+        if day not in self._events:
+            # 新しい日になった → それより前の日は捨てる（過去分は DB / CSV から引く）
+            for old in [d for d in self._events if d < day]:
+                del self._events[old]
+        self._events.setdefault(day, []).append((dt, user, action))
+        self.aggregates.apply(dt, user, action)
+        self.version += 1
+        s = self._state.get(user)
+        if s is None or s["date"] != day:
+            s = self._state[user] = {"date": day, "entered": False}
+        # 最後のアクションで上書き
+        s["entered"] = (action == "+")
 
     def _get_state(self, user: str) -> dict:
         today = date.today()
@@ -58,33 +335,147 @@ class AttendanceManager:
             self._state[user] = {"date": today, "entered": False}
         return self._state[user]
 
-    def _write_log(self, dt: datetime, user: str, action: str):
-        with open(self.log_path, "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([
-                dt.strftime("%Y-%m-%d %H:%M:%S"),
-                user, action,
-                dt.strftime("%Y-%m-%d")
-            ])
+    def _record(self, user: str, action: str) -> datetime:
+        with self._lock:
+            self._get_state(user)
+            now = datetime.now()
+            new_day = self.db is None and (self._day_start is None
+                                           or self._day_start[0] != now.date())
+            if new_day:
+                # 日付が変わった最初の1件 → ここからが当日分
+                self._day_start = (now.date(), self._log.size())
+            self._apply(now, user, action)
+            with WRITE_SECONDS.time(backend=self.backend):
+                self._log.append(now, user, action)
+            if new_day:
+                self._save_checkpoint()
+            return now
 
     def check_action(self, user: str) -> str:
         """
         "entry"        → 当日初回（自動入室）
         "exit_confirm" → 2回目以降（ダイアログ確認が必要）
         """
-        return "entry" if not self._get_state(user)["entered"] else "exit_confirm"
+        with self._lock:
+            return "entry" if not self._get_state(user)["entered"] else "exit_confirm"
 
     def record_entry(self, user: str) -> datetime:
-        self._get_state(user)["entered"] = True
-        now = datetime.now()
-        self._write_log(now, user, "+")
-        return now
+        return self._record(user, "+")
 
     def record_exit(self, user: str) -> datetime:
         """退室記録 + 状態リセット（当日中の再入室に対応）"""
-        self._get_state(user)["entered"] = False
-        now = datetime.now()
-        self._write_log(now, user, "-")
-        return now
+        return self._record(user, "-")
 
     def is_inside(self, user: str) -> bool:
-        return self._get_state(user)["entered"]
+        with self._lock:
+            return self._get_state(user)["entered"]
+
+    def inside_users(self) -> list[str]:
+        """現在入室中のユーザー"""
+        today = date.today()
+        with self._lock:
+            return sorted(u for u, s in self._state.items()
+                          if s["date"] == today and s["entered"])
+
+    def events_on(self, day: date | None = None) -> list[tuple[datetime, str, str]]:
+        """
+        指定日（既定は今日）のイベント一覧。
+        メモリに持っている当日分はそこから、それ以外は DB / CSV から読む。
+        """
+        day = day or date.today()
+        with self._lock:
+            if day in self._events:
+                return list(self._events[day])
+        return self.events_between(day, day)
+
+    def events_between(self, start: date, end: date) -> list[tuple[datetime, str, str]]:
+        """start〜end（両端含む）の全員分のイベント（時系列順）"""
+        if self.db is not None:
+            self.db.flush()
+            return self.db.events_between(start, end)
+        return self._scan_csv(start, end)
+
+    def user_events(self, user: str, start: date, end: date) -> list[tuple[datetime, str, str]]:
+        """ユーザーの start〜end（両端含む）のイベント（時系列順）"""
+        if self.db is not None:
+            self.db.flush()
+            return self.db.user_events(user, start, end)
+        return self._scan_csv(start, end, user)
+
+    def _scan_csv(self, start: date, end: date,
+                  user: str | None = None) -> list[tuple[datetime, str, str]]:
+        """CSV を先頭から全件読む（CSV バックエンドで過去分を引くとき用）"""
+        self._log.flush()
+        lo, hi = str(start), str(end)
+        events, skipped = [], 0
+        # 壊れたバイトがあっても全体は読めるよう置き換えて読み、その行は _parse_row で捨てる
+        with open(self.log_path, "r", encoding="utf-8", errors="replace", newline="") as f:
+            for row in csv.DictReader(f):
+                if not (lo <= (row["date"] or "") <= hi):
+                    continue
+                if user is not None and row["user_name"] != user:
+                    continue
+                event = _parse_row(row["timestamp"], row["user_name"], row["action"])
+                if event is None:
+                    skipped += 1
+                    continue
+                events.append(event)
+        if skipped:
+            print(f"[Attendance] 壊れた行を {skipped} 件読み飛ばしました ({lo}〜{hi})")
+        return events
+
+    # ──────────────────────────────────────────
+    # 集計
+    # ──────────────────────────────────────────
+    @property
+    def etag(self) -> str:
+        """記録が増えるたびに変わる値（再起動・日付の変わり目でも変わる）"""
+        return f"{self._boot_id}-{self.version}-{date.today():%Y%m%d}"
+
+    def occupancy(self) -> list[dict]:
+        """入室中のユーザーと入室時刻"""
+        with self._lock:
+            return [{"name": u["name"], "since": u["inside_since"]}
+                    for u in self.aggregates.users_on(date.today()) if u["inside_since"]]
+
+    def dwell_on(self, day: date) -> list[dict]:
+        """指定日のユーザーごとの在室時間など（名前順）"""
+        self._ensure_days([day])
+        with self._lock:
+            return self.aggregates.users_on(day)
+
+    def day_summaries(self, days: list[date]) -> list[dict]:
+        """指定した日それぞれのサマリー"""
+        self._ensure_days(days)
+        with self._lock:
+            return [self.aggregates.summary(d) for d in days]
+
+    def _ensure_days(self, days: list[date]):
+        """
+        今日より前の日で手元に無いものを、まとめて1回の読み出しで組み立てる。
+        今日の分は記録のたびに集計済み。持ちすぎた過去の日はここで捨てる。
+        """
+        today = date.today()
+        with self._lock:
+            self.aggregates.touch(days)
+            missing = [d for d in days if d < today and not self.aggregates.has_day(d)]
+        if not missing:
+            return
+        # 読み出しはロックの外で（CSV 全件読みの間も記録を止めない）
+        by_day: dict[date, list] = {d: [] for d in missing}
+        for ev in self.events_between(min(missing), max(missing)):
+            if ev[0].date() in by_day:
+                by_day[ev[0].date()].append(ev)
+        with self._lock:
+            for d, events in by_day.items():
+                if not self.aggregates.has_day(d):
+                    self.aggregates.load_day(d, events)
+            self.aggregates.trim(today, keep=set(days))
+
+    def flush(self):
+        self._log.flush()
+
+    def close(self):
+        self._log.close()
+        with self._lock:
+            self._save_checkpoint()
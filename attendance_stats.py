@@ -0,0 +1,107 @@
+"""
+出退勤の集計（在室時間・日別サマリー）
+
+AttendanceManager がイベントを記録するたびに apply() で差分だけ更新する。
+ログ全体から数え直さないので、ダッシュボードが頻繁に問い合わせても軽い。
+
+ユーザー × 日ごとに持つ値:
+    first_in / last_out   その日の最初の入室・最後の退室
+    entries / exits       入室・退室の回数
+    dwell_sec             退室で閉じた在室時間の合計（秒）
+    inside_since          入室中ならその入室時刻（まだ dwell_sec には含めない）
+
+在室中の時間は問い合わせ時刻で変わるため dwell_sec には足さず、
+inside_since を返してクライアント側で足してもらう。こうすると
+同じデータなら同じ応答になり、ETag でキャッシュできる。
+
+今日より前の日は max_past_days 日分だけ持ち、それを超えたら最後に
+問い合わせられたのが古い日から捨てる（捨てた日は次の問い合わせで組み立て直す）。
+"""
+
+import itertools
+from datetime import date, datetime
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _fmt(dt: datetime | None) -> str | None:
+    return dt.strftime(TS_FORMAT) if dt else None
+
+
+class AttendanceAggregates:
+    def __init__(self, max_past_days: int = 90):
+        # 日付 → ユーザー → 集計
+        self._days: dict[date, dict[str, dict]] = {}
+        self.max_past_days = max_past_days
+        self._used: dict[date, int] = {}        # 日付 → 最後に問い合わせられた順番
+        self._clock = itertools.count()
+
+    def has_day(self, day: date) -> bool:
+        return day in self._days
+
+    def apply(self, dt: datetime, user: str, action: str):
+        """1件分を反映する（時系列順に呼ぶこと）"""
+        users = self._days.setdefault(dt.date(), {})
+        u = users.get(user)
+        if u is None:
+            u = users[user] = {"first_in": None, "last_out": None, "entries": 0,
+                               "exits": 0, "dwell_sec": 0.0, "inside_since": None}
+        if action == "+":
+            u["entries"] += 1
+            if u["first_in"] is None:
+                u["first_in"] = dt
+            if u["inside_since"] is None:
+                u["inside_since"] = dt
+        else:
+            u["exits"] += 1
+            u["last_out"] = dt
+            if u["inside_since"] is not None:
+                u["dwell_sec"] += (dt - u["inside_since"]).total_seconds()
+                u["inside_since"] = None
+
+    def load_day(self, day: date, events: list[tuple[datetime, str, str]]):
+        """過去の日を（1回だけ）イベント一覧から組み立てる"""
+        self._days[day] = {}
+        for dt, user, action in events:
+            self.apply(dt, user, action)
+
+    def touch(self, days: list[date]):
+        """問い合わせられた日を新しい順に記録する（trim で最後まで残る）"""
+        for d in days:
+            self._used[d] = next(self._clock)
+
+    def trim(self, today: date, keep: set[date] = frozenset()):
+        """今日より前の日が max_past_days を超えていれば、使われていない日から捨てる"""
+        past = [d for d in self._days if d < today]
+        overflow = len(past) - self.max_past_days
+        if overflow <= 0:
+            return
+        # 今回の問い合わせで使う日は残す（ページが max_past_days より長くても返せるように）
+        evictable = sorted((d for d in past if d not in keep), key=lambda d: self._used.get(d, -1))
+        for d in evictable[:overflow]:
+            del self._days[d]
+            self._used.pop(d, None)
+
+    def users_on(self, day: date) -> list[dict]:
+        """ユーザーごとの集計（名前順）"""
+        users = self._days.get(day, {})
+        return [{
+            "name":         name,
+            "first_in":     _fmt(u["first_in"]),
+            "last_out":     _fmt(u["last_out"]),
+            "entries":      u["entries"],
+            "exits":        u["exits"],
+            "dwell_sec":    round(u["dwell_sec"]),
+            "inside_since": _fmt(u["inside_since"]),
+        } for name, u in sorted(users.items())]
+
+    def summary(self, day: date) -> dict:
+        users = self._days.get(day, {}).values()
+        return {
+            "date":      str(day),
+            "users":     len(users),
+            "entries":   sum(u["entries"] for u in users),
+            "exits":     sum(u["exits"] for u in users),
+            "dwell_sec": round(sum(u["dwell_sec"] for u in users)),
+            "inside":    sum(1 for u in users if u["inside_since"] is not None),
+        }
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+顔検出バックエンドのベンチマーク（CLI）
+
+登録用フォルダの画像で各バックエンドの速度と、HOG との一致度を比べる。
+拠点ごとに「十分に一致する中で最速の検出器」を選ぶ目安にする。
+
+使い方:
+    python bench_detectors.py
+    python bench_detectors.py --faces-dir ~/new_faces --backends hog_gray,haar
+    python bench_detectors.py --json bench_detectors.json
+
+指標:
+    avg_ms / p95_ms  1枚あたりの検出時間
+    count_agree      顔の数が HOG と同じだった画像の割合
+    recall           HOG の顔枠のうち IoU >= 0.5 で見つかった割合
+    precision        検出した顔枠のうち HOG の顔枠と IoU >= 0.5 で一致した割合
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from config import Config
+from face_detectors import BACKENDS, make_detector
+
+IOU_MATCH = 0.5
+
+
+def iou(a: tuple, b: tuple) -> float:
+    top, right    = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left  = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area  = lambda r: (r[2] - r[0]) * (r[1] - r[3])
+    union = area(a) + area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def count_matches(ref: list[tuple], locs: list[tuple]) -> int:
+    """IoU の大きい順に1対1で対応付けた数"""
+    pairs = sorted(((iou(r, l), i, j) for i, r in enumerate(ref) for j, l in enumerate(locs)),
+                   reverse=True)
+    used_r, used_l, matched = set(), set(), 0
+    for score, i, j in pairs:
+        if score < IOU_MATCH:
+            break
+        if i in used_r or j in used_l:
+            continue
+        used_r.add(i)
+        used_l.add(j)
+        matched += 1
+    return matched
+
+
+def main():
+    cfg = Config("config.json").get("detector")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces-dir", default=os.path.expanduser("~/new_faces"))
+    parser.add_argument("--backends",  default=",".join(BACKENDS))
+    parser.add_argument("--json",      default="", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    paths  = sorted(glob.glob(os.path.join(args.faces_dir, "*", "*.jpg")))
+    images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    if not images:
+        print(f"❌ 画像が見つかりません: {args.faces_dir}")
+        sys.exit(1)
+
+    detectors = {}
+    for name in args.backends.split(","):
+        try:
+            detectors[name] = make_detector(**{**cfg, "backend": name})
+        except (ValueError, FileNotFoundError) as e:
+            print(f"⚠  {name}: スキップ（{e}）")
+    reference = make_detector(**{**cfg, "backend": "hog"})
+
+    print(f"📂 {args.faces_dir}: {len(images)} 枚\n")
+    ref_locs = [reference.detect(img) for img in images]
+
+    results = {}
+    for name, det in detectors.items():
+        times, agree, matched, n_ref, n_found = [], 0, 0, 0, 0
+        for img, ref in zip(images, ref_locs):
+            locs = det.detect(img)
+            times.append(det.last_sec * 1000)
+            agree   += len(locs) == len(ref)
+            matched += count_matches(ref, locs)
+            n_ref   += len(ref)
+            n_found += len(locs)
+        results[name] = {
+            "avg_ms":      round(float(np.mean(times)), 2),
+            "p95_ms":      round(float(np.percentile(times, 95)), 2),
+            "count_agree": round(agree / len(images), 3),
+            "recall":      round(matched / max(n_ref, 1), 3),
+            "precision":   round(matched / max(n_found, 1), 3),
+        }
+
+    print(f"{'backend':10} {'avg_ms':>8} {'p95_ms':>8} {'count':>7} {'recall':>7} {'prec':>7}")
+    print("─" * 52)
+    for name, r in results.items():
+        print(f"{name:10} {r['avg_ms']:8.2f} {r['p95_ms']:8.2f} "
+              f"{r['count_agree']:7.3f} {r['recall']:7.3f} {r['precision']:7.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": len(images), "results": results}, f, indent=2)
+        print(f"\n💾 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
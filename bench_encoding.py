@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+エンコード設定（プロファイル）のベンチマーク（CLI）
+
+登録用フォルダの画像を各プロファイルでエンコードし、
+1枚あたりの処理時間と照合精度を比べる。
+
+使い方:
+    python bench_encoding.py
+    python bench_encoding.py --profiles large:1,small:1,large:10
+    python bench_encoding.py --faces-dir ~/new_faces --tolerance 0.45 --json bench_encoding.json
+
+プロファイル:
+    "<landmark model>:<num_jitters>"  例) small:1, large:10
+
+指標:
+    avg_ms / p95_ms  1顔あたりのエンコード時間
+    rank1            自分以外の全画像の中で最も近い画像が本人だった割合
+    tar              本人同士のペアで距離 <= tolerance の割合（本人受入率）
+    far              他人同士のペアで距離 <= tolerance の割合（他人受入率）
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+from encode_faces import load_config
+from face_detectors import make_detector
+
+
+def parse_profiles(text: str) -> list[dict]:
+    profiles = []
+    for item in text.split(","):
+        model, _, jitters = item.partition(":")
+        profiles.append({"model": model, "num_jitters": int(jitters or 1)})
+    return profiles
+
+
+def evaluate(encs: np.ndarray, labels: np.ndarray, tolerance: float) -> dict:
+    dist = np.linalg.norm(encs[:, None, :] - encs[None, :, :], axis=2)
+    same = labels[:, None] == labels[None, :]
+    off  = ~np.eye(len(labels), dtype=bool)
+
+    genuine  = dist[same & off]
+    impostor = dist[~same]
+
+    np.fill_diagonal(dist, np.inf)
+    # 本人の画像が他にもある画像だけで rank1 を数える
+    has_pair = (same & off).any(axis=1)
+    nearest  = np.argmin(dist, axis=1)
+    rank1    = (labels[nearest] == labels)[has_pair]
+
+    return {
+        "rank1": round(float(rank1.mean()), 4) if rank1.size else None,
+        "tar":   round(float((genuine  <= tolerance).mean()), 4) if genuine.size  else None,
+        "far":   round(float((impostor <= tolerance).mean()), 4) if impostor.size else None,
+        "genuine_mean":  round(float(genuine.mean()), 4)  if genuine.size  else None,
+        "impostor_mean": round(float(impostor.mean()), 4) if impostor.size else None,
+    }
+
+
+def main():
+    cfg = load_config()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces-dir", default=os.path.expanduser("~/new_faces"))
+    parser.add_argument("--profiles",  default="large:1,small:1,large:10")
+    parser.add_argument("--tolerance", type=float,
+                        default=cfg.get("settings", {}).get("face_tolerance", 0.5))
+    parser.add_argument("--json",      default="", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    detector = make_detector(**cfg.get("detector", {}))
+    samples  = []
+    for path in sorted(glob.glob(os.path.join(args.faces_dir, "*", "*.jpg"))):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        locs = detector.detect(img)
+        if len(locs) != 1:
+            continue
+        person = os.path.basename(os.path.dirname(path))
+        samples.append((person, cv2.cvtColor(img, cv2.COLOR_BGR2RGB), locs))
+
+    if len({p for p, _, _ in samples}) < 2:
+        print(f"❌ 顔が1つだけ写った画像が2人分以上必要です: {args.faces_dir}")
+        sys.exit(1)
+
+    labels = np.array([p for p, _, _ in samples])
+    print(f"📂 {args.faces_dir}: {len(samples)} 枚 / {len(set(labels))} 人 "
+          f"(tolerance={args.tolerance})\n")
+
+    results = {}
+    for profile in parse_profiles(args.profiles):
+        key = f"{profile['model']}:{profile['num_jitters']}"
+        times, encs = [], []
+        for _, rgb, locs in samples:
+            t0 = time.perf_counter()
+            enc = face_recognition.face_encodings(
+                rgb, locs, num_jitters=profile["num_jitters"], model=profile["model"])[0]
+            times.append((time.perf_counter() - t0) * 1000)
+            encs.append(enc)
+        results[key] = {
+            "avg_ms": round(float(np.mean(times)), 2),
+            "p95_ms": round(float(np.percentile(times, 95)), 2),
+            **evaluate(np.array(encs), labels, args.tolerance),
+        }
+
+    print(f"{'profile':10} {'avg_ms':>8} {'p95_ms':>8} {'rank1':>7} {'tar':>7} {'far':>7}")
+    print("─" * 52)
+    fmt = lambda v: f"{v:7.4f}" if v is not None else f"{'—':>7}"
+    for key, r in results.items():
+        print(f"{key:10} {r['avg_ms']:8.2f} {r['p95_ms']:8.2f} "
+              f"{fmt(r['rank1'])} {fmt(r['tar'])} {fmt(r['far'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": len(samples), "tolerance": args.tolerance,
+                       "results": results}, f, indent=2)
+        print(f"\n💾 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+認識・登録ホットパスのベンチマーク（CLI、オフライン）
+
+FaceEngine / encode_faces.py / check_faces.py を変更したときに、
+速くなったか遅くなったかを同じ条件で測って比べるためのもの。
+カメラもネットワークも使わない。
+
+スイート:
+    match    乱数で作った登録データ（--gallery-sizes 件）に対する照合
+             （FaceEngine.match、seed 固定なので毎回同じデータ）
+    frames   録画済みフレーム（--frames-dir の jpg / png）の検出〜照合
+             （FaceEngine.recognize_detail、段階別の時間も出す）
+    enroll   登録用フォルダ（--faces-dir）のエンコード（encode_faces.encode_image）と
+             チェック（check_faces.check_image）
+
+各スイートは別プロセスで動かし、そのプロセスのピーク RSS もスイート単位で記録する
+（ピーク RSS はプロセスで1つの値なので、match[1000] などの項目ごとには出さない）。
+
+使い方:
+    python benchmark.py --suites match --gallery-sizes 1000,10000,100000
+    python benchmark.py --frames-dir bench/frames --faces-dir bench/faces --json baseline.json
+    python benchmark.py --frames-dir bench/frames --compare baseline.json --threshold 0.1
+
+出力（JSON）:
+    {"meta": {...}, "results": {"match[10000]": {"n", "throughput_per_s",
+     "mean_ms", "p50_ms", "p95_ms", "p99_ms", ...}, ...},
+     "peak_rss_mb": {"match": 312.4, ...}}
+
+比較:
+    --compare のベースラインと共通の項目について、
+        p50 / p95 / p99 / スイートの peak_rss_mb が (1 + threshold) 倍を超えた
+        throughput_per_s が (1 - threshold) 倍を下回った
+    ものを回帰として表示し、1つでもあれば終了コード 1 で終わる。
+"""
+
+import argparse
+import glob
+import json
+import os
+import pickle
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+SUITES = ("match", "frames", "enroll")
+
+# 大きいほど悪い指標 / 小さいほど悪い指標
+LOWER_IS_BETTER  = ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput_per_s",)
+
+
+def summarize(times_sec: list[float], wall_sec: float | None = None) -> dict:
+    ms = np.asarray(times_sec) * 1000
+    wall = wall_sec if wall_sec is not None else float(np.sum(times_sec))
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "n":                len(ms),
+        "throughput_per_s": round(len(ms) / wall, 2) if wall > 0 else None,
+        "mean_ms":          round(float(ms.mean()), 3),
+        "p50_ms":           round(float(p50), 3),
+        "p95_ms":           round(float(p95), 3),
+        "p99_ms":           round(float(p99), 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    # Linux では KB、macOS ではバイト
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def synthetic_gallery(size: int, people: int, seed: int) -> tuple[list[str], np.ndarray]:
+    """
+    実際の 128 次元特徴に近い分布（人ごとの中心 + 小さなばらつき）の登録データ。
+    中心同士の距離は 0.9 前後、同一人物内は 0.35 前後になる。
+    """
+    rng     = np.random.default_rng(seed)
+    people  = max(1, min(people, size))
+    centers = rng.normal(0, 0.056, (people, 128))
+    owner   = np.arange(size) % people
+    encs    = centers[owner] + rng.normal(0, 0.022, (size, 128))
+    return [f"p{i:05d}" for i in owner], encs
+
+
+def _write_pkl(path: str, names: list[str], encs: np.ndarray):
+    with open(path, "wb") as f:
+        pickle.dump({"names": names, "encodings": list(encs),
+                     "profile": {"model": "large", "num_jitters": 1}}, f)
+
+
+# ──────────────────────────────────────────
+# スイート本体（子プロセスで動く）
+# ──────────────────────────────────────────
+def run_match(args) -> dict:
+    from face_engine import FaceEngine
+
+    results = {}
+    rng = np.random.default_rng(args.seed + 1)
+    for size in [int(s) for s in args.gallery_sizes.split(",")]:
+        names, encs = synthetic_gallery(size, args.people, args.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            pkl = os.path.join(tmp, "encodings.pkl")
+            _write_pkl(pkl, names, encs)
+            engine = FaceEngine(pkl_path=pkl, tolerance=args.tolerance)
+
+        # 半分は登録済みの人（近くに散らしたもの）、半分は未登録
+        picks   = rng.integers(0, size, args.queries)
+        queries = encs[picks] + rng.normal(0, 0.022, (args.queries, 128))
+        queries[args.queries // 2:] = rng.normal(0, 0.056, (args.queries - args.queries // 2, 128))
+
+        for q in queries[:args.warmup]:
+            engine.match(q)
+        times = []
+        t_all = time.perf_counter()
+        for q in queries:
+            t0 = time.perf_counter()
+            engine.match(q)
+            times.append(time.perf_counter() - t0)
+        results[f"match[{size}]"] = summarize(times, time.perf_counter() - t_all)
+    return results
+
+
+def _load_images(directory: str, patterns: tuple[str, ...]) -> list[tuple[str, np.ndarray]]:
+    import cv2
+    paths = sorted(p for pat in patterns for p in glob.glob(os.path.join(directory, pat)))
+    images = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is not None:
+            images.append((path, img))
+    return images
+
+
+def run_frames(args) -> dict:
+    from encode_faces import load_config, load_pkl_path
+    from face_engine import FaceEngine, encoding_profile
+
+    frames = _load_images(args.frames_dir, ("*.jpg", "*.png"))
+    if not frames:
+        raise SystemExit(f"❌ フレームが見つかりません: {args.frames_dir}")
+
+    cfg = load_config()
+    with tempfile.TemporaryDirectory() as tmp:
+        pkl = os.path.expanduser(args.pkl or load_pkl_path(cfg))
+        if not os.path.exists(pkl):
+            # 登録データが無ければ合成データで照合まで通す
+            pkl = os.path.join(tmp, "encodings.pkl")
+            _write_pkl(pkl, *synthetic_gallery(args.frames_gallery, args.people, args.seed))
+        engine = FaceEngine(pkl_path=pkl, tolerance=args.tolerance,
+                            quality=cfg.get("quality"), detector=cfg.get("detector"),
+                            encoding=encoding_profile(cfg.get("encoding"), "live"))
+
+    for _, img in frames[:args.warmup]:
+        engine.recognize_detail(img)
+
+    times, stages, faces = [], {}, 0
+    t_all = time.perf_counter()
+    for _ in range(args.repeat):
+        for _, img in frames:
+            t0 = time.perf_counter()
+            result = engine.recognize_detail(img)
+            times.append(time.perf_counter() - t0)
+            faces += result.location is not None
+            for stage, sec in result.timings.items():
+                stages.setdefault(stage, []).append(sec)
+    wall = time.perf_counter() - t_all
+
+    results = {"frames": {**summarize(times, wall), "frames": len(frames),
+                          "face_rate": round(faces / len(times), 3)}}
+    for stage, values in stages.items():
+        results[f"frames.{stage}"] = summarize(values)
+    return results
+
+
+def run_enroll(args) -> dict:
+    from check_faces import check_image
+    from encode_faces import encode_image, load_config
+    from face_detectors import make_detector
+    from face_engine import encoding_profile
+
+    images = _load_images(args.faces_dir, ("*/*.jpg",))
+    if not images:
+        raise SystemExit(f"❌ 登録用の画像が見つかりません: {args.faces_dir}/<人物>/*.jpg")
+
+    cfg      = load_config()
+    detector = make_detector(**cfg.get("detector", {}))
+    profile  = encoding_profile(cfg.get("encoding"), "enroll")
+
+    results = {}
+    for key, fn in (("enroll.encode", lambda img: encode_image(img, detector, profile)),
+                    ("enroll.check",  lambda img: check_image(img, detector))):
+        for _, img in images[:args.warmup]:
+            fn(img)
+        times = []
+        t_all = time.perf_counter()
+        for _, img in images:
+            t0 = time.perf_counter()
+            fn(img)
+            times.append(time.perf_counter() - t0)
+        results[key] = {**summarize(times, time.perf_counter() - t_all), "images": len(images)}
+    return results
+
+
+RUNNERS = {"match": run_match, "frames": run_frames, "enroll": run_enroll}
+
+
+# ──────────────────────────────────────────
+# 親プロセス：スイートごとに子プロセスを起動して集める
+# ──────────────────────────────────────────
+def run_suite_isolated(suite: str, argv: list[str]) -> dict:
+    """{"results": {項目: 結果}, "peak_rss_mb": スイートのピーク RSS}。失敗したら {}"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        out = f.name
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), *argv, "--child", suite, "--child-out", out]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL if not os.environ.get("BENCH_VERBOSE")
+                              else None)
+        if proc.returncode != 0:
+            print(f"❌ {suite} が失敗しました (exit {proc.returncode})")
+            return {}
+        with open(out, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(out)
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f"\n{'項目':24} {'指標':18} {'baseline':>12} {'current':>12} {'変化':>8}")
+    print("─" * 78)
+    for key, cur in current.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = base.get(metric), cur.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse  = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            mark   = "  ⚠ 回帰" if worse else ""
+            print(f"{key:24} {metric:18} {old:12.3f} {new:12.3f} {change:+7.1%}{mark}")
+            if worse:
+                regressions.append(f"{key} {metric}: {old} → {new} ({change:+.1%})")
+    return regressions
+
+
+def rss_rows(peak_rss: dict) -> dict:
+    """スイートのピーク RSS を compare() に渡せる形に"""
+    return {f"{suite} (suite)": {"peak_rss_mb": mb} for suite, mb in peak_rss.items()}
+
+
+def print_table(results: dict, peak_rss: dict):
+    print(f"{'項目':24} {'n':>7} {'/s':>10} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    print("─" * 73)
+    for key, r in results.items():
+        tp  = f"{r['throughput_per_s']:10.1f}" if r.get("throughput_per_s") else f"{'—':>10}"
+        print(f"{key:24} {r['n']:7d} {tp} {r['p50_ms']:9.3f} {r['p95_ms']:9.3f} {r['p99_ms']:9.3f}")
+    print()
+    for suite, mb in peak_rss.items():
+        print(f"ピーク RSS  {suite:12} {mb:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="認識・登録ホットパスのベンチマーク")
+    parser.add_argument("--suites",         default="match,frames,enroll")
+    parser.add_argument("--gallery-sizes",  default="1000,10000,100000")
+    parser.add_argument("--people",         type=int, default=200, help="合成データの人数")
+    parser.add_argument("--queries",        type=int, default=500)
+    parser.add_argument("--frames-dir",     default="bench/frames")
+    parser.add_argument("--frames-gallery", type=int, default=1000,
+                        help="frames で登録データが無いときに使う合成データの件数")
+    parser.add_argument("--pkl",            default="", help="frames で使う登録データ（既定は config.json）")
+    parser.add_argument("--repeat",         type=int, default=3, help="frames を何周するか")
+    parser.add_argument("--faces-dir",      default=os.path.expanduser("~/new_faces"))
+    parser.add_argument("--tolerance",      type=float, default=0.5)
+    parser.add_argument("--warmup",         type=int, default=5)
+    parser.add_argument("--seed",           type=int, default=42)
+    parser.add_argument("--json",           default="", help="結果を JSON で保存するパス")
+    parser.add_argument("--compare",        default="", help="比較するベースラインの JSON")
+    parser.add_argument("--threshold",      type=float, default=0.10, help="回帰とみなす変化率")
+    parser.add_argument("--child",          default="", help=argparse.SUPPRESS)
+    parser.add_argument("--child-out",      default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        results = RUNNERS[args.child](args)
+        with open(args.child_out, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "peak_rss_mb": peak_rss_mb()}, f)
+        return
+
+    suites = [s for s in args.suites.split(",") if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"不明なスイート: {', '.join(sorted(unknown))}（{', '.join(SUITES)} から選ぶ）")
+
+    # 子プロセスにも同じ引数を渡す（--json / --compare は子では使わない）
+    argv = sys.argv[1:]
+    results, peak_rss = {}, {}
+    for suite in suites:
+        print(f"▶ {suite} ...", flush=True)
+        out = run_suite_isolated(suite, argv)
+        if out:
+            results.update(out["results"])
+            peak_rss[suite] = out["peak_rss_mb"]
+    if not results:
+        sys.exit(1)
+
+    print()
+    print_table(results, peak_rss)
+
+    report = {
+        "meta": {
+            "created":   datetime.now().isoformat(timespec="seconds"),
+            "python":    platform.python_version(),
+            "platform":  platform.platform(),
+            "machine":   platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "numpy":     np.__version__,
+            "args":      {k: v for k, v in vars(args).items() if not k.startswith("child")},
+        },
+        "results": results,
+        "peak_rss_mb": peak_rss,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare({**results, **rss_rows(peak_rss)},
+                              {**baseline.get("results", {}),
+                               **rss_rows(baseline.get("peak_rss_mb", {}))},
+                              args.threshold)
+        if regressions:
+            print(f"\n⚠ {len(regressions)} 件の回帰（threshold={args.threshold:.0%}）")
+            sys.exit(1)
+        print("\n✅ 回帰なし")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,34 @@
 使い方:
     python check_faces.py
     python check_faces.py --faces-dir ~/new_faces
+    python check_faces.py --detector haar
 """
 
 import os, glob, base64, threading, argparse
-import cv2, face_recognition
+import cv2
 from flask import Flask, render_template_string, jsonify
 
+from config import Config
+from face_detectors import BACKENDS, make_detector
+
 app = Flask(__name__)
-parser = argparse.ArgumentParser()
-parser.add_argument("--faces-dir", default=os.path.expanduser("~/new_faces"))
-args = parser.parse_args()
-FACES_DIR = args.faces_dir
+FACES_DIR = os.path.expanduser("~/new_faces")
+detector  = None   # __main__ で引数に従って作る
+
+def check_image(img, detector) -> dict:
+    """1枚分のチェック（顔の数の判定 + 枠を描いたサムネイル）。benchmark.py からも使う"""
+    locs = detector.detect(img)
+    draw = img.copy()
+    for (top, right, bottom, left) in locs:
+        color = (139, 180, 250) if len(locs) == 1 else (243, 139, 168)
+        cv2.rectangle(draw, (left, top), (right, bottom), color, 2)
+
+    thumb   = cv2.resize(draw, (160, 120))
+    _, buf  = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, 75])
+    b64     = base64.b64encode(buf).decode()
+    ok      = len(locs) == 1
+    reason  = "OK" if ok else ("顔が検出されませんでした" if len(locs) == 0 else f"顔が {len(locs)} 人検出されました")
+    return {"ok": ok, "face_count": len(locs), "reason": reason, "thumb": b64}
 
 check_lock    = threading.Lock()
 check_running = False
@@ -39,21 +56,8 @@ def run_check():
             with check_lock: check_results = list(results)
             continue
 
-        rgb  = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        locs = face_recognition.face_locations(rgb, model="hog")
-        draw = img.copy()
-        for (top, right, bottom, left) in locs:
-            color = (139, 180, 250) if len(locs) == 1 else (243, 139, 168)
-            cv2.rectangle(draw, (left, top), (right, bottom), color, 2)
-
-        thumb   = cv2.resize(draw, (160, 120))
-        _, buf  = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, 75])
-        b64     = base64.b64encode(buf).decode()
-        ok      = len(locs) == 1
-        reason  = "OK" if ok else ("顔が検出されませんでした" if len(locs) == 0 else f"顔が {len(locs)} 人検出されました")
-
         results.append({"path": path, "person": person, "filename": os.path.basename(path),
-                        "ok": ok, "face_count": len(locs), "reason": reason, "thumb": b64})
+                        **check_image(img, detector)})
         with check_lock: check_results = list(results)
 
     with check_lock: check_running = False
@@ -179,6 +183,15 @@ def api_results():
     return jsonify({"results": results, "done": not running, "progress": progress})
 
 if __name__ == "__main__":
+    detector_cfg = Config("config.json").get("detector")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces-dir", default=os.path.expanduser("~/new_faces"))
+    parser.add_argument("--detector",  default=detector_cfg.get("backend", "hog"), choices=list(BACKENDS))
+    args = parser.parse_args()
+    FACES_DIR = args.faces_dir
+    detector  = make_detector(**{**detector_cfg, "backend": args.detector})
+
     print(f"[Check] http://localhost:5002 で起動します")
     print(f"[Check] 対象: {FACES_DIR}")
+    print(f"[Check] 検出器: {detector.name}")
     app.run(host="0.0.0.0", port=5002, threaded=True, debug=False)
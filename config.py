@@ -9,13 +9,99 @@ from pathlib import Path
 
 DEFAULT = {
     "slack": {
-        "user_webhooks": {}
+        "user_webhooks": {},
+        "queue_size":    256,
+        "workers":       2,
+        "max_retries":   5,
+        "dead_letter":   "logs/slack_dead_letter.jsonl",
+        "coalesce_ms":   0
     },
     "settings": {
         "cooldown_sec":            5,
         "camera_index":            0,
+        "camera_source":           "",
         "face_tolerance":          0.5,
-        "recognition_interval_ms": 500
+        "recognition_interval_ms": 500,
+        "recognition_active_interval_ms": 100,
+        "recognition_idle_max_ms": 2000,
+        "motion_threshold":        4.0,
+        "motion_min_interval_ms":  250,
+        "recognition_workers":     0
+    },
+    "detector": {
+        "backend":       "hog",
+        "upsample":      1,
+        "haar_cascade":  "",
+        "lbp_cascade":   "",
+        "scale_factor":  1.1,
+        "min_neighbors": 5,
+        "min_size":      60
+    },
+    "encoding": {
+        "live_model":     "large",
+        "live_jitters":   1,
+        "enroll_model":   "large",
+        "enroll_jitters": 1
+    },
+    "quality": {
+        "enabled":        True,
+        "min_face_px":    60,
+        "min_brightness": 40,
+        "max_brightness": 220,
+        "min_sharpness":  30.0,
+        "max_yaw_ratio":  3.0
+    },
+    "attendance": {
+        "backend":            "csv",
+        "db_path":            "logs/attendance.db",
+        "durability":         "flush",
+        "fsync_interval_sec": 5,
+        "cached_days":        90
+    },
+    "tracing": {
+        "capacity": 2000
+    },
+    "stream": {
+        "enabled":            False,
+        "port":               5080,
+        "public_url":         "",
+        "max_clients":        200,
+        "max_per_ip":         0,
+        "write_timeout_sec":  10,
+        "header_timeout_sec": 5,
+        "max_buffer_kb":      512,
+        "status_interval_ms": 100,
+        "max_variants":       8
+    },
+    "fusion": {
+        "enabled":           True,
+        "early_margin":      0.12,
+        "margin":            0.06,
+        "unknown_margin":    0.08,
+        "early_unknown_margin": 0.2,
+        "max_frames":        5,
+        "track_iou":         0.3,
+        "track_timeout_sec": 1.5,
+        "reverify_sec":      3
+    },
+    "unknown": {
+        "window_sec":       600,
+        "cluster_distance": 0.5,
+        "better_ratio":     1.5
+    },
+    "images": {
+        "dir":            "logs/images",
+        "crop_only":      False,
+        "crop_padding":   0.3,
+        "jpeg_quality":   90,
+        "queue_size":     32,
+        "retention_days": 90,
+        "max_total_mb":   2048
+    },
+    "service": {
+        "port":            5003,
+        "batch_window_ms": 10,
+        "max_batch":       16
     },
     "paths": {
         "encodings_pkl": "~/encodings.pkl",
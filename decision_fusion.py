@@ -0,0 +1,268 @@
+"""
+複数フレームの認識結果をまとめた判定（早期確定つき）
+
+1フレームの recognize_detail() だけで決めると、際どいフレームは unknown で
+捨てられるか別人で入室してしまう。一方ではっきり分かった人も認識間隔ごとに
+エンコードし直している。ここでは顔の位置が続いている間を1つのトラックとし、
+人ごとの距離をフレームをまたいで平均して判定する。
+
+    early     1フレーム目で決まった
+              （最小距離が tolerance 以下で2位との差が early_margin 以上 /
+                tolerance + early_unknown_margin より遠い → unknown）
+    fused     複数フレームの平均で決まった（差が margin 以上 / 平均でも
+              tolerance + unknown_margin より遠い → unknown）
+    timeout   max_frames まで見ても決まらなかった。差が margin の半分以上あれば1位、
+              なければ unknown（似た登録者どうしで誤入室させない）
+    pending   まだ決めない（name は None として扱う）
+    tracked   確定済みトラックの顔。エンコードせず確定した名前を返す
+    verified  確定済みトラックの顔をエンコードし、確定した人のままと確かめた
+
+1フレームだけ写りの悪い登録者を unknown で締め出さないよう、1フレーム目の unknown は
+大きく離れているときだけにし、unknown のトラックはエンコードを省かない。
+そのトラックで tolerance 以内のフレームが来たら判定をやり直す。
+
+登録者で確定したトラックの顔位置（skip_box）を FaceEngine に渡すと、その位置で
+大きさも変わらない顔は品質判定・エンコードを省く。skip_box は確定（確認）したときの
+位置のまま動かさないので、顔が動いたり大きさが変わったりすると次のフレームは
+エンコードされる。それとは別に reverify_sec ごとに1回はエンコードする。
+エンコードした結果が確定した人の1位のままなら verified、違えば判定をやり直す
+（同じ位置での人の入れ替わり対策）。
+顔が track_timeout_sec 見えないか、位置が track_iou 未満しか重ならなければ別トラック。
+
+距離は FaceEngine が返す上位候補（人ごとの最小距離）を使う。あるフレームの候補に
+入っていない人は、そのフレームの候補の最大距離を足しておく（平均を公平にするため）。
+"""
+
+import threading
+import time
+
+import metrics
+
+DECISIONS = metrics.counter("fusion_decisions_total", "トラックの確定件数",
+                            labels=("decision", "result"))
+DECISION_FRAMES = metrics.histogram("fusion_decision_frames", "確定までにエンコードしたフレーム数",
+                                    buckets=(1, 2, 3, 4, 5, 6, 8, 10))
+DECISION_SECONDS = metrics.histogram("fusion_decision_seconds", "トラック開始から確定までの時間")
+ENCODES_SKIPPED = metrics.counter("fusion_encodes_skipped_total",
+                                  "確定済みトラックのため省いたエンコード数")
+
+
+def box_iou(a: tuple, b: tuple) -> float:
+    """(top, right, bottom, left) どうしの IoU"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(bottom - top, 0) * max(right - left, 0)
+    if not inter:
+        return 0.0
+    area = lambda r: (r[2] - r[0]) * (r[1] - r[3])
+    return inter / float(area(a) + area(b) - inter)
+
+
+def same_spot(a: tuple, b: tuple, min_iou: float = 0.5, max_scale: float = 1.25) -> bool:
+    """a と b が同じ位置・ほぼ同じ大きさか（IoU と面積比だけを見る軽い判定）"""
+    area = lambda r: (r[2] - r[0]) * (r[1] - r[3])
+    small, large = sorted((area(a), area(b)))
+    if small <= 0 or large > small * max_scale ** 2:
+        return False
+    return box_iou(a, b) >= min_iou
+
+
+class _Track:
+    __slots__ = ("box", "started", "last_seen", "frames", "sums", "floor",
+                 "name", "distance", "decision", "committed_at", "anchor")
+
+    def __init__(self, box: tuple, now: float):
+        self.box       = box
+        self.started   = now
+        self.last_seen = now
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.sums: dict[str, float] = {}   # 人ごとの距離の合計
+        self.floor  = 0.0                  # 各フレームの候補の最大距離の合計
+        self.name: str | None = None       # 確定した名前（"unknown" を含む）
+        self.distance = None
+        self.decision: str | None = None   # 確定したときの判定
+        self.committed_at = 0.0            # 確定・確認した時刻
+        self.anchor: tuple | None = None   # 確定・確認したときの顔位置
+
+    def add(self, candidates: list[tuple[str, float]]):
+        worst = candidates[-1][1]
+        seen = {name for name, _ in candidates}
+        for name in self.sums:
+            if name not in seen:
+                self.sums[name] += worst
+        for name, dist in candidates:
+            # 初めて候補に入った人は、それまでのフレームを各フレームの最大距離で埋める
+            self.sums[name] = self.sums.get(name, self.floor) + dist
+        self.floor  += worst
+        self.frames += 1
+
+    def ranking(self) -> list[tuple[str, float]]:
+        """平均距離の小さい順"""
+        return sorted(((n, s / self.frames) for n, s in self.sums.items()), key=lambda x: x[1])
+
+
+class DecisionFusion:
+    def __init__(self, tolerance: float = 0.5, early_margin: float = 0.12, margin: float = 0.06,
+                 unknown_margin: float = 0.08, early_unknown_margin: float = 0.2,
+                 max_frames: int = 5, track_iou: float = 0.3,
+                 track_timeout_sec: float = 1.5, reverify_sec: float = 3.0):
+        self.tolerance         = tolerance
+        self.early_margin      = early_margin
+        self.margin            = margin
+        self.unknown_margin    = unknown_margin
+        self.early_unknown_margin = early_unknown_margin
+        self.max_frames        = max_frames
+        self.track_iou         = track_iou
+        self.track_timeout_sec = track_timeout_sec
+        self.reverify_sec      = reverify_sec
+        self._track: _Track | None = None
+
+        self._lock  = threading.Lock()
+        self._stats = {"tracks": 0, "decisions": {}, "encodes": 0, "skipped": 0,
+                       "verified": 0, "decision_frames": 0, "decision_sec": 0.0}
+
+    # ──────────────────────────────────────────
+    def skip_box(self) -> tuple | None:
+        """
+        登録者で確定済み、かつ判定し直す時期でないトラックの確定時の顔位置
+        （この位置・大きさの顔はエンコード不要）。unknown のトラックは常に None。
+        """
+        t = self._track
+        if t is None or t.name is None or t.name == "unknown":
+            return None
+        now = time.monotonic()
+        if now - t.last_seen > self.track_timeout_sec or now - t.committed_at > self.reverify_sec:
+            return None
+        return t.anchor
+
+    def update(self, result, now: float | None = None):
+        """
+        1フレームの RecognitionResult をトラックに加え、判定後の name / distance /
+        decision / frames に書き換えて返す（同じオブジェクト）。
+        """
+        now = time.monotonic() if now is None else now
+        loc = result.location
+        if loc is None:
+            if self._track is not None and now - self._track.last_seen > self.track_timeout_sec:
+                self._track = None
+            return result
+
+        t = self._track
+        if t is None or now - t.last_seen > self.track_timeout_sec or box_iou(loc, t.box) < self.track_iou:
+            t = self._track = _Track(loc, now)
+            with self._lock:
+                self._stats["tracks"] += 1
+        t.box, t.last_seen = loc, now
+
+        if result.tracked:
+            if t.name is None:
+                # 確定前に入れ替わったトラック。次のフレームでエンコードする
+                result.decision = "pending"
+                return result
+            ENCODES_SKIPPED.inc()
+            with self._lock:
+                self._stats["skipped"] += 1
+            return self._apply(result, t, "tracked")
+
+        if result.reject_reason or result.encoding is None:
+            return result   # 品質ゲートで不採用・エンコード失敗は判断材料にしない
+
+        with self._lock:
+            self._stats["encodes"] += 1
+        candidates = result.candidates or [("unknown", float("inf"))]
+        if t.name is not None:
+            # 確定済みトラックのエンコード（顔が動いた・reverify_sec 経過・プールで確定前に
+            # 投入したフレーム）。1位が確定した人のままなら確認済みとして続ける
+            if self._agrees(t, candidates[0]):
+                t.committed_at, t.anchor = now, loc
+                with self._lock:
+                    self._stats["verified"] += 1
+                return self._apply(result, t, "verified")
+            t.reset()       # 入れ替わった・unknown に見覚えのある顔が写った → 判定し直し
+            t.started = now
+        t.add(candidates)
+
+        decision, name, dist = self._decide(t)
+        if decision == "pending":
+            result.name, result.decision, result.frames = None, "pending", t.frames
+            return result
+
+        t.name, t.distance, t.decision = name, dist, decision
+        t.committed_at, t.anchor = now, loc
+        DECISIONS.inc(decision=decision, result="unknown" if name == "unknown" else "known")
+        DECISION_FRAMES.observe(t.frames)
+        DECISION_SECONDS.observe(now - t.started)
+        with self._lock:
+            d = self._stats["decisions"]
+            d[decision] = d.get(decision, 0) + 1
+            self._stats["decision_frames"] += t.frames
+            self._stats["decision_sec"]    += now - t.started
+        return self._apply(result, t, decision)
+
+    def _decide(self, t: _Track) -> tuple[str, str | None, float | None]:
+        """(decision, name, 平均距離)"""
+        ranking = t.ranking()
+        best_name, best = ranking[0]
+        second = ranking[1][1] if len(ranking) > 1 else float("inf")
+        gap = second - best
+
+        if t.frames == 1:
+            if best <= self.tolerance and gap >= self.early_margin:
+                return "early", best_name, best
+            if best > self.tolerance + self.early_unknown_margin:
+                return "early", "unknown", best
+            return "pending", None, None
+
+        if best <= self.tolerance and gap >= self.margin:
+            return "fused", best_name, best
+        if best > self.tolerance + self.unknown_margin:
+            return "fused", "unknown", best
+        if t.frames >= self.max_frames:
+            if best <= self.tolerance and gap >= self.margin / 2:
+                return "timeout", best_name, best
+            return "timeout", "unknown", best
+        return "pending", None, None
+
+    def _agrees(self, t: _Track, top: tuple[str, float]) -> bool:
+        """確定済みトラックの新しいフレームの1位 (name, 距離) が確定した判定と矛盾しないか"""
+        name, dist = top
+        if t.name == "unknown":
+            return dist > self.tolerance
+        return name == t.name and dist <= self.tolerance + self.unknown_margin
+
+    @staticmethod
+    def _apply(result, t: _Track, decision: str):
+        result.name     = t.name
+        result.distance = t.distance
+        result.decision = decision
+        result.frames   = t.frames
+        if t.name != "unknown" and decision in ("tracked", "verified"):
+            result.encoding = None   # 同じ人の画像を unknown として保存し直さない
+        return result
+
+    def reset(self):
+        """登録データの再読込時など、今のトラックの判定を捨てる"""
+        self._track = None
+
+    # ──────────────────────────────────────────
+    def snapshot(self) -> dict:
+        """/api/fusion 用：確定の内訳と1人あたりのエンコード数・確定までの時間"""
+        with self._lock:
+            s = {**self._stats, "decisions": dict(self._stats["decisions"])}
+        committed = sum(s["decisions"].values())
+        t = self._track
+        return {
+            "tracks":      s["tracks"],
+            "decisions":   s["decisions"],
+            "encodes":     s["encodes"],
+            "skipped_encodes":        s["skipped"],
+            "verified_encodes":       s["verified"],
+            "avg_frames_to_decision": round(s["decision_frames"] / committed, 2) if committed else None,
+            "avg_ms_to_decision":     round(s["decision_sec"] / committed * 1000, 1) if committed else None,
+            "encodes_per_track":      round(s["encodes"] / s["tracks"], 2) if s["tracks"] else None,
+            "current": None if t is None else {"name": t.name, "decision": t.decision,
+                                              "frames": t.frames, "box": t.box},
+        }
@@ -5,26 +5,61 @@
 使い方:
     python encode_faces.py
     python encode_faces.py --faces-dir ~/new_faces --out ~/encodings.pkl
+    python encode_faces.py --detector hog_gray
+    python encode_faces.py --model large --jitters 10
 """
 
 import os, sys, glob, pickle, argparse, json
 import cv2, face_recognition
 
+from face_detectors import BACKENDS, make_detector
+from face_engine import encoding_profile
 
-def load_pkl_path():
+
+def load_config():
     try:
         with open("config.json") as f:
-            return json.load(f).get("paths", {}).get("encodings_pkl", "~/encodings.pkl")
+            return json.load(f)
     except:
-        return "~/encodings.pkl"
+        return {}
+
+
+def load_pkl_path(cfg):
+    return cfg.get("paths", {}).get("encodings_pkl", "~/encodings.pkl")
+
+
+def encode_image(img, detector, profile: dict):
+    """
+    1枚分の検出 + エンコード。benchmark.py からも使う。
+    Returns:
+        (特徴ベクトル or None, 検出した顔の数)
+    """
+    locs = detector.detect(img)
+    if len(locs) != 1:
+        return None, len(locs)
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    enc = face_recognition.face_encodings(
+        rgb, locs, num_jitters=profile["num_jitters"], model=profile["model"])[0]
+    return enc, 1
 
 
 def main():
-    default_out = os.path.expanduser(load_pkl_path())
+    cfg          = load_config()
+    detector_cfg = cfg.get("detector", {})
+    profile      = encoding_profile(cfg.get("encoding"), "enroll")
+    default_out  = os.path.expanduser(load_pkl_path(cfg))
     parser = argparse.ArgumentParser()
     parser.add_argument("--faces-dir", default=os.path.expanduser("~/new_faces"))
     parser.add_argument("--out",       default=default_out)
+    parser.add_argument("--detector",  default=detector_cfg.get("backend", "hog"),
+                        choices=list(BACKENDS))
+    parser.add_argument("--model",     default=profile["model"], choices=["large", "small"],
+                        help="ランドマークモデル（認識側の encoding.live_model と揃える）")
+    parser.add_argument("--jitters",   type=int, default=profile["num_jitters"],
+                        help="ジッター回数（多いほど安定するが遅い）")
     args = parser.parse_args()
+    detector = make_detector(**{**detector_cfg, "backend": args.detector})
+    profile  = {"model": args.model, "num_jitters": args.jitters}
 
     base     = args.faces_dir
     out_path = args.out
@@ -34,7 +69,9 @@ def main():
         sys.exit(1)
 
     print(f"📂 顔画像フォルダ: {base}")
-    print(f"💾 出力先        : {out_path}\n")
+    print(f"💾 出力先        : {out_path}")
+    print(f"🔍 検出器        : {detector.name}")
+    print(f"🧬 エンコード    : model={profile['model']}, jitters={profile['num_jitters']}\n")
 
     names, encs, skipped = [], [], 0
     persons = sorted([p for p in os.listdir(base) if os.path.isdir(os.path.join(base, p))])
@@ -56,13 +93,11 @@ def main():
                 print(f"   ❌ 読み込み失敗: {os.path.basename(path)}")
                 skipped += 1
                 continue
-            rgb  = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            locs = face_recognition.face_locations(rgb, model="hog")
-            if len(locs) != 1:
-                print(f"   ⚠  スキップ（顔 {len(locs)} 人）: {os.path.basename(path)}")
+            enc, faces = encode_image(img, detector, profile)
+            if enc is None:
+                print(f"   ⚠  スキップ（顔 {faces} 人）: {os.path.basename(path)}")
                 skipped += 1
                 continue
-            enc = face_recognition.face_encodings(rgb, locs)[0]
             names.append(person)
             encs.append(enc)
             count += 1
@@ -75,12 +110,13 @@ def main():
 
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
     with open(out_path, "wb") as f:
-        pickle.dump({"names": names, "encodings": encs}, f)
+        pickle.dump({"names": names, "encodings": encs, "profile": profile}, f)
 
     print("─" * 40)
     print(f"🎉 完了: {len(encs)} 枚 / {len(set(names))} 人 → {out_path}")
     print(f"   スキップ: {skipped} 枚")
     print(f"   登録人物: {', '.join(sorted(set(names)))}")
+    print(f"   検出時間: 平均 {detector.stats()['avg_ms']} ms / 枚")
 
 
 if __name__ == "__main__":
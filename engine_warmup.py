@@ -0,0 +1,91 @@
+"""
+FaceEngine のバックグラウンド初期化（ウォームアップ）
+
+dlib / face_recognition の import、モデルと encodings.pkl の読み込み、
+初回推論の立ち上がりには数秒かかる。app.py はこれを待たずに Flask と
+カメラを先に動かし、認識はエンジンの準備ができるまで飛ばす。
+
+    state    pending → loading → ready
+                                 → failed（例外。error に内容）
+    timings  import / load / warmup の所要時間（秒）
+
+ウォームアップでは黒画像で検出を1回、仮の顔位置でエンコードを1回通し、
+最初の来訪者の認識で初回分の遅れが出ないようにする。
+
+names_only=True（認識をワーカープロセスに任せる親プロセス）では dlib もモデルも
+読み込まず、GalleryInfo で登録名だけを読む（ウォームアップもしない）。
+"""
+
+import threading
+import time
+
+import numpy as np
+
+WARMUP_SHAPE = (480, 640, 3)
+WARMUP_LOCATION = (140, 400, 340, 240)   # (top, right, bottom, left)
+
+
+class EngineWarmup:
+    def __init__(self, engine_kwargs: dict, on_ready=None, names_only: bool = False):
+        self.engine_kwargs = engine_kwargs
+        self.names_only    = names_only
+        self.on_ready = on_ready   # 準備完了時に engine を渡して呼ぶ
+        self.engine   = None       # ready になるまでは None
+        self.ready    = threading.Event()
+        self.state    = "pending"
+        self.error: str | None = None
+        self.timings: dict[str, float] = {}
+        self._started: float | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "EngineWarmup":
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        self.state = "loading"
+        try:
+            t0 = time.perf_counter()
+            if self.names_only:
+                from recognition_types import GalleryInfo as FaceEngine
+            else:
+                from face_engine import FaceEngine
+            t1 = time.perf_counter()
+            engine = FaceEngine(**self.engine_kwargs)
+            t2 = time.perf_counter()
+            if not self.names_only:
+                self._warmup(engine)
+            t3 = time.perf_counter()
+        except Exception as e:
+            self.state = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"[EngineWarmup] 初期化に失敗しました: {self.error}")
+            return
+
+        self.timings = {"import": t1 - t0, "load": t2 - t1, "warmup": t3 - t2}
+        self.engine = engine
+        self.state  = "ready"
+        self.ready.set()
+        print(f"[EngineWarmup] 準備完了: import {t1 - t0:.2f}s / "
+              f"load {t2 - t1:.2f}s / warmup {t3 - t2:.2f}s")
+        if self.on_ready is not None:
+            self.on_ready(engine)
+
+    @staticmethod
+    def _warmup(engine):
+        """検出器とエンコーダーに1回ずつダミー入力を通す"""
+        frame = np.zeros(WARMUP_SHAPE, dtype=np.uint8)
+        engine.recognize_detail(frame)
+        engine.encode_batch([frame], [WARMUP_LOCATION])
+
+    def snapshot(self) -> dict:
+        """/readyz 用の状態"""
+        return {
+            "state":   self.state,
+            "names_only": self.names_only,
+            "error":   self.error,
+            "elapsed_sec": round(time.time() - self._started, 2) if self._started else None,
+            "timings": {k: round(v, 3) for k, v in self.timings.items()},
+        }
@@ -5,47 +5,116 @@ encode_faces.py が生成した ~/encodings.pkl を読み込み、
 カメラフレームから人物を識別する。
 
 pkl のデータ構造:
-    {"names": [str, ...], "encodings": [np.ndarray, ...]}
+    {"names": [str, ...], "encodings": [np.ndarray, ...],
+     "profile": {"model": "large" | "small", "num_jitters": int}}
+
+    profile はエンコード時のランドマークモデルとジッター回数。
+    古い pkl には無いので既定値（large / 1）とみなす。
+    認識側とランドマークモデルが異なると距離が信用できないため、
+    ロード時に警告して profile_mismatch を立てる。
 
 フレーム内で最も大きい顔（カメラに近い人）を1人だけ処理する。
 face_distance の最小値で判定するため複数枚登録でも精度が上がる。
+
+照合は登録ベクトルを (N, 128) 行列にまとめ、複数の顔を1回の行列演算で
+処理できるようにしている（recognition_service.py のマイクロバッチ用）。
+行列や名前順の添字は _Gallery に束ね、load_faces() は新しい _Gallery を作ってから
+1回の代入で差し替える（再読込中に別スレッドで照合しても食い違わない）。
+
+検出器は face_detectors.py から config.json の detector セクションで選ぶ。
+カラー（RGB）変換はエンコードする顔が残ったときだけ行う。
+
+エンコードの前に FaceQualityGate で小さい・ブレた・暗い・横向きの顔をはじく。
+はじいた理由は RecognitionResult.reject_reason に入る。
 """
 
 import pickle
+import time
+import dlib
 import face_recognition
+import face_recognition.api as fr_api
 import numpy as np
 import cv2
 from pathlib import Path
 
+from face_detectors import make_detector
+from face_quality import FaceQualityGate
+# RecognitionResult / encoding_profile は dlib を読み込まずに使えるよう別モジュールに置き、
+# 従来どおり face_engine からも import できるようにしている
+from recognition_types import DEFAULT_PROFILE, RecognitionResult, encoding_profile  # noqa: F401
+from decision_fusion import same_spot
+
+
+# 顔チップ切り出しに使うランドマークモデル
+POSE_PREDICTORS = {
+    "large": fr_api.pose_predictor_68_point,
+    "small": fr_api.pose_predictor_5_point,
+}
+
+
+class _Gallery:
+    """照合用に並べ替えた登録データ一式（作ったあとは書き換えない）"""
+    __slots__ = ("names", "vectors", "sq", "order", "starts", "identities")
+
+    def __init__(self, names: list[str], encodings: list[np.ndarray]):
+        self.names   = list(names)
+        self.vectors = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        self.sq      = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        # 人ごとの最小距離を reduceat で1回に求めるため、登録データを名前順に並べる添字
+        self.order   = np.argsort(np.asarray(self.names), kind="stable")
+        sorted_names = [self.names[i] for i in self.order]
+        self.starts  = np.array([i for i, n in enumerate(sorted_names)
+                                 if i == 0 or n != sorted_names[i - 1]], dtype=np.intp)
+        self.identities = [sorted_names[i] for i in self.starts]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
 
 class FaceEngine:
-    def __init__(self, pkl_path: str = "~/encodings.pkl", tolerance: float = 0.5):
+    def __init__(self, pkl_path: str = "~/encodings.pkl", tolerance: float = 0.5,
+                 quality: dict | None = None, detector: dict | None = None,
+                 encoding: dict | None = None):
         self.pkl_path  = Path(pkl_path).expanduser()
         self.tolerance = tolerance
+        self.profile   = {**DEFAULT_PROFILE, **(encoding or {})}
+        self.gallery_profile  = dict(DEFAULT_PROFILE)
+        self.profile_mismatch = False
+        self.quality_gate = FaceQualityGate(**(quality or {}))
+        self.detector     = make_detector(**(detector or {}))
         self.known_encodings: list[np.ndarray] = []
         self.known_names:     list[str]        = []
+        self._gallery = _Gallery([], [])
         self.load_faces()
 
     def load_faces(self):
         """encodings.pkl から特徴ベクトルをロードする"""
-        self.known_encodings = []
-        self.known_names     = []
-
         if not self.pkl_path.exists():
             print(f"[FaceEngine] {self.pkl_path} が見つかりません。"
                   "encode_faces.py を先に実行してください。")
+            self._gallery = _Gallery([], [])
+            self.known_encodings, self.known_names = [], []
             return
 
         with open(self.pkl_path, "rb") as f:
             data = pickle.load(f)
 
+        # 照合中のスレッドは self._gallery を1回だけ読むので、組み立ててから差し替える
+        self._gallery = _Gallery(data["names"], data["encodings"])
         self.known_names     = data["names"]
         self.known_encodings = data["encodings"]
 
+        self.gallery_profile  = {**DEFAULT_PROFILE, **data.get("profile", {})}
+        self.profile_mismatch = self.gallery_profile["model"] != self.profile["model"]
+
         unique = set(self.known_names)
         print(f"[FaceEngine] ロード完了: "
               f"{len(self.known_names)} 枚 / {len(unique)} 人 "
               f"({', '.join(sorted(unique))})")
+        if self.profile_mismatch:
+            print(f"[FaceEngine] 警告: 登録データのランドマークモデル "
+                  f"({self.gallery_profile['model']}) と認識側 ({self.profile['model']}) "
+                  "が異なります。encode_faces.py で作り直してください。")
 
     def recognize(self, frame: np.ndarray) -> tuple[str | None, tuple | None]:
         """
@@ -54,36 +123,126 @@ class FaceEngine:
         Returns:
             (name, face_location)   登録済みの場合
             ("unknown", face_location)  未登録の場合
+            (None, face_location)  品質ゲートで不採用の場合
             (None, None)  顔が検出されなかった場合
         """
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        locations = face_recognition.face_locations(rgb, model="hog")
+        result = self.recognize_detail(frame)
+        return result.name, result.location
+
+    def recognize_detail(self, frame: np.ndarray, skip_box: tuple | None = None,
+                         skip_iou: float = 0.5, skip_scale: float = 1.25) -> RecognitionResult:
+        """
+        recognize() と同じ処理で、距離・上位候補・不採用理由・処理時間も返す。
+        skip_box（判定済みの顔の位置）と IoU skip_iou 以上で重なり、大きさの比も
+        skip_scale 以内の顔は品質判定・エンコードを省き、tracked = True の結果を返す
+        （誰かは呼び出し側が知っている）。
+        """
+        result = RecognitionResult()
+        t0 = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        locations = self.detector.detect(frame, gray)
+        t1 = time.perf_counter()
+        result.timings["detect"] = t1 - t0
         if not locations:
-            return None, None
+            return result
 
         # 面積最大の顔を選ぶ
         largest = max(
             locations,
             key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3])
         )
+        result.location = largest
+        if skip_box is not None and same_spot(largest, skip_box, skip_iou, skip_scale):
+            result.tracked = True
+            return result
 
-        encodings = face_recognition.face_encodings(rgb, [largest])
-        if not encodings:
-            return None, largest
+        result.reject_reason, result.quality = self.quality_gate.check(gray, largest)
+        t2 = time.perf_counter()
+        result.timings["quality"] = t2 - t1
+        if result.reject_reason:
+            return result
 
-        enc = encodings[0]
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        encodings = face_recognition.face_encodings(
+            rgb, [largest],
+            num_jitters=self.profile["num_jitters"], model=self.profile["model"],
+        )
+        t3 = time.perf_counter()
+        result.timings["encode"] = t3 - t2
+        if not encodings:
+            return result
+
+        result.encoding = encodings[0]
+        gallery = self._gallery
+        if len(gallery):
+            distances = self._distances(np.atleast_2d(encodings[0]), gallery)
+            result.name, result.distance = self._nearest(distances, gallery)[0]
+            result.candidates = self._candidates(distances[0], gallery)
+        else:
+            result.name, result.distance = "unknown", float("inf")
+        result.timings["match"] = time.perf_counter() - t3
+        return result
 
-        if not self.known_encodings:
-            return "unknown", largest
+    def match(self, encodings: np.ndarray) -> list[tuple[str, float]]:
+        """
+        特徴ベクトル (B, 128) をまとめて登録データと照合する。
+        |a - b|^2 = |a|^2 + |b|^2 - 2ab で B x N の距離行列を1回で求める。
 
-        distances = face_recognition.face_distance(self.known_encodings, enc)
-        best_idx  = int(np.argmin(distances))
+        Returns:
+            [(name or "unknown", 最小距離), ...]  入力と同じ順
+        """
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float64))
+        gallery = self._gallery
+        if not len(gallery):
+            return [("unknown", float("inf"))] * len(encodings)
+        return self._nearest(self._distances(encodings, gallery), gallery)
+
+    @staticmethod
+    def _distances(encodings: np.ndarray, gallery: _Gallery) -> np.ndarray:
+        """(B, 128) → 登録データ全件との距離 (B, N)"""
+        sq = np.einsum("ij,ij->i", encodings, encodings)
+        d2 = sq[:, None] + gallery.sq[None, :] - 2.0 * encodings @ gallery.vectors.T
+        return np.sqrt(np.maximum(d2, 0.0))
+
+    def _nearest(self, distances: np.ndarray, gallery: _Gallery) -> list[tuple[str, float]]:
+        best_idx = np.argmin(distances, axis=1)
+
+        results = []
+        for row, idx in enumerate(best_idx):
+            dist = float(distances[row, idx])
+            name = gallery.names[idx] if dist <= self.tolerance else "unknown"
+            results.append((name, dist))
+        return results
+
+    @staticmethod
+    def _candidates(distances: np.ndarray, gallery: _Gallery, k: int = 3) -> list[tuple[str, float]]:
+        """1件分の距離 (N,) から、人ごとの最小距離が小さい順に上位 k 人"""
+        per_person = np.minimum.reduceat(distances[gallery.order], gallery.starts)
+        top = np.argsort(per_person)[:k]
+        return [(gallery.identities[i], float(per_person[i])) for i in top]
+
+    def encode_batch(self, images: list[np.ndarray], locations: list[tuple]) -> np.ndarray:
+        """
+        複数画像の顔をまとめてエンコードする。
+        ランドマーク → 150x150 の顔チップ切り出しまでは1枚ずつ、
+        ResNet への入力はチップをまとめて1回で渡す。
 
-        if distances[best_idx] <= self.tolerance:
-            return self.known_names[best_idx], largest
-        else:
-            return "unknown", largest
+        Args:
+            images:    RGB 画像のリスト
+            locations: 各画像の顔位置 (top, right, bottom, left)
+        Returns:
+            (len(images), 128) の特徴ベクトル
+        """
+        if not images:
+            return np.empty((0, 128))
+        predictor = POSE_PREDICTORS[self.profile["model"]]
+        chips = []
+        for rgb, loc in zip(images, locations):
+            shape = predictor(rgb, fr_api._css_to_rect(loc))
+            chips.append(dlib.get_face_chip(rgb, shape, size=150, padding=0.25))
+        return np.array(fr_api.face_encoder.compute_face_descriptor(
+            chips, self.profile["num_jitters"]))
 
     @property
     def unique_names(self) -> list[str]:
-        return sorted(set(self.known_names))
+        return sorted(set(self._gallery.names))
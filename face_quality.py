@@ -0,0 +1,86 @@
+"""
+顔画像の品質ゲート
+
+エンコード（最も重い処理）の前に、安い指標で使えない顔をはじく。
+小さすぎる顔・ブレた顔・暗すぎ/明るすぎる顔・横を向いた顔は
+エンコードしても距離が安定しないため、最初から処理しない。
+
+判定順（安い順）:
+    size        顔枠の短辺が min_face_px 未満
+    brightness  顔領域の平均輝度が [min_brightness, max_brightness] の外
+    sharpness   顔領域（96x96 に正規化）のラプラシアン分散が min_sharpness 未満
+    pose        5点ランドマークから求めた左右比が max_yaw_ratio を超える
+"""
+
+import cv2
+import face_recognition.api as fr_api
+import numpy as np
+
+# シャープネス計算時の正規化サイズ（顔の大きさで値が変わらないようにする）
+SHARPNESS_SIZE = (96, 96)
+
+DEFAULT_THRESHOLDS = {
+    "min_face_px":    60,
+    "min_brightness": 40,
+    "max_brightness": 220,
+    "min_sharpness":  30.0,
+    "max_yaw_ratio":  3.0,
+}
+
+
+class FaceQualityGate:
+    def __init__(self, enabled: bool = True, **thresholds):
+        self.enabled = enabled
+        self.thresholds = {**DEFAULT_THRESHOLDS,
+                           **{k: v for k, v in thresholds.items() if k in DEFAULT_THRESHOLDS}}
+
+    def check(self, gray: np.ndarray, loc: tuple) -> tuple[str | None, dict]:
+        """
+        Args:
+            gray: グレースケールのフレーム
+            loc:  顔位置 (top, right, bottom, left)
+        Returns:
+            (reject_reason, metrics)  合格なら reject_reason は None
+        """
+        if not self.enabled:
+            return None, {}
+
+        t = self.thresholds
+        top, right, bottom, left = loc
+        h, w = gray.shape[:2]
+        top, left     = max(top, 0), max(left, 0)
+        bottom, right = min(bottom, h), min(right, w)
+
+        metrics = {"size": min(bottom - top, right - left)}
+        if metrics["size"] < t["min_face_px"]:
+            return "size", metrics
+
+        crop = gray[top:bottom, left:right]
+        metrics["brightness"] = float(crop.mean())
+        if not t["min_brightness"] <= metrics["brightness"] <= t["max_brightness"]:
+            return "brightness", metrics
+
+        norm = cv2.resize(crop, SHARPNESS_SIZE, interpolation=cv2.INTER_AREA)
+        metrics["sharpness"] = float(cv2.Laplacian(norm, cv2.CV_64F).var())
+        if metrics["sharpness"] < t["min_sharpness"]:
+            return "sharpness", metrics
+
+        metrics["yaw_ratio"] = self._yaw_ratio(gray, loc)
+        if metrics["yaw_ratio"] > t["max_yaw_ratio"]:
+            return "pose", metrics
+
+        return None, metrics
+
+    @staticmethod
+    def _yaw_ratio(gray: np.ndarray, loc: tuple) -> float:
+        """
+        5点ランドマーク（両目の端 x4 + 鼻下）から横向き度合いを求める。
+        鼻から左右の目の中心までの水平距離の比。正面なら 1 に近い。
+        """
+        shape = fr_api.pose_predictor_5_point(gray, fr_api._css_to_rect(loc))
+        pts   = np.array([(p.x, p.y) for p in shape.parts()], dtype=np.float64)
+        right_eye = pts[0:2, 0].mean()
+        left_eye  = pts[2:4, 0].mean()
+        nose      = pts[4, 0]
+        d1, d2 = abs(nose - right_eye), abs(left_eye - nose)
+        return float(max(d1, d2) / max(min(d1, d2), 1.0))
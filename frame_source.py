@@ -0,0 +1,117 @@
+"""
+カメラの代わりのフレームソース
+
+settings.camera_source を指定すると camera_worker が USB カメラの代わりに使う。
+負荷試験（loadtest_dashboard.py）やカメラの無い開発機での動作確認用。
+
+    ""                   USB カメラ（settings.camera_index、既定）
+    "synthetic"          動く模様とフレーム番号・時刻を描いた合成フレーム
+    動画ファイルのパス    最後まで読んだら先頭に戻ってループ
+    フォルダのパス        中の jpg / png を名前順にループ
+
+どれも cv2.VideoCapture と同じ read() / isOpened() / release() を持ち、
+fps に合わせて read() の中で待つ（実カメラと同じく 15fps で流れる）。
+"""
+
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+class _Throttle:
+    """read() を fps に合わせて待たせる"""
+
+    def __init__(self, fps: float):
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self._next = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+        # 遅れたときに取り戻そうと連続で返さない
+        self._next = max(self._next + self.interval, time.monotonic())
+
+
+class SyntheticSource:
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 15):
+        self.width, self.height = width, height
+        self._throttle = _Throttle(fps)
+        self._count = 0
+        # 毎回作らないよう背景のグラデーションは先に用意しておく
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        self._base = np.dstack([np.tile(x, (height, 1))] * 3)
+
+    def isOpened(self) -> bool:
+        return True
+
+    def read(self) -> tuple[bool, np.ndarray]:
+        self._throttle.wait()
+        self._count += 1
+        frame = np.roll(self._base, self._count * 4, axis=1).copy()
+        cx = int((np.sin(self._count / 15) + 1) / 2 * (self.width - 160)) + 80
+        cv2.circle(frame, (cx, self.height // 2), 60, (200, 170, 140), -1)
+        cv2.putText(frame, f"#{self._count} {time.strftime('%H:%M:%S')}", (16, 36),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class VideoFileSource:
+    def __init__(self, path: str, fps: float = 15):
+        self.path = path
+        self._cap = cv2.VideoCapture(path)
+        self._throttle = _Throttle(fps)
+
+    def isOpened(self) -> bool:
+        return self._cap.isOpened()
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        self._throttle.wait()
+        ret, frame = self._cap.read()
+        if not ret:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        return ret, frame
+
+    def release(self):
+        self._cap.release()
+
+
+class ImageFolderSource:
+    def __init__(self, path: str, fps: float = 15):
+        paths = sorted(p for ext in ("*.jpg", "*.png") for p in glob.glob(os.path.join(path, ext)))
+        # 先に全部読み込んでおく（ディスク読み込みを負荷試験に混ぜない）
+        self._frames = [f for f in (cv2.imread(p) for p in paths) if f is not None]
+        self._throttle = _Throttle(fps)
+        self._idx = 0
+
+    def isOpened(self) -> bool:
+        return bool(self._frames)
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        self._throttle.wait()
+        if not self._frames:
+            return False, None
+        frame = self._frames[self._idx % len(self._frames)]
+        self._idx += 1
+        return True, frame
+
+    def release(self):
+        self._frames = []
+
+
+def open_source(source: str, fps: float = 15, width: int = 640, height: int = 480):
+    """camera_source の値からフレームソースを作る（"" のときは None）"""
+    if not source:
+        return None
+    if source == "synthetic":
+        return SyntheticSource(width, height, fps)
+    if os.path.isdir(source):
+        return ImageFolderSource(source, fps)
+    return VideoFileSource(source, fps)
@@ -0,0 +1,203 @@
+"""
+顔画像のバックグラウンド保存
+
+認識スレッドから cv2.imwrite を追い出し、専用スレッドで書き込む。
+キューが一杯のときは待たずに捨てる（認識を止めないことを優先）。
+
+保存先:
+    logs/images/YYYY-MM-DD/<user>_HH-MM-SS-mmm.jpg
+    logs/images/YYYY-MM-DD/unknown/unknown_HH-MM-SS-mmm.jpg
+    （mmm はミリ秒。それでも同じ名前があれば _2, _3 … を付け、上書きはしない）
+
+crop_only=True なら顔枠に crop_padding（顔サイズ比）の余白を付けた
+部分だけを保存する。フレーム全体より 1/10 程度の容量で済む。
+
+保持期間:
+    retention_days より古い日付フォルダを削除し、
+    さらに合計が max_total_mb を超えていれば古いファイルから消す。
+    cleanup_interval_sec ごとに書き込みスレッド上で実行する。
+"""
+
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import cv2
+import numpy as np
+
+
+class ImageWriter:
+    def __init__(self, base_dir: str = "logs/images", crop_only: bool = False,
+                 crop_padding: float = 0.3, jpeg_quality: int = 90, queue_size: int = 32,
+                 retention_days: int = 90, max_total_mb: float = 2048,
+                 cleanup_interval_sec: float = 3600):
+        self.base_dir       = base_dir
+        self.crop_only      = crop_only
+        self.crop_padding   = crop_padding
+        self.jpeg_quality   = jpeg_quality
+        self.retention_days = retention_days
+        self.max_total_mb   = max_total_mb
+        self.cleanup_interval_sec = cleanup_interval_sec
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._dirs: set[str] = set()    # 作成済みのフォルダ（毎回 makedirs しない）
+        self._last_cleanup = 0.0
+        # 呼び出し側のスレッド（dropped）と書き込みスレッドの両方が更新する
+        self._lock  = threading.Lock()
+        self._stats = {"written": 0, "dropped": 0, "failed": 0, "bytes": 0, "removed": 0}
+
+        threading.Thread(target=self._run, name="image-writer", daemon=True).start()
+
+    def submit(self, frame: np.ndarray, name: str, dt: datetime,
+               face_loc: tuple | None = None, unknown: bool = False) -> bool:
+        """
+        保存を依頼してすぐ戻る。frame は書き込みが終わるまで変更しないこと。
+        Returns:
+            キューに積めたら True（一杯なら捨てて False）
+        """
+        try:
+            self._queue.put_nowait((frame, name, dt, face_loc, unknown))
+            return True
+        except queue.Full:
+            self._count("dropped")
+            print(f"[ImageWriter] キューが一杯のため破棄: {name} {dt:%H:%M:%S}")
+            return False
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def snapshot(self) -> dict:
+        """/api/images 用：書き込み数・破棄数・削除数と書き込み待ちの件数"""
+        with self._lock:
+            return {**self._stats, "queued": self.queue_depth()}
+
+    def queue_depth(self) -> int:
+        """書き込み待ちの件数"""
+        return self._queue.qsize()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # ──────────────────────────────────────────
+    # 書き込みスレッド
+    # ──────────────────────────────────────────
+    def _run(self):
+        # 起動直後に一度掃除する（長期停止後の再起動でも容量を戻すため）
+        try:
+            self.cleanup()
+        except Exception as e:
+            print(f"[ImageWriter] エラー: {e}")
+        self._last_cleanup = time.monotonic()
+
+        while True:
+            try:
+                job = self._queue.get(timeout=self.cleanup_interval_sec)
+            except queue.Empty:
+                job = None
+            try:
+                if job is not None:
+                    self._write(*job)
+                if time.monotonic() - self._last_cleanup >= self.cleanup_interval_sec:
+                    self._last_cleanup = time.monotonic()
+                    self.cleanup()
+            except Exception as e:
+                print(f"[ImageWriter] エラー: {e}")
+            finally:
+                if job is not None:
+                    self._queue.task_done()
+
+    def _write(self, frame, name, dt, face_loc, unknown):
+        if self.crop_only and face_loc is not None:
+            frame = self._crop(frame, face_loc)
+
+        save_dir = os.path.join(self.base_dir, dt.strftime("%Y-%m-%d"))
+        if unknown:
+            save_dir = os.path.join(save_dir, "unknown")
+        if save_dir not in self._dirs:
+            os.makedirs(save_dir, exist_ok=True)
+            self._dirs.add(save_dir)
+
+        stem = f"{name}_{dt:%H-%M-%S}-{dt.microsecond // 1000:03d}"
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            self._count("failed")
+            print(f"[ImageWriter] エンコード失敗: {stem}")
+            return
+        # 同じ名前が既にあれば連番を付ける（"x" は既存ファイルを開かない）
+        suffix = 1
+        while True:
+            filepath = os.path.join(save_dir, f"{stem}.jpg" if suffix == 1 else f"{stem}_{suffix}.jpg")
+            try:
+                with open(filepath, "xb") as f:
+                    f.write(buf.tobytes())
+                break
+            except FileExistsError:
+                suffix += 1
+        with self._lock:
+            self._stats["written"] += 1
+            self._stats["bytes"]   += len(buf)
+
+    def _crop(self, frame: np.ndarray, loc: tuple) -> np.ndarray:
+        top, right, bottom, left = loc
+        pad_y = int((bottom - top) * self.crop_padding)
+        pad_x = int((right - left) * self.crop_padding)
+        h, w  = frame.shape[:2]
+        return frame[max(top - pad_y, 0):min(bottom + pad_y, h),
+                     max(left - pad_x, 0):min(right + pad_x, w)]
+
+    # ──────────────────────────────────────────
+    # 保持期間・容量の管理
+    # ──────────────────────────────────────────
+    def cleanup(self):
+        if not os.path.isdir(self.base_dir):
+            return
+
+        # 期限切れの日付フォルダを丸ごと削除
+        cutoff = date.today() - timedelta(days=self.retention_days)
+        for entry in sorted(os.scandir(self.base_dir), key=lambda e: e.name):
+            day = self._parse_day(entry)
+            if day is not None and day < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                self._dirs = {d for d in self._dirs if not d.startswith(entry.path)}
+                self._count("removed")
+                print(f"[ImageWriter] 保持期間切れを削除: {entry.path}")
+
+        # 容量超過なら古いファイルから削除
+        files = []
+        for root, _, names in os.walk(self.base_dir):
+            for n in names:
+                path = os.path.join(root, n)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        limit = self.max_total_mb * 1024 * 1024
+        for _, size, path in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._count("removed")
+
+    @staticmethod
+    def _parse_day(entry: os.DirEntry) -> date | None:
+        if not entry.is_dir():
+            return None
+        try:
+            return datetime.strptime(entry.name, "%Y-%m-%d").date()
+        except ValueError:
+            return None
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+ダッシュボード（app.py）の負荷試験（CLI）
+
+MJPEG ストリーム（/video_feed）を N 本、状態ポーリング（/api/status）を M 本、
+退室確認（/api/exit_confirm）を一定レートで同時に流し、
+何台のキオスク・壁面モニターまで耐えられるかを測る。
+
+カメラは使わず、app.py 側を settings.camera_source = "synthetic"
+（または録画した動画・画像フォルダ）で起動して試す:
+
+    # config.json の settings.camera_source を "synthetic" にして
+    python app.py
+    python loadtest_dashboard.py --streams 20 --pollers 50 --duration 60 --pid $(pgrep -f "python app.py")
+
+指標:
+    ストリーム   クライアントごとの受信 fps（平均・最小・下位5%）、最初のフレームまでの時間、受信量
+    ポーリング   /api/status の応答時間 p50 / p95 / p99、エラー数
+    退室確認     /api/exit_confirm の応答時間（応答内容は問わない）
+    サーバー     --pid を渡すと CPU 使用率とスレッド数を1秒ごとに記録する（Linux の /proc）
+"""
+
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+BOUNDARY = b"--frame\r\n"
+
+
+def _percentiles(values_ms: list[float]) -> dict:
+    if not values_ms:
+        return {"count": 0}
+    arr = np.asarray(values_ms)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"count": len(arr), "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2), "max_ms": round(float(arr.max()), 2)}
+
+
+class LoadTest:
+    def __init__(self, url: str, duration: float, timeout: float = 10.0, stream_query: str = ""):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stream_path = "/video_feed" + (f"?{stream_query}" if stream_query else "")
+        self.duration = duration
+        self.timeout  = timeout
+        self.stop_at  = 0.0
+
+        self._lock = threading.Lock()
+        self.streams: list[dict] = []
+        self.latency: dict[str, list[float]] = {"status": [], "exit_confirm": []}
+        self.errors:  dict[str, int] = {"stream": 0, "status": 0, "exit_confirm": 0}
+        self.server:  list[dict] = []
+
+    def _conn(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _error(self, kind: str):
+        with self._lock:
+            self.errors[kind] += 1
+
+    # ──────────────────────────────────────────
+    # MJPEG ストリーム
+    # ──────────────────────────────────────────
+    def stream_client(self, cid: int):
+        stats = {"id": cid, "frames": 0, "bytes": 0, "first_frame_ms": None, "seconds": 0.0}
+        with self._lock:
+            self.streams.append(stats)
+        started = time.monotonic()
+        try:
+            conn = self._conn()
+            conn.request("GET", self.stream_path)
+            res = conn.getresponse()
+            if res.status in (301, 302, 303, 307) and res.getheader("Location"):
+                # stream.enabled のときは StreamServer のポートへ転送される
+                res.read()
+                conn.close()
+                loc = urllib.parse.urlsplit(res.getheader("Location"))
+                conn = http.client.HTTPConnection(loc.hostname, loc.port or 80, timeout=self.timeout)
+                conn.request("GET", loc.path + (f"?{loc.query}" if loc.query else ""))
+                res = conn.getresponse()
+            if res.status != 200:
+                self._error("stream")
+                return
+            tail = b""
+            while time.monotonic() < self.stop_at:
+                chunk = res.read1(65536)
+                if not chunk:
+                    self._error("stream")   # サーバーが切った
+                    break
+                stats["bytes"] += len(chunk)
+                data = tail + chunk
+                n = data.count(BOUNDARY)
+                if n and stats["first_frame_ms"] is None:
+                    stats["first_frame_ms"] = round((time.monotonic() - started) * 1000, 1)
+                stats["frames"] += n
+                # 境界が chunk をまたいでも数え漏れないよう末尾を残す
+                tail = data[-(len(BOUNDARY) - 1):]
+            conn.close()
+        except (OSError, http.client.HTTPException):
+            self._error("stream")
+        finally:
+            stats["seconds"] = time.monotonic() - started
+
+    # ──────────────────────────────────────────
+    # 状態ポーリング / 退室確認
+    # ──────────────────────────────────────────
+    def _timed(self, conn, kind: str, method: str, path: str, body: bytes | None = None):
+        t0 = time.perf_counter()
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            res = conn.getresponse()
+            res.read()
+            if res.status >= 500:
+                self._error(kind)
+                return
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._error(kind)
+            return
+        with self._lock:
+            self.latency[kind].append((time.perf_counter() - t0) * 1000)
+
+    def status_poller(self, interval: float):
+        conn = self._conn()
+        while time.monotonic() < self.stop_at:
+            t0 = time.monotonic()
+            self._timed(conn, "status", "GET", "/api/status")
+            time.sleep(max(interval - (time.monotonic() - t0), 0))
+        conn.close()
+
+    def exit_confirmer(self, rate: float):
+        conn = self._conn()
+        body = json.dumps({"confirmed": False}).encode()
+        while time.monotonic() < self.stop_at:
+            t0 = time.monotonic()
+            self._timed(conn, "exit_confirm", "POST", "/api/exit_confirm", body)
+            time.sleep(max(1.0 / rate - (time.monotonic() - t0), 0))
+        conn.close()
+
+    # ──────────────────────────────────────────
+    # サーバープロセスの CPU / スレッド数
+    # ──────────────────────────────────────────
+    def server_sampler(self, pid: int):
+        ticks = os.sysconf("SC_CLK_TCK")
+        prev_cpu, prev_t = None, None
+        while time.monotonic() < self.stop_at:
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu = (int(fields[11]) + int(fields[12])) / ticks   # utime + stime
+                with open(f"/proc/{pid}/status") as f:
+                    threads = next(int(l.split()[1]) for l in f if l.startswith("Threads:"))
+            except (OSError, StopIteration, IndexError, ValueError):
+                return
+            now = time.monotonic()
+            if prev_cpu is not None:
+                self.server.append({"cpu_pct": round((cpu - prev_cpu) / (now - prev_t) * 100, 1),
+                                    "threads": threads})
+            prev_cpu, prev_t = cpu, now
+            time.sleep(1.0)
+
+    # ──────────────────────────────────────────
+    def run(self, streams: int, pollers: int, poll_interval: float,
+            exit_rate: float, ramp_sec: float, pid: int | None) -> dict:
+        self.stop_at = time.monotonic() + ramp_sec + self.duration
+        threads = []
+        if pid:
+            threads.append(threading.Thread(target=self.server_sampler, args=(pid,), daemon=True))
+        threads += [threading.Thread(target=self.stream_client, args=(i,), daemon=True)
+                    for i in range(streams)]
+        threads += [threading.Thread(target=self.status_poller, args=(poll_interval,), daemon=True)
+                    for _ in range(pollers)]
+        if exit_rate > 0:
+            threads.append(threading.Thread(target=self.exit_confirmer, args=(exit_rate,), daemon=True))
+
+        # 一斉に繋がないよう ramp_sec かけて順に開始する
+        step = ramp_sec / max(len(threads), 1)
+        for t in threads:
+            t.start()
+            time.sleep(step)
+        for t in threads:
+            t.join(timeout=max(self.stop_at - time.monotonic(), 0) + self.timeout + 1)
+        return self.report()
+
+    def report(self) -> dict:
+        fps = sorted(s["frames"] / s["seconds"] for s in self.streams if s["seconds"] > 0)
+        first = [s["first_frame_ms"] for s in self.streams if s["first_frame_ms"] is not None]
+        return {
+            "streams": {
+                "clients":      len(self.streams),
+                "fps_avg":      round(float(np.mean(fps)), 2) if fps else None,
+                "fps_min":      round(fps[0], 2) if fps else None,
+                "fps_p5":       round(float(np.percentile(fps, 5)), 2) if fps else None,
+                "first_frame":  _percentiles(first),
+                "mbytes_total": round(sum(s["bytes"] for s in self.streams) / 1e6, 1),
+                "errors":       self.errors["stream"],
+            },
+            "status":       {**_percentiles(self.latency["status"]), "errors": self.errors["status"]},
+            "exit_confirm": {**_percentiles(self.latency["exit_confirm"]),
+                             "errors": self.errors["exit_confirm"]},
+            "server": {
+                "cpu_pct_avg": round(float(np.mean([s["cpu_pct"] for s in self.server])), 1)
+                               if self.server else None,
+                "cpu_pct_max": max((s["cpu_pct"] for s in self.server), default=None),
+                "threads_max": max((s["threads"] for s in self.server), default=None),
+                "samples":     self.server,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダッシュボードの負荷試験")
+    parser.add_argument("--url",           default="http://localhost:5000")
+    parser.add_argument("--streams",       type=int,   default=10, help="/video_feed の同時接続数")
+    parser.add_argument("--stream-query",  default="",
+                        help='/video_feed のクエリ（例: "scale=0.25&quality=50&fps=2"）')
+    parser.add_argument("--pollers",       type=int,   default=10, help="/api/status のポーリング数")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="ポーリング間隔（秒）")
+    parser.add_argument("--exit-rate",     type=float, default=0.2,
+                        help="/api/exit_confirm の送信レート（回/秒、0 で送らない）")
+    parser.add_argument("--duration",      type=float, default=30, help="計測時間（秒）")
+    parser.add_argument("--ramp",          type=float, default=5, help="全クライアントを繋ぎ終えるまでの秒数")
+    parser.add_argument("--pid",           type=int,   default=0, help="app.py のプロセス ID")
+    parser.add_argument("--json",          default="", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    print(f"🚀 {args.url}: streams={args.streams}, pollers={args.pollers} "
+          f"(every {args.poll_interval}s), exit_rate={args.exit_rate}/s, "
+          f"duration={args.duration}s (+ramp {args.ramp}s)")
+    result = LoadTest(args.url, args.duration, stream_query=args.stream_query).run(
+        args.streams, args.pollers, args.poll_interval, args.exit_rate, args.ramp, args.pid or None)
+
+    s = result["streams"]
+    print(f"\n📺 ストリーム {s['clients']} 本: fps 平均 {s['fps_avg']} / 最小 {s['fps_min']} / "
+          f"下位5% {s['fps_p5']}、最初のフレーム p95 {s['first_frame'].get('p95_ms')} ms、"
+          f"受信 {s['mbytes_total']} MB、エラー {s['errors']}")
+    for key, label in (("status", "📊 /api/status"), ("exit_confirm", "🚪 /api/exit_confirm")):
+        r = result[key]
+        if r["count"]:
+            print(f"{label}: {r['count']} 件 p50 {r['p50_ms']} / p95 {r['p95_ms']} / "
+                  f"p99 {r['p99_ms']} ms、エラー {r['errors']}")
+    srv = result["server"]
+    if srv["samples"]:
+        print(f"🖥  サーバー: CPU 平均 {srv['cpu_pct_avg']}% / 最大 {srv['cpu_pct_max']}%、"
+              f"スレッド数 最大 {srv['threads_max']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), **result}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
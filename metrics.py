@@ -0,0 +1,233 @@
+"""
+軽量メトリクス（Prometheus テキスト形式）
+
+prometheus_client を入れずに、カウンター・ゲージ・ヒストグラムだけを持つ。
+記録は1回あたりロック1つと数回の加算で済むので、認識ループや
+フレームごとのエンコードの中で呼んでも負担にならない。
+
+使い方:
+    import metrics
+    FRAMES = metrics.counter("camera_frames_total", "カメラから読めたフレーム数")
+    FRAMES.inc()
+
+    DETECT = metrics.histogram("recognition_stage_seconds", "段階別の処理時間",
+                               labels=("stage",))
+    DETECT.observe(0.012, stage="detect")
+
+    metrics.render()   # /metrics の本文
+
+同じ名前で2回作ると最初のものを返す（モジュールの再読込や
+複数インスタンスから呼んでも重複登録にならない）。
+名前には自動で "face_attendance_" が付く。
+"""
+
+import bisect
+import threading
+import time
+
+PREFIX = "face_attendance_"
+
+# 秒単位の既定バケット（1ms〜10s）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name   = PREFIX + name
+        self.help   = help
+        self.labels = tuple(labels)
+        self._lock  = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, kw: dict) -> tuple:
+        return tuple(kw.get(n, "") for n in self.labels)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_label_str(self.labels, k)} {_fmt(v)}"
+                                 for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), func=None):
+        super().__init__(name, help, labels)
+        self._func = func   # 出力時に値を取る関数（ラベルなしのときだけ）
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def render(self) -> list[str]:
+        if self._func is not None:
+            try:
+                self.set(self._func())
+            except Exception:
+                pass
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_label_str(self.labels, k)} {_fmt(v)}"
+                                 for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                # [バケットごとの件数..., +Inf の件数], 合計, 件数
+                h = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][idx] += 1
+            h[1] += value
+            h[2] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """with metrics_obj.time(stage="x"): ... で経過時間を記録する"""
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(k, (list(h[0]), h[1], h[2])) for k, h in sorted(self._values.items())]
+        lines = self._header()
+        for key, (counts, total, n) in items:
+            cum = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                le = _label_str(self.labels, key, f'le="{_fmt(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cum}")
+            lbl = _label_str(self.labels, key)
+            lines.append(f"{self.name}_sum{lbl} {_fmt(total)}")
+            lines.append(f"{self.name}_count{lbl} {n}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: dict):
+        self._hist, self._labels = hist, labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._t0, **self._labels)
+        return False
+
+
+class RateGauge:
+    """
+    直近 window_sec の件数から毎秒のレートを出すゲージ（カメラ FPS 用）。
+    tick() は時刻を1つ記録するだけ。
+    """
+
+    def __init__(self, name: str, help: str, window_sec: float = 5.0):
+        self.window_sec = window_sec
+        self._lock  = threading.Lock()
+        self._times: list[float] = []
+        gauge(name, help, func=self.rate)
+
+    def tick(self):
+        now = time.monotonic()
+        with self._lock:
+            self._times.append(now)
+            if len(self._times) > 1024 or now - self._times[0] > self.window_sec * 2:
+                self._trim(now)
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            return round(len(self._times) / self.window_sec, 2)
+
+    def _trim(self, now: float):
+        cutoff = now - self.window_sec
+        idx = bisect.bisect_left(self._times, cutoff)
+        del self._times[:idx]
+
+
+def _register(cls, name: str, *args, **kwargs):
+    with _registry_lock:
+        m = _registry.get(PREFIX + name)
+        if m is None:
+            m = _registry[PREFIX + name] = cls(name, *args, **kwargs)
+        return m
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name: str, help: str, labels: tuple = (), func=None) -> Gauge:
+    return _register(Gauge, name, help, labels, func)
+
+
+def histogram(name: str, help: str, labels: tuple = (),
+              buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, labels, buckets)
+
+
+def render() -> str:
+    """登録済みの全メトリクスを Prometheus テキスト形式で返す"""
+    with _registry_lock:
+        ms = list(_registry.values())
+    lines = []
+    for m in ms:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Slack Webhook のモックサーバー（ポート 5099）
+
+SlackNotifier の再送・バックオフ・dead-letter を、本物の Slack に
+送らずに確認するためのローカルサーバー。受け取ったメッセージを表示する。
+
+使い方:
+    python mock_slack.py
+    python mock_slack.py --delay 3                 # 応答を3秒遅らせる
+    python mock_slack.py --fail-rate 0.5           # 半分を 503 で失敗させる
+    python mock_slack.py --rate-limit 10           # 1分あたり10件を超えたら 429
+
+config.json の Webhook URL を http://localhost:5099/<任意のパス> に向けて使う。
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+args = None
+lock = threading.Lock()
+stats = {"requests": 0, "ok": 0, "failed": 0, "rate_limited": 0, "connections": 0}
+recent: list[float] = []   # レート制限用の受信時刻
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive を受け付ける
+
+    def setup(self):
+        super().setup()
+        with lock:
+            stats["connections"] += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body   = self.rfile.read(length)
+        now    = time.time()
+
+        with lock:
+            stats["requests"] += 1
+            recent[:] = [t for t in recent if now - t < 60]
+            limited = args.rate_limit and len(recent) >= args.rate_limit
+            if not limited:
+                recent.append(now)
+
+        if args.delay:
+            time.sleep(args.delay)
+
+        if limited:
+            with lock: stats["rate_limited"] += 1
+            self._reply(429, b"rate_limited", {"Retry-After": "5"})
+            return
+        if random.random() < args.fail_rate:
+            with lock: stats["failed"] += 1
+            self._reply(503, b"service_unavailable")
+            return
+
+        try:
+            text = json.loads(body).get("text", "")
+        except (json.JSONDecodeError, AttributeError):
+            text = body[:200].decode(errors="replace")
+        with lock: stats["ok"] += 1
+        print(f"[MockSlack] {self.path}: {text}")
+        self._reply(200, b"ok")
+
+    def do_GET(self):
+        # GET /stats で集計を返す
+        with lock:
+            data = json.dumps(stats).encode()
+        self._reply(200, data, {"Content-Type": "application/json"})
+
+    def _reply(self, code: int, body: bytes, headers: dict | None = None):
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *a):
+        pass
+
+
+def main():
+    global args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port",       type=int,   default=5099)
+    parser.add_argument("--delay",      type=float, default=0.0, help="応答までの秒数")
+    parser.add_argument("--fail-rate",  type=float, default=0.0, help="503 を返す確率")
+    parser.add_argument("--rate-limit", type=int,   default=0,   help="1分あたりの上限（0 で無制限）")
+    args = parser.parse_args()
+
+    print(f"[MockSlack] http://localhost:{args.port} で起動します "
+          f"(delay={args.delay}s, fail_rate={args.fail_rate}, rate_limit={args.rate_limit}/min)")
+    ThreadingHTTPServer(("0.0.0.0", args.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
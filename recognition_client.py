@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+顔認識サービス クライアント + 負荷テスト（CLI）
+
+recognition_service.py を呼び出すキオスク側のクライアント。
+単体で実行すると、画像フォルダの JPEG を並列に送り続ける負荷テストになる。
+
+使い方:
+    python recognition_client.py --images ~/new_faces --concurrency 8 --requests 500
+    python recognition_client.py --images ~/crops --crop --url http://10.0.0.5:5003
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+
+class RecognitionClient:
+    def __init__(self, url: str = "http://localhost:5003", timeout_sec: float = 10.0):
+        self.url         = url.rstrip("/")
+        self.timeout_sec = timeout_sec
+
+    def recognize(self, jpeg: bytes, crop: bool = False) -> dict:
+        """
+        JPEG を送って照合結果を受け取る。
+        crop=True なら画像全体を1つの顔として扱う。
+        """
+        url = f"{self.url}/api/recognize" + ("?crop=1" if crop else "")
+        req = urllib.request.Request(
+            url, data=jpeg, method="POST",
+            headers={"Content-Type": "image/jpeg", "Content-Length": str(len(jpeg))},
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout_sec) as res:
+            return json.loads(res.read())
+
+    def stats(self) -> dict:
+        with urllib.request.urlopen(f"{self.url}/api/stats", timeout=self.timeout_sec) as res:
+            return json.loads(res.read())
+
+
+def load_test(client: RecognitionClient, payloads: list[bytes], crop: bool,
+              concurrency: int, total: int) -> dict:
+    lock      = threading.Lock()
+    latencies = []
+    errors    = 0
+    counter   = iter(range(total))
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                client.recognize(payloads[i % len(payloads)], crop=crop)
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    start   = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests":   total,
+        "errors":     errors,
+        "wall_sec":   round(wall, 3),
+        "throughput": round(len(latencies) / wall, 2),
+        "p50_ms":     round(float(np.percentile(lat, 50)), 2),
+        "p95_ms":     round(float(np.percentile(lat, 95)), 2),
+        "p99_ms":     round(float(np.percentile(lat, 99)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url",         default="http://localhost:5003")
+    parser.add_argument("--images",      default=os.path.expanduser("~/new_faces"))
+    parser.add_argument("--crop",        action="store_true", help="画像を顔の切り抜きとして送る")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests",    type=int, default=200)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.images, "**", "*.jpg"), recursive=True))
+    if not paths:
+        print(f"❌ JPEG が見つかりません: {args.images}")
+        sys.exit(1)
+    payloads = [open(p, "rb").read() for p in paths]
+
+    client = RecognitionClient(args.url)
+    print(f"🚀 {args.url} に {args.requests} 件 / 並列 {args.concurrency} "
+          f"（画像 {len(payloads)} 枚）")
+    result = load_test(client, payloads, args.crop, args.concurrency, args.requests)
+    result["server"] = client.stats()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
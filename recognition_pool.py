@@ -0,0 +1,229 @@
+"""
+プロセスプール型 顔認識バックエンド
+
+FaceEngine.recognize を N 個のワーカープロセスで並列に実行し、
+Flask / カメラ / JPEG エンコードと GIL を奪い合わないようにする。
+
+フレームの受け渡し:
+    ワーカーごとに multiprocessing.shared_memory のスロットを1枚確保する。
+    親プロセスはフレームをスロットへコピーし、タスクキューには
+    (seq, shape, スロット名) だけを送る。フレーム本体は pickle しない。
+    スロットより大きいフレーム（640x480 を超えるカメラ）が来たら、その
+    ワーカーのスロットを作り直して名前ごと渡す（ワーカーは付け替える）。
+
+結果の受け取り:
+    全ワーカー共通の結果キューに (worker_idx, seq, RecognitionResult) が返る。
+
+ワーカーの再起動:
+    check_workers() が死んだワーカーを検出して同じスロットで再起動する。
+    app.py の watchdog_worker から定期的に呼ばれる。
+
+注意:
+    ワーカーは forkserver で起動する。スレッドの動いているプロセスから fork すると
+    他のスレッドが握っていたロックを子が引き継いで固まることがあるため
+    （再起動は watchdog_worker から、スレッドが動いている最中に行われる）。
+    forkserver のサーバーは新しいインタープリタなので face_engine を読み込んだ状態で
+    待たせておき、ワーカーはそこから fork する。
+    spawn / forkserver は通常、子プロセスで __main__（app.py）を import し直すが、
+    app.py は import するだけで出退勤ログやSlack送信を始めてしまう。そのため
+    ワーカーを起動する間だけ __main__ をこのモジュールに見せて、子で app.py が
+    読み込まれないようにしている。
+"""
+
+import multiprocessing as mp
+import queue
+import sys
+import threading
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from recognition_types import RecognitionResult
+
+# 640x480 BGR を1枚格納できるサイズ
+DEFAULT_SLOT_BYTES = 640 * 480 * 3
+
+# ワーカー起動完了の通知に使う seq
+_READY = -1
+
+
+def _worker_main(idx: int, shm_name: str, task_q, result_q, engine_kwargs: dict):
+    """子プロセス本体：自前の FaceEngine でスロット上のフレームを認識する"""
+    # dlib / モデルの読み込みは子プロセス側だけで行う（親の起動を待たせない。
+    # forkserver が読み込み済みならここは一瞬）
+    from face_engine import FaceEngine
+
+    shm    = shared_memory.SharedMemory(name=shm_name)
+    engine = FaceEngine(**engine_kwargs)
+    result_q.put((idx, _READY, None))
+
+    try:
+        while True:
+            task = task_q.get()
+            if task is None:
+                break
+            if task[0] == "reload":
+                engine.load_faces()
+                continue
+
+            _, seq, shape, skip_box, slot_name = task
+            if slot_name != shm.name:
+                # 親が大きいスロットに作り直した
+                shm.close()
+                shm = shared_memory.SharedMemory(name=slot_name)
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            try:
+                result = engine.recognize_detail(frame, skip_box=skip_box)
+            except Exception as e:
+                print(f"[RecognitionPool] worker{idx} 認識エラー: {e}")
+                result = RecognitionResult()
+            del frame
+            result_q.put((idx, seq, result))
+    finally:
+        shm.close()
+
+
+class RecognitionPool:
+    def __init__(self, num_workers: int, engine_kwargs: dict,
+                 slot_bytes: int = DEFAULT_SLOT_BYTES):
+        self.num_workers   = num_workers
+        self.engine_kwargs = engine_kwargs
+        self.slot_bytes    = slot_bytes
+
+        self._ctx      = mp.get_context("forkserver")
+        self._ctx.set_forkserver_preload(["face_engine"])
+        self._result_q = self._ctx.Queue()
+        self._lock     = threading.Lock()
+        self._workers: list[dict] = []
+
+        for idx in range(num_workers):
+            shm = shared_memory.SharedMemory(create=True, size=slot_bytes)
+            self._workers.append({
+                "shm":      shm,
+                "proc":     None,
+                "task_q":   None,
+                "busy":     True,    # ready 通知が来るまではタスクを渡さない
+                "ready":    False,
+                "restarts": 0,
+            })
+            self._start_worker(idx)
+
+        print(f"[RecognitionPool] {num_workers} ワーカーを起動しました")
+
+    def _start_worker(self, idx: int):
+        w = self._workers[idx]
+        w["task_q"] = self._ctx.Queue()
+        w["busy"]   = True
+        w["ready"]  = False
+        w["proc"]   = self._ctx.Process(
+            target=_worker_main,
+            args=(idx, w["shm"].name, w["task_q"], self._result_q, self.engine_kwargs),
+            name=f"recognition-{idx}",
+            daemon=True,
+        )
+        # 子で app.py を import し直させない（モジュール冒頭の注意を参照）
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            w["proc"].start()
+        finally:
+            sys.modules["__main__"] = main
+
+    def _fit_slot(self, idx: int, nbytes: int):
+        """ワーカー idx のスロットを nbytes 以上に作り直す（ワーカーが空いているときだけ呼ぶ）"""
+        w = self._workers[idx]
+        old = w["shm"]
+        w["shm"] = shared_memory.SharedMemory(create=True, size=nbytes)
+        old.close()
+        old.unlink()   # ワーカーは次のタスクで新しいスロットに付け替える
+        print(f"[RecognitionPool] worker{idx} のスロットを {old.size} → {nbytes} バイトに拡張しました")
+
+    # ──────────────────────────────────────────
+    # Public API
+    # ──────────────────────────────────────────
+    def submit(self, frame: np.ndarray, seq: int, skip_box: tuple | None = None) -> bool:
+        """
+        空いているワーカーにフレームを渡す。
+        全ワーカーが処理中なら False を返す（フレームは捨ててよい）。
+        skip_box は FaceEngine.recognize_detail() にそのまま渡す。
+        スロットに入らない大きさのフレームは、そのワーカーのスロットを広げてから渡す。
+        """
+        with self._lock:
+            for idx, w in enumerate(self._workers):
+                if w["busy"] or not w["proc"].is_alive():
+                    continue
+                if frame.nbytes > w["shm"].size:
+                    self._fit_slot(idx, frame.nbytes)
+                slot = np.ndarray(frame.shape, dtype=np.uint8, buffer=w["shm"].buf)
+                slot[...] = frame
+                del slot
+                w["busy"] = True
+                w["task_q"].put(("recognize", seq, frame.shape, skip_box, w["shm"].name))
+                return True
+        return False
+
+    def get_result(self, timeout: float) -> tuple[int, RecognitionResult] | None:
+        """
+        結果を1件受け取る。timeout 内に無ければ None。
+        Returns:
+            (seq, RecognitionResult)
+        """
+        try:
+            idx, seq, result = self._result_q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        with self._lock:
+            self._workers[idx]["busy"] = False
+            if seq == _READY:
+                self._workers[idx]["ready"] = True
+        if seq == _READY:
+            print(f"[RecognitionPool] worker{idx} 準備完了")
+            return None
+        return seq, result
+
+    def ready_workers(self) -> int:
+        """モデルの読み込みを終えて動いているワーカー数"""
+        with self._lock:
+            return sum(1 for w in self._workers if w["ready"] and w["proc"].is_alive())
+
+    def reload(self):
+        """各ワーカーに encodings.pkl の再読込を指示する"""
+        with self._lock:
+            for w in self._workers:
+                if w["proc"].is_alive():
+                    w["task_q"].put(("reload",))
+
+    def check_workers(self) -> list[str]:
+        """
+        死んだワーカーを再起動する。
+        Returns:
+            再起動したワーカーごとのメッセージ（ウォッチドッグのアラート用）
+        """
+        messages = []
+        with self._lock:
+            for idx, w in enumerate(self._workers):
+                proc = w["proc"]
+                if proc.is_alive():
+                    continue
+                code = proc.exitcode
+                proc.join(timeout=0)
+                w["restarts"] += 1
+                self._start_worker(idx)
+                messages.append(
+                    f"認識ワーカー{idx} が停止 (exitcode={code}) → 再起動 "
+                    f"({w['restarts']} 回目)"
+                )
+        return messages
+
+    def close(self):
+        with self._lock:
+            for w in self._workers:
+                if w["proc"].is_alive():
+                    w["task_q"].put(None)
+            for w in self._workers:
+                w["proc"].join(timeout=3)
+                if w["proc"].is_alive():
+                    w["proc"].terminate()
+                w["shm"].close()
+                w["shm"].unlink()
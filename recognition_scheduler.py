@@ -0,0 +1,160 @@
+"""
+顔認識スケジューラ
+
+固定間隔の sleep の代わりに、直前の認識結果と処理時間から
+次に認識する時刻を決める。
+
+状態と認識間隔:
+    unresolved  顔はあるが未確定（unknown / エンコード失敗） → active_interval
+    resolved    登録済みの人物を認識中                       → base_interval
+    empty       顔なし → base_interval から倍々で idle_max まで間隔を延ばす
+
+    empty で待機中も新しいフレームごとに縮小画像の差分（動き検出）だけは行い、
+    動きがあれば間隔を待たずに即認識する。誰もいない間はほぼ CPU を使わず、
+    人が来たときの遅延は最小になる。ただし動きで起こすのは前回の認識開始から
+    motion_min_interval 以上たってから（木の揺れ・照明のちらつきが続いても
+    毎フレーム認識しない）。
+
+スレッド:
+    状態の更新（update / wake）は認識スレッドと Flask のスレッド（退室確認）の
+    両方から呼ばれるので、計測値と同じロックで守る。
+
+フレーム:
+    前回処理したものより新しい seq のフレームだけを処理する。
+    常に最新の1枚を見るのでキューに古いフレームが溜まることはない。
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# 動き検出用の縮小サイズ
+MOTION_SIZE = (80, 60)
+
+# レイテンシの指数移動平均の係数
+EMA_ALPHA = 0.2
+
+
+class RecognitionScheduler:
+    def __init__(self, base_interval_ms: float = 500, active_interval_ms: float = 100,
+                 idle_max_ms: float = 2000, motion_threshold: float = 4.0,
+                 motion_min_interval_ms: float = 250):
+        self.base_interval    = base_interval_ms   / 1000.0
+        self.active_interval  = active_interval_ms / 1000.0
+        self.idle_max         = idle_max_ms        / 1000.0
+        self.motion_threshold = motion_threshold
+        self.motion_min_interval = motion_min_interval_ms / 1000.0
+
+        self.last_seq = 0
+        self.state    = "empty"
+        self._idle_interval = self.base_interval
+        self._next_due      = 0.0
+        self._last_started  = 0.0   # 直近の認識を始めた時刻（time.monotonic）
+        self._prev_thumb: np.ndarray | None = None
+
+        self._lock    = threading.Lock()
+        self._latency: dict[str, dict] = {}
+        self._skipped = 0
+
+    # ──────────────────────────────────────────
+    # フレーム選択
+    # ──────────────────────────────────────────
+    def is_new(self, seq: int) -> bool:
+        return seq > self.last_seq
+
+    def consume(self, seq: int):
+        """seq までのフレームを処理済みにする（間のフレームは捨てる）"""
+        with self._lock:
+            self._skipped += max(seq - self.last_seq - 1, 0)
+        self.last_seq = seq
+
+    @property
+    def idle(self) -> bool:
+        return self.state == "empty"
+
+    def time_until_due(self) -> float:
+        return self._next_due - time.monotonic()
+
+    def motion(self, frame: np.ndarray) -> bool:
+        """直前に見たフレームとの差分が閾値を超えたら True"""
+        small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        thumb = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        prev, self._prev_thumb = self._prev_thumb, thumb
+        if prev is None:
+            return True
+        return float(cv2.absdiff(thumb, prev).mean()) >= self.motion_threshold
+
+    def motion_wake(self, frame: np.ndarray) -> bool:
+        """
+        待機中に動きで認識を起こしてよいか。前回の認識開始から motion_min_interval
+        たっていなければ差分も取らずに False。
+        """
+        if time.monotonic() - self._last_started < self.motion_min_interval:
+            return False
+        return self.motion(frame)
+
+    # ──────────────────────────────────────────
+    # 結果の反映
+    # ──────────────────────────────────────────
+    def update(self, name: str | None, face_loc: tuple | None, started: float):
+        """
+        認識結果から状態と次回時刻を決める。
+        started は認識を始めた時刻（time.monotonic）。処理時間は間隔に含める。
+        """
+        if face_loc is None:
+            state = "empty"
+        elif name and name != "unknown":
+            state = "resolved"
+        else:
+            state = "unresolved"
+
+        with self._lock:
+            if state == "empty":
+                if self.state == "empty":
+                    self._idle_interval = min(self._idle_interval * 2, self.idle_max)
+                else:
+                    self._idle_interval = self.base_interval
+                interval = self._idle_interval
+            elif state == "resolved":
+                interval = self.base_interval
+            else:
+                interval = self.active_interval
+
+            self.state         = state
+            self._next_due     = started + interval
+            self._last_started = started
+
+    def wake(self):
+        """退室確認の終了時など、次のフレームをすぐ認識させたいときに呼ぶ"""
+        with self._lock:
+            self.state          = "unresolved"
+            self._idle_interval = self.base_interval
+            self._next_due      = 0.0
+
+    # ──────────────────────────────────────────
+    # 計測
+    # ──────────────────────────────────────────
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            s = self._latency.setdefault(stage, {"last_ms": 0.0, "avg_ms": 0.0, "count": 0})
+            ms = seconds * 1000
+            s["last_ms"] = ms
+            s["avg_ms"]  = ms if s["count"] == 0 else s["avg_ms"] + EMA_ALPHA * (ms - s["avg_ms"])
+            s["count"]  += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latency = {k: {kk: round(vv, 2) for kk, vv in v.items()}
+                       for k, v in self._latency.items()}
+            skipped = self._skipped
+            state, idle_interval = self.state, self._idle_interval
+            next_due = self.time_until_due()
+        return {
+            "state":          state,
+            "next_due_ms":    round(max(next_due, 0) * 1000, 1),
+            "idle_interval_ms": round(idle_interval * 1000, 1),
+            "skipped_frames": skipped,
+            "latency":        latency,
+        }
@@ -0,0 +1,169 @@
+"""
+顔認識サービス - Flask 版 (ポート 5003)
+
+各キオスクが自前でモデルとギャラリーを持つ代わりに、
+性能の高い1台でまとめて認識するためのローカルサービス。
+
+使い方:
+    python recognition_service.py
+    python recognition_service.py --port 5003 --window-ms 10 --max-batch 16
+
+API:
+    POST /api/recognize          JPEG を送るとフレーム内の全ての顔を照合する
+    POST /api/recognize?crop=1   JPEG 全体を1つの顔として扱う（検出を省略）
+    GET  /api/stats              バッチ処理の統計
+
+    レスポンス:
+        {"faces": [{"name": "sato", "distance": 0.38,
+                    "location": [top, right, bottom, left]}, ...],
+         "batch_size": 4}
+
+マイクロバッチ:
+    同時に届いたリクエストを window_ms の間だけ溜めて1バッチにする。
+    ResNet へのエンコードと登録データとの照合をバッチ単位でまとめて行う。
+"""
+
+import argparse
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+from flask import Flask, jsonify, request
+
+from config import Config
+from face_engine import FaceEngine, encoding_profile
+
+
+class MicroBatcher:
+    def __init__(self, engine: FaceEngine, window_ms: float = 10, max_batch: int = 16):
+        self.engine    = engine
+        self.window    = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "faces": 0, "max_batch_seen": 0}
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, img: np.ndarray, is_crop: bool, timeout: float = 10.0) -> dict | None:
+        """リクエストスレッドから呼ぶ。バッチ処理が終わるまで待って結果を返す"""
+        item = {"img": img, "crop": is_crop, "done": threading.Event(), "result": None}
+        self._queue.put(item)
+        if not item["done"].wait(timeout):
+            return None
+        return item["result"]
+
+    def _run(self):
+        while True:
+            batch    = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._process(batch)
+            except Exception as e:
+                print(f"[Service] バッチ処理エラー: {e}")
+                for item in batch:
+                    item["result"] = {"faces": [], "batch_size": len(batch), "error": str(e)}
+            for item in batch:
+                item["done"].set()
+
+    def _process(self, batch: list[dict]):
+        # 検出は画像ごと、エンコードと照合はバッチ全体で1回
+        images, locations, owners = [], [], []
+        for i, item in enumerate(batch):
+            img = item["img"]
+            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            if item["crop"]:
+                h, w = rgb.shape[:2]
+                locs = [(0, w, h, 0)]
+            else:
+                locs = self.engine.detector.detect(img)
+            for loc in locs:
+                images.append(rgb)
+                locations.append(loc)
+                owners.append(i)
+
+        encodings = self.engine.encode_batch(images, locations)
+        matches   = self.engine.match(encodings) if len(encodings) else []
+
+        for item in batch:
+            item["result"] = {"faces": [], "batch_size": len(batch)}
+        for owner, loc, (name, dist) in zip(owners, locations, matches):
+            batch[owner]["result"]["faces"].append({
+                "name":     name,
+                "distance": round(dist, 4) if np.isfinite(dist) else None,
+                "location": list(loc),
+            })
+
+        with self._stats_lock:
+            self.stats["requests"]      += len(batch)
+            self.stats["batches"]       += 1
+            self.stats["faces"]         += len(locations)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+
+
+# ══════════════════════════════════════════════
+# Flask アプリ
+# ══════════════════════════════════════════════
+app = Flask(__name__)
+batcher: MicroBatcher | None = None
+
+
+@app.route("/api/recognize", methods=["POST"])
+def api_recognize():
+    buf = np.frombuffer(request.get_data(), dtype=np.uint8)
+    img = cv2.imdecode(buf, cv2.IMREAD_COLOR) if len(buf) else None
+    if img is None:
+        return jsonify({"ok": False, "error": "invalid image"}), 400
+
+    is_crop = request.args.get("crop", "0") == "1"
+    result  = batcher.submit(img, is_crop)
+    if result is None:
+        return jsonify({"ok": False, "error": "timeout"}), 503
+    return jsonify({"ok": "error" not in result, **result})
+
+
+@app.route("/api/stats")
+def api_stats():
+    with batcher._stats_lock:
+        stats = dict(batcher.stats)
+    stats["avg_batch"] = round(stats["requests"] / max(stats["batches"], 1), 2)
+    return jsonify(stats)
+
+
+@app.route("/api/reload_faces", methods=["POST"])
+def api_reload_faces():
+    batcher.engine.load_faces()
+    return jsonify({"ok": True, "users": batcher.engine.unique_names})
+
+
+if __name__ == "__main__":
+    config = Config("config.json")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port",      type=int,   default=config.get("service", "port"))
+    parser.add_argument("--window-ms", type=float, default=config.get("service", "batch_window_ms"))
+    parser.add_argument("--max-batch", type=int,   default=config.get("service", "max_batch"))
+    args = parser.parse_args()
+
+    engine = FaceEngine(
+        pkl_path  = config.get("paths",    "encodings_pkl"),
+        tolerance = config.get("settings", "face_tolerance"),
+        detector  = config.get("detector"),
+        encoding  = encoding_profile(config.get("encoding"), "live"),
+    )
+    batcher = MicroBatcher(engine, window_ms=args.window_ms, max_batch=args.max_batch)
+
+    print(f"[Service] http://localhost:{args.port} で起動します "
+          f"(window={args.window_ms}ms, max_batch={args.max_batch})")
+    app.run(host="0.0.0.0", port=args.port, threaded=True, debug=False)
@@ -0,0 +1,74 @@
+"""
+認識結果の型とエンコード設定
+
+dlib / face_recognition を読み込まずに使えるよう face_engine.py から分けている。
+app.py は起動直後（モデルの読み込み前）からこれらを使う。
+face_engine からも従来どおり import できる。
+"""
+
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+
+@dataclass
+class RecognitionResult:
+    """recognize_detail() の結果。プロセス間でそのまま受け渡せる"""
+    name:          str | None   = None    # 登録名 / "unknown" / None（顔なし・不採用）
+    location:      tuple | None = None    # (top, right, bottom, left)
+    distance:      float | None = None    # 最も近い登録データとの距離
+    reject_reason: str | None   = None    # 品質ゲートで不採用になった理由
+    quality:       dict         = field(default_factory=dict)
+    encoding:      np.ndarray | None = None   # エンコードした特徴ベクトル（128 次元）
+    timings:       dict         = field(default_factory=dict)   # 段階別の処理時間（秒）
+    candidates:    list         = field(default_factory=list)   # 人ごとの最小距離の上位 [(name, distance), ...]
+    tracked:       bool         = False   # 判定済みの顔と同じ位置なのでエンコードを省いた
+    decision:      str | None   = None    # DecisionFusion の判定（pending / early / fused / timeout / tracked）
+    frames:        int          = 0       # 判定に使ったフレーム数
+
+
+# encode_faces.py 導入時からの既定のエンコード設定
+DEFAULT_PROFILE = {"model": "large", "num_jitters": 1}
+
+def encoding_profile(section: dict | None, use: str) -> dict:
+    """
+    config.json の encoding セクションから用途別のプロファイルを取り出す。
+    use は "live"（リアルタイム認識）か "enroll"（encode_faces.py）。
+    """
+    section = section or {}
+    return {
+        "model":       section.get(f"{use}_model",   DEFAULT_PROFILE["model"]),
+        "num_jitters": section.get(f"{use}_jitters", DEFAULT_PROFILE["num_jitters"]),
+    }
+
+
+
+class GalleryInfo:
+    """
+    encodings.pkl の登録名とエンコード設定だけを持つ（照合はしない）。
+    recognition_workers > 0 のとき認識はワーカープロセスが行うので、親プロセスは
+    dlib・モデルを読み込まずにこれで画面のユーザー一覧や再読込の応答を作る。
+    FaceEngine と同じ引数・属性（unique_names / profile_mismatch / load_faces()）を持つ。
+    """
+
+    def __init__(self, pkl_path: str = "~/encodings.pkl", encoding: dict | None = None, **_):
+        self.pkl_path = Path(pkl_path).expanduser()
+        self.profile  = {**DEFAULT_PROFILE, **(encoding or {})}
+        self.gallery_profile  = dict(DEFAULT_PROFILE)
+        self.profile_mismatch = False
+        self.unique_names: list[str] = []
+        self.load_faces()
+
+    def load_faces(self):
+        if not self.pkl_path.exists():
+            print(f"[GalleryInfo] {self.pkl_path} が見つかりません。"
+                  "encode_faces.py を先に実行してください。")
+            self.unique_names = []
+            return
+        with open(self.pkl_path, "rb") as f:
+            data = pickle.load(f)
+        self.unique_names     = sorted(set(data["names"]))
+        self.gallery_profile  = {**DEFAULT_PROFILE, **data.get("profile", {})}
+        self.profile_mismatch = self.gallery_profile["model"] != self.profile["model"]
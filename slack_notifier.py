@@ -1,19 +1,141 @@
 """
 Slack 通知モジュール（KIT プロキシ対応・全リクエスト・リダイレクト対応版）
+
+非同期配信:
+    notify_* はメッセージを上限付きキューに積むだけで即座に戻る。
+    送信はワーカースレッドが行い、失敗したら指数バックオフで再送する
+    （429 は Retry-After に従う。ただし backoff_max_sec より長い待ちを求められたら
+    ワーカーを止めずに諦める）。再送しきれなかったもの・キューが
+    満杯で積めなかったものは dead-letter ファイル（JSON Lines）に残す。
+    dead-letter の書き込みも専用スレッドが行う（キュー満杯のとき、呼び出し元の
+    認識スレッドでファイル I/O をしない）。Webhook URL は秘密情報なので
+    dead-letter には残さず、送信先のキー（ユーザー名 / "alert"）を to に残す。
+
+    async_delivery=False にすると従来どおり呼び出し元で同期送信する。
+
+接続の使い回し:
+    ホスト（+ プロキシ）ごとに keep-alive の HTTP(S) 接続をプールし、
+    毎回の TCP / TLS ハンドシェイクとプロキシの CONNECT を省く。
+    プロキシは urllib と同じく環境変数（https_proxy / no_proxy）に従い、
+    http / https とも CONNECT のトンネル越しに送る。
+    プールから出す前に、サーバーが閉じた接続（読める状態になっている）は捨てる。
+    それでも送信の途中で切れていたと分かったときだけ張り直して送り直す。
+    応答待ちで切れた場合はサーバーが受け取っている可能性があるので、
+    その場では送り直さない（二重投稿を避ける。再送は通常の再送処理に任せる）。
+
+まとめ送り（coalesce_ms > 0 のとき）:
+    同じ送信先（Webhook URL / Bot チャンネル）宛てのメッセージを
+    coalesce_ms の間溜め、改行でつないで1通にする。朝の混雑時の
+    送信回数と 429 を減らす。
 """
 
 from __future__ import annotations
 
+import base64
+import http.client
 import json
+import os
+import queue
+import select
+import threading
+import time
 import urllib.request
-import urllib.error
 import urllib.parse
 from datetime import datetime
 from typing import Any
 
-import cv2
 import numpy as np
 
+import metrics
+from image_writer import ImageWriter
+
+SEND_SECONDS = metrics.histogram("slack_send_seconds", "Slack への1回の送信にかかった時間",
+                                 labels=("kind",))
+SEND_FAILURES = metrics.counter("slack_send_failures_total", "Slack 送信の失敗回数（再送前の1回ごと）",
+                                labels=("reason",))
+DEAD_LETTERS = metrics.counter("slack_dead_letters_total", "再送しても届かず dead-letter に回した件数")
+
+
+# 使い回した接続がサーバー側で閉じられていて送れなかったときの例外（張り直して1回だけ送る）
+_STALE_ERRORS = (ConnectionResetError, BrokenPipeError, http.client.CannotSendRequest)
+
+
+class _ConnectionPool:
+    """送信先ホストごとの keep-alive 接続プール"""
+
+    def __init__(self, timeout_sec: float, max_idle: int = 4, idle_ttl_sec: float = 60.0):
+        self.timeout_sec  = timeout_sec
+        self.max_idle     = max_idle
+        self.idle_ttl_sec = idle_ttl_sec
+        self._idle: dict[tuple, list[tuple[http.client.HTTPConnection, float]]] = {}
+        self._lock  = threading.Lock()
+        self.stats  = {"opened": 0, "reused": 0}
+
+    def acquire(self, parts: urllib.parse.SplitResult) -> tuple[tuple, http.client.HTTPConnection, bool]:
+        """
+        Returns:
+            (プールのキー, 接続, 使い回しかどうか)
+        """
+        proxy = self._proxy_for(parts)
+        key   = (parts.scheme, parts.hostname, parts.port, proxy)
+        now   = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_ttl_sec and not self._closed_by_peer(conn):
+                    self.stats["reused"] += 1
+                    return key, conn, True
+                conn.close()
+            self.stats["opened"] += 1
+        return key, self._connect(parts, proxy), False
+
+    @staticmethod
+    def _closed_by_peer(conn: http.client.HTTPConnection) -> bool:
+        """待機中の接続が読める状態 = サーバーが閉じた（応答待ちでないのにデータは来ない）"""
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def release(self, key: tuple, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def snapshot(self) -> dict:
+        """接続の新規作成・使い回しの回数"""
+        with self._lock:
+            return dict(self.stats)
+
+    @staticmethod
+    def _proxy_for(parts: urllib.parse.SplitResult) -> str | None:
+        if urllib.request.proxy_bypass(parts.hostname or ""):
+            return None
+        return urllib.request.getproxies().get(parts.scheme)
+
+    def _connect(self, parts: urllib.parse.SplitResult, proxy: str | None) -> http.client.HTTPConnection:
+        https = parts.scheme == "https"
+        cls   = http.client.HTTPSConnection if https else http.client.HTTPConnection
+        if not proxy:
+            return cls(parts.hostname, parts.port, timeout=self.timeout_sec)
+
+        p = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        headers = {}
+        if p.username:
+            cred = f"{urllib.parse.unquote(p.username)}:{urllib.parse.unquote(p.password or '')}"
+            headers["Proxy-Authorization"] = "Basic " + base64.b64encode(cred.encode()).decode()
+        # プロキシへ CONNECT してトンネル内で送る（https はトンネル内で TLS を張る）
+        conn = cls(p.hostname, p.port or 8080, timeout=self.timeout_sec)
+        conn.set_tunnel(parts.hostname, parts.port or (443 if https else 80), headers=headers)
+        return conn
+
 
 class SlackNotifier:
     def __init__(
@@ -24,6 +146,16 @@ class SlackNotifier:
         channel_id: str = "",
         timeout_sec: int = 20,
         debug: bool = True,
+        async_delivery: bool = True,
+        queue_size: int = 256,
+        workers: int = 2,
+        max_retries: int = 5,
+        backoff_base_sec: float = 1.0,
+        backoff_max_sec: float = 60.0,
+        dead_letter_path: str = "logs/slack_dead_letter.jsonl",
+        coalesce_ms: float = 0,
+        coalesce_max: int = 20,
+        image_writer: ImageWriter | None = None,
     ):
         self.user_webhooks = user_webhooks
         self.alert_webhook = alert_webhook
@@ -31,25 +163,58 @@ class SlackNotifier:
         self.channel_id = channel_id
         self.timeout_sec = timeout_sec
         self.debug = debug
+        self.image_writer = image_writer or ImageWriter()
+
+        self.async_delivery   = async_delivery
+        self.max_retries      = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec  = backoff_max_sec
+        self.dead_letter_path = dead_letter_path
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "sent": 0, "retried": 0, "dead": 0, "dropped": 0,
+                       "coalesced": 0}
+        self._dead_lock = threading.Lock()
+        self._dead_q: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self._pool = _ConnectionPool(timeout_sec)
+
+        self.coalesce_sec = coalesce_ms / 1000.0
+        self.coalesce_max = coalesce_max
+        self._pending: dict[tuple, dict] = {}   # まとめ送り待ちのメッセージ
+        self._pending_lock = threading.Lock()
+
+        if async_delivery:
+            for i in range(workers):
+                threading.Thread(target=self._delivery_worker, name=f"slack-{i}",
+                                 daemon=True).start()
+            threading.Thread(target=self._dead_letter_worker, name="slack-dead-letter",
+                             daemon=True).start()
 
     # ──────────────────────────────────────────
     # Public API
     # ──────────────────────────────────────────
-    def notify_entry(self, user: str, dt: datetime, face_frame: np.ndarray | None = None):
+    def notify_entry(self, user: str, dt: datetime, face_frame: np.ndarray | None = None,
+                     face_loc: tuple | None = None, on_done=None):
+        """
+        on_done: 送信が終わったら（成功 / 断念とも）送信スレッドから
+                 on_done(ok: bool) で呼ばれる。トレースの記録用。
+        """
         text = f"+ {user} {dt.strftime('%H:%M:%S')}"
         if self._bot_mode():
-            self._post_message(text)
+            self._post_message(text, on_done)
         else:
-            self._webhook(self.user_webhooks.get(user, ""), text)
+            self._webhook(self.user_webhooks.get(user, ""), text, on_done, to=user)
         if face_frame is not None:
-            self._save_image(face_frame, user, dt)
+            self._save_image(face_frame, user, dt, face_loc)
 
     def notify_exit(self, user: str, dt: datetime):
         text = f"- {user} {dt.strftime('%H:%M:%S')}"
         if self._bot_mode():
             self._post_message(text)
         else:
-            self._webhook(self.user_webhooks.get(user, ""), text)
+            self._webhook(self.user_webhooks.get(user, ""), text, to=user)
 
     def notify_alert(self, message: str):
         """システム障害・異常をアラート用 Webhook に通知する"""
@@ -57,80 +222,287 @@ class SlackNotifier:
             self._log(f"[Alert] alert_webhook 未設定のため送信スキップ: {message}")
             return
         text = f":warning: [SYSTEM ALERT] {message}"
-        try:
-            self._webhook(self.alert_webhook, text)
-            self._log(f"[Alert] 送信: {message}")
-        except Exception as e:
-            self._log(f"[Alert] 送信失敗: {e}")
+        self._webhook(self.alert_webhook, text, to="alert")
+        self._log(f"[Alert] 送信キュー投入: {message}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = {**self._stats, "queued": self._queue.qsize()}
+        stats.update({f"conn_{k}": v for k, v in self._pool.snapshot().items()})
+        return stats
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """まとめ送り待ちを即送信に回し、キューが空になるまで待つ（再送待ちを含む）"""
+        with self._pending_lock:
+            keys = list(self._pending)
+        for key in keys:
+            self._flush_pending(key)
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks or self._dead_q.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
 
     # ──────────────────────────────────────────
     # 汎用 HTTP リクエスト（プロキシ & リダイレクト対応）
     # ──────────────────────────────────────────
-    def _http_request(self, url: str, method: str, data: bytes, headers: dict) -> bytes:
+    def _http_request(self, url: str, method: str, data: bytes, headers: dict,
+                      _redirects: int = 0) -> tuple[int, bytes, http.client.HTTPMessage]:
+        """
+        プールした keep-alive 接続で送る。
+        Returns: (status, body, response headers)  ヘッダーは大文字小文字を区別せずに get できる
+        """
         headers["Content-Length"] = str(len(data))
-        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        parts = urllib.parse.urlsplit(url)
+
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            key, conn, reused = self._pool.acquire(parts)
+            try:
+                conn.request(method, path, body=data, headers=headers)
+            except _STALE_ERRORS as e:
+                conn.close()
+                if reused and attempt == 0:
+                    continue   # 送る途中で切れていた（サーバーは受け取っていない）
+                self._log(f"[CRITICAL] Network Error: {e}")
+                raise
+            except Exception as e:
+                conn.close()
+                self._log(f"[CRITICAL] Network Error: {e}")
+                raise
+            try:
+                res  = conn.getresponse()
+                body = res.read()
+            except Exception as e:
+                # 送った後に切れた。受け取られているかもしれないのでここでは送り直さない
+                conn.close()
+                self._log(f"[CRITICAL] Network Error: {e}")
+                raise
+
+            if res.will_close:
+                conn.close()
+            else:
+                self._pool.release(key, conn)
+            break
+
+        if res.status in (301, 302, 307, 308) and _redirects < 5:
+            new_url = res.getheader("Location")
+            if new_url:
+                new_url = urllib.parse.urljoin(url, new_url)
+                return self._http_request(new_url, method, data, headers, _redirects + 1)
+        return res.status, body, res.headers
+
+    # ──────────────────────────────────────────
+    # 非同期配信（キュー・再送・dead-letter）
+    # ──────────────────────────────────────────
+    def _deliver(self, msg: dict):
+        """
+        メッセージを送信キューに積む。同期モードならその場で送る。
+        まとめ送りが有効なら同じ送信先の保留メッセージに追記する。
+        """
+        msg.setdefault("created", time.time())
+        msg.setdefault("attempt", 0)
+        if self.async_delivery and self.coalesce_sec > 0:
+            self._coalesce(msg)
+            return
+        self._enqueue(msg)
+
+    def _coalesce(self, msg: dict):
+        key = (msg["kind"], msg.get("_url"))
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending["text"]  += "\n" + msg["text"]
+                pending["count"] += 1
+                pending["_on_done"] = pending.get("_on_done", []) + msg.get("_on_done", [])
+                full = pending["count"] >= self.coalesce_max
+            else:
+                self._pending[key] = {**msg, "count": 1}
+                timer = threading.Timer(self.coalesce_sec, self._flush_pending, args=(key,))
+                timer.daemon = True
+                timer.start()
+                return
+        self._count("coalesced")
+        if full:
+            self._flush_pending(key)
+
+    def _flush_pending(self, key: tuple):
+        with self._pending_lock:
+            msg = self._pending.pop(key, None)
+        if msg is not None:
+            self._enqueue(msg)
+
+    def _enqueue(self, msg: dict):
+        if not self.async_delivery:
+            try:
+                status, _ = self._send(msg)
+                self._done(msg, 200 <= status < 300)
+            except Exception:
+                self._done(msg, False)
+            return
         try:
-            with urllib.request.urlopen(req, timeout=self.timeout_sec) as res:
-                return res.read()
-        except urllib.error.HTTPError as e:
-            if e.code in (301, 302, 307, 308):
-                new_url = e.headers.get("Location")
-                if new_url:
-                    return self._http_request(new_url, method, data, headers)
-            return e.read()
-        except Exception as e:
-            self._log(f"[CRITICAL] Network Error: {e}")
-            raise
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            self._count("dropped")
+            self._dead_letter(msg, "queue_full")
+            return
+        self._count("enqueued")
+
+    def _delivery_worker(self):
+        while True:
+            msg = self._queue.get()
+            try:
+                self._deliver_with_retry(msg)
+            except Exception as e:
+                self._dead_letter(msg, f"unexpected: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _deliver_with_retry(self, msg: dict):
+        while True:
+            msg["attempt"] += 1
+            t0 = time.perf_counter()
+            try:
+                status, retry_after = self._send(msg)
+                error = f"HTTP {status}"
+            except Exception as e:
+                status, retry_after, error = None, None, str(e)
+            SEND_SECONDS.observe(time.perf_counter() - t0, kind=msg["kind"])
+
+            if status is not None and 200 <= status < 300:
+                self._count("sent")
+                self._done(msg, True)
+                return
+            SEND_FAILURES.inc(reason=str(status) if status is not None else "error")
+
+            # 4xx（429 以外）は再送しても通らない
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or msg["attempt"] > self.max_retries:
+                self._dead_letter(msg, error)
+                return
+
+            if retry_after is not None and retry_after > self.backoff_max_sec:
+                # 長い待ちの間ワーカーを占有すると後ろのメッセージが詰まる
+                self._dead_letter(msg, f"{error} (Retry-After {retry_after:.0f}s)")
+                return
+            delay = retry_after if retry_after is not None else min(
+                self.backoff_base_sec * 2 ** (msg["attempt"] - 1), self.backoff_max_sec)
+            delay = max(delay, 0.0)
+            self._count("retried")
+            self._log(f"[Slack] 送信失敗 ({error})、{delay:.1f}秒後に再送 "
+                      f"({msg['attempt']}/{self.max_retries})")
+            time.sleep(delay)
+
+    def _send(self, msg: dict) -> tuple[int, float | None]:
+        """
+        1回だけ送信する。
+        Returns:
+            (HTTP ステータス, Retry-After 秒 or None)
+        """
+        if msg["kind"] == "post":
+            payload = {"channel": self.channel_id, "text": msg["text"]}
+            status, body, headers = self._slack_api_call(
+                "chat.postMessage", json.dumps(payload).encode(), True)
+            # Slack API は HTTP 200 でも ok: false を返す
+            if status == 200 and not body.get("ok"):
+                print(f"[Slack] メッセージ送信失敗: {body}")
+                status = 429 if body.get("error") == "ratelimited" else 400
+        else:
+            status, _, headers = self._http_request(
+                msg["_url"], "POST", json.dumps({"text": msg["text"]}).encode(),
+                {"Content-Type": "application/json"})
+
+        retry_after = headers.get("Retry-After")   # HTTPMessage なので retry-after でも取れる
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        return status, retry_after
+
+    def _dead_letter(self, msg: dict, reason: str):
+        """
+        送れなかったメッセージを JSON Lines で残す（後から手動で再送できるように）。
+        非同期モードでは書き込みを dead-letter スレッドに任せてすぐ戻る。
+        """
+        self._count("dead")
+        DEAD_LETTERS.inc()
+        self._done(msg, False)
+        # "_" で始まるキーはプロセス内だけの値（コールバック・Webhook URL）なので残さない
+        record = {**{k: v for k, v in msg.items() if not k.startswith("_")},
+                  "reason": reason, "failed_at": time.time()}
+        print(f"[Slack] 送信断念 ({reason}): {msg.get('text')}")
+        if not self.async_delivery:
+            self._write_dead_letter(record)
+            return
+        try:
+            self._dead_q.put_nowait(record)
+        except queue.Full:
+            print(f"[Slack] dead-letter の書き込みが追いつかないため破棄: {msg.get('text')}")
+
+    def _dead_letter_worker(self):
+        while True:
+            record = self._dead_q.get()
+            try:
+                self._write_dead_letter(record)
+            finally:
+                self._dead_q.task_done()
+
+    def _write_dead_letter(self, record: dict):
+        try:
+            with self._dead_lock:
+                os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+                with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[Slack] dead-letter 書き込み失敗: {e}")
+
+    def _done(self, msg: dict, ok: bool):
+        for cb in msg.pop("_on_done", []):
+            try:
+                cb(ok)
+            except Exception as e:
+                print(f"[Slack] on_done コールバックでエラー: {e}")
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
 
     # ──────────────────────────────────────────
     # Slack API / 個別処理 (変更なし)
     # ──────────────────────────────────────────
-    def _slack_api_call(self, method: str, data: bytes, is_json: bool) -> dict[str, Any]:
+    def _slack_api_call(self, method: str, data: bytes, is_json: bool) -> tuple[int, dict[str, Any], http.client.HTTPMessage]:
         url = f"https://slack.com/api/{method}"
         ct = "application/json; charset=utf-8" if is_json else "application/x-www-form-urlencoded"
         headers = {
             "Content-Type": ct,
             "Authorization": f"Bearer {self.bot_token}",
         }
-        raw_res = self._http_request(url, "POST", data, headers)
+        status, raw_res, res_headers = self._http_request(url, "POST", data, headers)
         try:
-            return json.loads(raw_res)
+            return status, json.loads(raw_res), res_headers
         except json.JSONDecodeError:
-            return {"ok": False, "error": "invalid_response", "raw": raw_res.decode()[:200]}
-
-    def _post_message(self, text: str) -> str | None:
-        payload = {"channel": self.channel_id, "text": text}
-        res = self._slack_api_call("chat.postMessage", json.dumps(payload).encode(), True)
-        if res.get("ok"): return res.get("ts")
-        print(f"[Slack] メッセージ送信失敗: {res}")
-        return None
-
-    def _save_image(self, frame: np.ndarray, user: str, dt: datetime):
-        """顔画像を logs/images/ にローカル保存する"""
-        import os
-        save_dir = os.path.join("logs", "images")
-        os.makedirs(save_dir, exist_ok=True)
-        filename = f"{user}_{dt.strftime('%Y-%m-%d_%H-%M-%S')}.jpg"
-        filepath = os.path.join(save_dir, filename)
-        ret = cv2.imwrite(filepath, frame)
-        if ret:
-            self._log(f"[Local] 顔画像保存: {filepath}")
-        else:
-            print(f"[Local] 顔画像保存失敗: {filepath}")
-
-    def save_unknown_image(self, frame: np.ndarray, dt: datetime):
-        """未登録人物の顔画像を logs/images/unknown/ に保存する"""
-        import os
-        save_dir = os.path.join("logs", "images", "unknown")
-        os.makedirs(save_dir, exist_ok=True)
-        filename = f"unknown_{dt.strftime('%Y-%m-%d_%H-%M-%S')}.jpg"
-        filepath = os.path.join(save_dir, filename)
-        ret = cv2.imwrite(filepath, frame)
-        if ret:
-            self._log(f"[Local] unknown 顔画像保存: {filepath}")
-        else:
-            print(f"[Local] unknown 顔画像保存失敗: {filepath}")
+            return status, {"ok": False, "error": "invalid_response",
+                            "raw": raw_res.decode()[:200]}, res_headers
 
+    def _post_message(self, text: str, on_done=None):
+        self._deliver({"kind": "post", "text": text, "_on_done": [on_done] if on_done else []})
+
+    def _save_image(self, frame: np.ndarray, user: str, dt: datetime,
+                    face_loc: tuple | None = None):
+        """顔画像を logs/images/ にローカル保存する（書き込みは ImageWriter のスレッド）"""
+        if self.image_writer.submit(frame, user, dt, face_loc=face_loc):
+            self._log(f"[Local] 顔画像保存キュー投入: {user}")
+
+    def save_unknown_image(self, frame: np.ndarray, dt: datetime,
+                           face_loc: tuple | None = None, cluster_id: str | None = None):
+        """
+        未登録人物の顔画像を logs/images/<日付>/unknown/ に保存する。
+        cluster_id があればファイル名に入れる（unknown_u0003_HH-MM-SS-mmm.jpg）
+        """
+        name = f"unknown_{cluster_id}" if cluster_id else "unknown"
+        if self.image_writer.submit(frame, name, dt, face_loc=face_loc, unknown=True):
+            self._log(f"[Local] unknown 顔画像保存キュー投入: {name}")
 
     def _bot_mode(self) -> bool:
         return bool(self.bot_token and self.channel_id)
@@ -138,8 +510,8 @@ class SlackNotifier:
     def _log(self, *args):
         if self.debug: print(*args)
 
-    def _webhook(self, url: str, text: str):
+    def _webhook(self, url: str, text: str, on_done=None, to: str = ""):
+        """to は dead-letter に残す送信先のキー（URL は残さない）"""
         if not url: return
-        try:
-            self._http_request(url, "POST", json.dumps({"text": text}).encode(), {"Content-Type": "application/json"})
-        except: pass
\ No newline at end of file
+        self._deliver({"kind": "webhook", "to": to, "_url": url, "text": text,
+                       "_on_done": [on_done] if on_done else []})
\ No newline at end of file
@@ -0,0 +1,472 @@
+"""
+映像・状態のプッシュ配信（asyncio）
+
+Flask（threaded=True）の /video_feed は接続ごとにスレッドを1本ずっと占有し、
+古い接続を閉じずに繋ぎ直す壁面モニターがあるとスレッドが溜まっていく。
+ここでは配信だけを1つのイベントループ（スレッド1本）で受け持つ。
+
+    GET /video_feed   MJPEG（app.py の /video_feed と同じ形式）
+                      ?scale=0.1〜1.0 &quality=20〜95 &fps=0.5〜15 で縮小・画質・上限 fps を指定できる
+    GET /events       Server-Sent Events で /api/status と同じ内容を変化時に送る
+
+stream.enabled = false のときは Flask の /video_feed がスレッドで配信する。そのときも
+SharedEncoder で（縮小率, 画質）ごとのエンコードを1フレーム1回にし、クライアント間で共有する。
+
+仕組み:
+    - フレームは FrameHub が（縮小率, 画質）の組ごとに1回だけ JPEG にし、マルチパートの
+      1区切り分の bytes を同じ組のクライアント全員で共有する（クライアント数に比例するのは
+      送信だけ）。組の種類は max_variants まで、超えた分は既定の画質で配る
+    - fps を下げたクライアントはその間隔でだけ最新フレームを取りに行く（エンコードも増えない）
+    - 各クライアントは常に「最新の1枚」を取りに行く。送信が詰まっている間
+      （送信バッファが max_buffer_kb を超えて drain() で待っている間）に来たフレームは
+      そのクライアントの分だけ飛ばす（dropped に数える）
+    - write_timeout_sec の間まったく送れないクライアントは切断する
+    - 接続数は max_clients まで（超えたら 503）。max_per_ip を 1 以上にすると同じ IP からは
+      その本数までで、超えたらその IP の一番古い接続を閉じる（閉じずに繋ぎ直すモニター対策）。
+      NAT の内側の閲覧者を追い出さないよう既定（0）では行わない
+    - TLS は話さない（平文の HTTP のみ）。https のページからはリバースプロキシ経由で使う
+    - リクエストヘッダーが header_timeout_sec 以内に届かない接続は閉じる
+
+API（/api/...）は従来どおり Flask が受け持つ。
+"""
+
+import asyncio
+import json
+import math
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+
+import metrics
+
+STREAM_CLIENTS    = metrics.gauge("stream_clients", "/video_feed を開いているクライアント数")
+STREAM_ENCODE     = metrics.histogram("stream_jpeg_encode_seconds",
+                                      "ストリーム配信用の JPEG エンコード時間（配信パラメータごと）",
+                                      labels=("scale", "quality"))
+EVENT_CLIENTS     = metrics.gauge("stream_event_clients", "/events を開いているクライアント数")
+STREAM_DROPPED    = metrics.counter("stream_dropped_frames_total",
+                                    "送信が詰まって飛ばしたフレーム数（クライアントごとの合計）")
+STREAM_DISCONNECT = metrics.counter("stream_disconnects_total", "配信の切断・拒否の件数",
+                                    labels=("reason",))
+
+MJPEG_HEADER = (b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                b"Cache-Control: no-cache, no-store\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"Connection: close\r\n\r\n")
+SSE_HEADER = (b"HTTP/1.1 200 OK\r\n"
+              b"Content-Type: text/event-stream; charset=utf-8\r\n"
+              b"Cache-Control: no-cache\r\n"
+              b"Access-Control-Allow-Origin: *\r\n"
+              b"Connection: close\r\n\r\n")
+SSE_PING = b": ping\n\n"
+
+# /video_feed?scale=0.5&quality=60&fps=5 の範囲
+SCALE_RANGE   = (0.1, 1.0)
+QUALITY_RANGE = (20, 95)
+FPS_MIN       = 0.5
+
+
+def parse_variant(args, default_quality: int = 80, max_fps: float = 15) -> tuple[float, int, float]:
+    """
+    /video_feed のクエリ（scale / quality / fps）を (縮小率, JPEG 画質, 最大 fps) にする。
+    範囲外は丸め、scale は 0.05・quality は 5 刻みにそろえる（エンコードの種類を増やしすぎない）。
+    数値でなければ ValueError。
+    """
+    scale   = float(args.get("scale") or 1.0)
+    quality = int(args.get("quality") or default_quality)
+    fps     = float(args.get("fps") or max_fps)
+    if not (math.isfinite(scale) and math.isfinite(fps)):
+        raise ValueError("scale / fps must be finite")
+    scale   = round(min(max(scale, SCALE_RANGE[0]), SCALE_RANGE[1]) * 20) / 20
+    quality = round(min(max(quality, QUALITY_RANGE[0]), QUALITY_RANGE[1]) / 5) * 5
+    fps     = min(max(fps, FPS_MIN), max_fps)
+    return scale, quality, fps
+
+
+def encode_part(frame, scale: float, quality: int) -> bytes | None:
+    """フレームを縮小・JPEG 化し、マルチパートの1区切り分にする"""
+    t0 = time.perf_counter()
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ret, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    STREAM_ENCODE.observe(time.perf_counter() - t0, scale=f"{scale:g}", quality=quality)
+    if not ret:
+        return None
+    return b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + buf.tobytes() + b"\r\n"
+
+
+def _simple_response(status: str, body: str = "", headers: str = "") -> bytes:
+    data = body.encode()
+    return (f"HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n{headers}Connection: close\r\n\r\n").encode() + data
+
+
+class _Broadcast:
+    """最新の1件だけを持ち、新しいものが来たら待っている全員を起こす"""
+
+    def __init__(self):
+        self.seq  = 0
+        self.data = None
+        self._new = asyncio.Event()
+
+    def publish(self, data):
+        self.seq += 1
+        self.data = data
+        # 待っている側は自分が取った Event を待つので、差し替えてから set する
+        event, self._new = self._new, asyncio.Event()
+        event.set()
+
+    async def next(self, after: int, timeout: float | None = None) -> tuple[int, object]:
+        """seq が after より新しくなるまで待って (seq, data) を返す。タイムアウト時は (after, None)"""
+        while self.seq <= after:
+            try:
+                await asyncio.wait_for(self._new.wait(), timeout)
+            except asyncio.TimeoutError:
+                return after, None
+        return self.seq, self.data
+
+
+class FrameHub:
+    """
+    カメラの最新フレームを配り、配信パラメータ（縮小率・画質）ごとに
+    1フレームにつき1回だけエンコードする。同じパラメータのクライアントは
+    同じ bytes を共有し、誰も見ていないパラメータはエンコードしない。
+    """
+
+    def __init__(self, frame_fn, fps: float = 15, jpeg_quality: int = 80, max_variants: int = 8):
+        self._frame_fn = frame_fn   # () -> (通し番号, フレーム or None)
+        self.max_fps   = fps
+        self.interval  = 1.0 / fps
+        self.default   = (1.0, jpeg_quality)
+        self.max_variants = max_variants
+        self.frames    = _Broadcast()   # 元フレーム（エンコード前）
+        self.viewers: dict[tuple, int] = {}   # (scale, quality) → 見ているクライアント数
+        # (scale, quality) → (元フレームの seq, エンコード結果の Future)
+        self._cache: dict[tuple, tuple[int, asyncio.Future]] = {}
+
+    def join(self, key: tuple) -> tuple:
+        """key で見始める。種類が max_variants に達していたら既定の画質にする"""
+        if key not in self.viewers and len(self.viewers) >= self.max_variants:
+            key = self.default
+        self.viewers[key] = self.viewers.get(key, 0) + 1
+        return key
+
+    def leave(self, key: tuple):
+        self.viewers[key] -= 1
+        if not self.viewers[key]:
+            del self.viewers[key]
+            self._cache.pop(key, None)
+
+    async def part(self, key: tuple, seq: int, frame) -> bytes | None:
+        """seq のフレームを key でエンコードしたもの。同じ key の2人目以降はキャッシュを待つだけ"""
+        cached = self._cache.get(key)
+        if cached is None or cached[0] < seq:
+            # cv2.imencode / resize は GIL を離すので、ループを止めないよう別スレッドで
+            future = asyncio.get_running_loop().run_in_executor(None, encode_part, frame, *key)
+            cached = self._cache[key] = (seq, future)
+        # 待っている1人が切断しても他の人の分のエンコードは続ける
+        return await asyncio.shield(cached[1])
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_src = None
+        while True:
+            t0 = loop.time()
+            # 見ている人がいないときはフレームを配らない
+            if self.viewers:
+                src_seq, frame = self._frame_fn()
+                if frame is not None and src_seq != last_src:
+                    last_src = src_seq
+                    self.frames.publish(frame)
+            await asyncio.sleep(max(self.interval - (loop.time() - t0), 0))
+
+
+class _Variant:
+    __slots__ = ("lock", "seq", "part", "encoded_at")
+
+    def __init__(self):
+        self.lock = threading.Lock()   # 同じ組のエンコードは1本ずつ（2人目は結果を待つ）
+        self.seq  = -1
+        self.part: bytes | None = None
+        self.encoded_at = 0.0
+
+
+class SharedEncoder:
+    """
+    FrameHub のスレッド版（Flask の /video_feed 用）。（縮小率, 画質）ごとに最新の
+    エンコード結果を1つ持ち、同じ組のクライアントで共有する。元フレームが新しくなっていても
+    前回のエンコードから 1/max_fps 秒経つまでは前の結果を返すので、クライアントごとの
+    fps の待ち方に関係なく、組ごとのエンコードは max_fps 回/秒まで。
+    組の種類は max_variants まで、超えたら一番長く使われていない組を捨てる。
+    """
+
+    def __init__(self, max_fps: float = 15, max_variants: int = 8):
+        self.interval     = 1.0 / max_fps
+        self.max_variants = max_variants
+        self._lock = threading.Lock()
+        self._variants: dict[tuple, _Variant] = {}   # (scale, quality) → 最新の結果
+
+    def part(self, seq: int, frame, scale: float, quality: int) -> tuple[int, bytes | None]:
+        """(エンコードした元フレームの seq, マルチパートの1区切り分)"""
+        key = (scale, quality)
+        with self._lock:
+            v = self._variants.pop(key, None) or _Variant()
+            self._variants[key] = v   # 末尾 = 最近使った組
+            while len(self._variants) > self.max_variants:
+                del self._variants[next(iter(self._variants))]
+        with v.lock:
+            now = time.monotonic()
+            if v.seq != seq and (v.part is None or now - v.encoded_at >= self.interval):
+                v.part = encode_part(frame, scale, quality)
+                v.seq, v.encoded_at = seq, now
+            return v.seq, v.part
+
+    def variants(self) -> int:
+        with self._lock:
+            return len(self._variants)
+
+
+class StatusHub:
+    """status を一定間隔で見て、変わったときだけ SSE のイベントを作る"""
+
+    def __init__(self, status_fn, interval_sec: float = 0.1):
+        self._status_fn = status_fn   # () -> dict
+        self.interval   = interval_sec
+        self.events     = _Broadcast()
+
+    async def run(self):
+        last = None
+        while True:
+            body = json.dumps(self._status_fn(), ensure_ascii=False)
+            if body != last:
+                last = body
+                self.events.publish(f"data: {body}\n\n".encode())
+            await asyncio.sleep(self.interval)
+
+
+class StreamServer:
+    def __init__(self, frame_fn, status_fn, host: str = "0.0.0.0", port: int = 5080,
+                 fps: float = 15, jpeg_quality: int = 80,
+                 max_clients: int = 200, max_per_ip: int = 0,
+                 write_timeout_sec: float = 10, header_timeout_sec: float = 5,
+                 max_buffer_kb: int = 512, status_interval_ms: int = 100,
+                 keepalive_sec: float = 15, max_variants: int = 8):
+        self.host, self.port = host, port
+        self.frame_hub  = FrameHub(frame_fn, fps, jpeg_quality, max_variants)
+        self.status_hub = StatusHub(status_fn, status_interval_ms / 1000)
+        self.max_clients        = max_clients
+        self.max_per_ip         = max_per_ip
+        self.write_timeout_sec  = write_timeout_sec
+        self.header_timeout_sec = header_timeout_sec
+        self.max_buffer         = max_buffer_kb * 1024
+        self.keepalive_sec      = keepalive_sec
+        metrics.gauge("stream_variants", "エンコードしている配信パラメータ（縮小率・画質）の種類",
+                      func=lambda: len(self.frame_hub.viewers))
+
+        # 接続中のクライアント（接続順）: writer → {"ip", "kind", "since", "sent", "dropped"}
+        self._clients: dict[asyncio.StreamWriter, dict] = {}
+        self._thread: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    # ──────────────────────────────────────────
+    # 起動
+    # ──────────────────────────────────────────
+    def start(self) -> "StreamServer":
+        """専用スレッドでイベントループを回す"""
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+        self._thread.start()
+        return self
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle, self.host, self.port,
+                                            reuse_address=True, backlog=1024)
+        print(f"[StreamServer] http://{self.host}:{self.port} で配信します "
+              f"(max_clients={self.max_clients}, max_per_ip={self.max_per_ip})")
+        async with server:
+            await asyncio.gather(self.frame_hub.run(), self.status_hub.run(),
+                                 server.serve_forever())
+
+    # ──────────────────────────────────────────
+    # 接続の受付
+    # ──────────────────────────────────────────
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.header_timeout_sec)
+            method, target, _ = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError, OSError):
+            STREAM_DISCONNECT.inc(reason="bad_request")
+            writer.close()
+            return
+
+        url = urlsplit(target)
+        if method != "GET" or url.path not in ("/video_feed", "/events"):
+            writer.write(_simple_response("404 Not Found", "not found\n"))
+            await self._close(writer)
+            return
+        if url.path == "/video_feed":
+            try:
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                variant = parse_variant(query, self.frame_hub.default[1], self.frame_hub.max_fps)
+            except ValueError:
+                writer.write(_simple_response("400 Bad Request", "scale / quality / fps は数値で指定してください\n"))
+                await self._close(writer)
+                return
+        if len(self._clients) >= self.max_clients:
+            STREAM_DISCONNECT.inc(reason="rejected")
+            writer.write(_simple_response("503 Service Unavailable", "too many clients\n",
+                                          "Retry-After: 5\r\n"))
+            await self._close(writer)
+            return
+
+        peer = writer.get_extra_info("peername")
+        ip = peer[0] if peer else ""
+        if self.max_per_ip > 0:
+            self._evict_same_ip(ip)
+        # カーネル側の送信バッファも小さくし、遅いクライアントに古いフレームを溜めない
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.max_buffer)
+        writer.transport.set_write_buffer_limits(high=self.max_buffer)
+        kind = "mjpeg" if url.path == "/video_feed" else "events"
+        info = {"ip": ip, "kind": kind, "since": time.time(), "sent": 0, "dropped": 0}
+        self._clients[writer] = info
+        try:
+            if kind == "mjpeg":
+                await self._serve_mjpeg(writer, info, variant)
+            else:
+                await self._serve_events(writer, info)
+            reason = "closed"
+        except asyncio.TimeoutError:
+            reason = "slow"      # write_timeout_sec の間まったく送れなかった
+        except OSError:
+            reason = "evicted" if info.get("evicted") else "closed"
+        finally:
+            self._clients.pop(writer, None)
+        STREAM_DISCONNECT.inc(reason=reason)
+        await self._close(writer)
+
+    def _evict_same_ip(self, ip: str):
+        """同じ IP の接続が max_per_ip に達していたら古いものから閉じる"""
+        same = [w for w, c in self._clients.items() if c["ip"] == ip]
+        for w in same[:max(len(same) - self.max_per_ip + 1, 0)]:
+            # 配信ループは次の送信で閉じられたことに気づいて抜ける
+            self._clients.pop(w)["evicted"] = True
+            w.transport.abort()
+
+    async def _close(self, writer: asyncio.StreamWriter):
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), 1.0)
+        except (asyncio.TimeoutError, OSError):
+            writer.transport.abort()
+
+    async def _send(self, writer: asyncio.StreamWriter, data: bytes):
+        if writer.transport.is_closing():
+            raise ConnectionResetError
+        writer.write(data)
+        # 送信バッファが max_buffer を超えているときだけ待つ。
+        # 少しずつでも送れている間は待ち続け、まったく減らなければ切断する
+        transport = writer.transport
+        while True:
+            before = transport.get_write_buffer_size()
+            try:
+                await asyncio.wait_for(writer.drain(), self.write_timeout_sec)
+                return
+            except asyncio.TimeoutError:
+                if transport.get_write_buffer_size() >= before:
+                    raise
+
+    # ──────────────────────────────────────────
+    # 配信
+    # ──────────────────────────────────────────
+    async def _serve_mjpeg(self, writer: asyncio.StreamWriter, info: dict, variant: tuple):
+        hub = self.frame_hub
+        scale, quality, fps = variant
+        key = hub.join((scale, quality))
+        info["variant"] = {"scale": key[0], "quality": key[1], "fps": fps}
+        interval = 1.0 / fps if fps < hub.max_fps else 0.0
+        loop = asyncio.get_running_loop()
+        STREAM_CLIENTS.inc()
+        try:
+            await self._send(writer, MJPEG_HEADER)
+            last = 0
+            while True:
+                # 最初の1枚が来ない（カメラ停止）間も切断を検知できるよう区切って待つ
+                seq, frame = await hub.frames.next(last, timeout=self.keepalive_sec)
+                if frame is None:
+                    if writer.transport.is_closing():
+                        return
+                    continue
+                started = loop.time()
+                last = seq
+                part = await hub.part(key, seq, frame)
+                if part is not None:
+                    await self._send(writer, part)
+                    info["sent"] += 1
+                # エンコード待ち・drain() の間に来たフレームは送らずに飛ばした
+                # （fps 指定で間を空けた分は数えない）
+                behind = hub.frames.seq - seq
+                if behind:
+                    info["dropped"] += behind
+                    STREAM_DROPPED.inc(behind)
+                if interval:
+                    await asyncio.sleep(max(interval - (loop.time() - started), 0))
+        finally:
+            hub.leave(key)
+            STREAM_CLIENTS.dec()
+
+    async def _serve_events(self, writer: asyncio.StreamWriter, info: dict):
+        hub = self.status_hub
+        EVENT_CLIENTS.inc()
+        try:
+            await self._send(writer, SSE_HEADER + b"retry: 2000\n\n")
+            last = 0
+            while True:
+                seq, data = await hub.events.next(last, timeout=self.keepalive_sec)
+                if data is None:
+                    # 変化がなくても定期的に送り、閉じられた接続を見つける
+                    await self._send(writer, SSE_PING)
+                    continue
+                last = seq
+                await self._send(writer, data)
+                info["sent"] += 1
+        finally:
+            EVENT_CLIENTS.dec()
+
+    # ──────────────────────────────────────────
+    def stats(self) -> dict:
+        """
+        /api/stream 用の接続状況。接続一覧はイベントループが書き換えるので、
+        写しはループのスレッドで取る（呼び出し側のスレッドでは辿らない）。
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            clients, variants = [], []
+        else:
+            clients, variants = asyncio.run_coroutine_threadsafe(
+                self._snapshot(), loop).result(timeout=2)
+        return {
+            "port":        self.port,
+            "max_clients": self.max_clients,
+            "max_per_ip":  self.max_per_ip,
+            "mjpeg":       sum(1 for c in clients if c["kind"] == "mjpeg"),
+            "events":      sum(1 for c in clients if c["kind"] == "events"),
+            "variants":    variants,
+            "clients":     clients,
+        }
+
+    async def _snapshot(self) -> tuple[list[dict], list[dict]]:
+        now = time.time()
+        clients = [{"ip": c["ip"], "kind": c["kind"], "age_sec": round(now - c["since"], 1),
+                    "sent": c["sent"], "dropped": c["dropped"],
+                    **({"variant": c["variant"]} if "variant" in c else {})}
+                   for c in self._clients.values()]
+        variants = [{"scale": k[0], "quality": k[1], "viewers": n}
+                    for k, n in self.frame_hub.viewers.items()]
+        return clients, variants
@@ -0,0 +1,106 @@
+"""
+撮影から通知までのイベント単位のトレース
+
+1フレームごとに Trace を作り、撮影時刻とフレーム番号を持たせたまま
+camera_worker → 認識 → 出退勤記録 → Slack 送信 と受け渡す。
+各段階は開始・終了時刻（time.time()）を span として追記する。
+
+    camera_read       cap.read() がブロックしていた時間
+    wait              撮影から認識開始まで（認識間隔の待ち・キュー待ち）
+    detect / quality / encode / match
+                      FaceEngine の段階別時間（結果の timings を順に並べる）
+    recognize_other   認識全体のうち上記以外（プール時のプロセス間転送など）
+    cooldown          クールダウン判定
+    attendance_write  出退勤の記録
+    slack_enqueue     Slack 送信キューへの投入
+    status_update     ブラウザ表示用 status の更新（次のポーリングで表示される）
+    slack_delivery    キュー投入から送信完了まで（別スレッドで後から追記される）
+
+顔が検出されたフレームのトレースだけを固定長のリングバッファに残し、
+/api/traces で直近分と段階ごとのパーセンタイルを返す。
+"""
+
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+
+class Trace:
+    __slots__ = ("seq", "captured", "spans", "meta")
+
+    def __init__(self, seq: int, captured: float):
+        self.seq      = seq
+        self.captured = captured   # 撮影時刻（time.time()）
+        self.spans: list[tuple[str, float, float]] = []
+        self.meta: dict = {}
+
+    def add(self, stage: str, start: float, end: float):
+        self.spans.append((stage, start, end))
+
+    def add_sequence(self, start: float, durations: dict[str, float]) -> float:
+        """所要時間だけ分かっている段階を start から順に並べる。最後の終了時刻を返す"""
+        for stage, sec in durations.items():
+            self.add(stage, start, start + sec)
+            start += sec
+        return start
+
+    def end(self) -> float:
+        spans = list(self.spans)
+        return max((e for _, _, e in spans), default=self.captured)
+
+    def to_dict(self) -> dict:
+        spans = list(self.spans)
+        return {
+            "seq":      self.seq,
+            "captured": datetime.fromtimestamp(self.captured).strftime("%H:%M:%S.%f")[:-3],
+            **self.meta,
+            "total_ms": round((self.end() - self.captured) * 1000, 1),
+            "spans": [{"stage":    stage,
+                       "start_ms": round((s - self.captured) * 1000, 1),
+                       "ms":       round((e - s) * 1000, 2)} for stage, s, e in spans],
+        }
+
+
+class TraceBuffer:
+    def __init__(self, capacity: int = 2000):
+        self._lock   = threading.Lock()
+        self._traces: deque[Trace] = deque(maxlen=capacity)
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent(self, limit: int = 50, **meta) -> list[dict]:
+        """新しい順に limit 件。meta を渡すとその値が一致するものだけ"""
+        with self._lock:
+            traces = list(self._traces)
+        out = []
+        for t in reversed(traces):
+            if all(t.meta.get(k) == v for k, v in meta.items()):
+                out.append(t.to_dict())
+                if len(out) >= limit:
+                    break
+        return out
+
+    def summary(self) -> dict:
+        """段階ごとの件数と p50 / p95 / p99 / max（ミリ秒）"""
+        with self._lock:
+            traces = list(self._traces)
+        per_stage: dict[str, list[float]] = {}
+        for t in traces:
+            for stage, s, e in list(t.spans):
+                per_stage.setdefault(stage, []).append(e - s)
+            per_stage.setdefault("end_to_end", []).append(t.end() - t.captured)
+
+        summary = {}
+        for stage, values in per_stage.items():
+            ms = np.asarray(values) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[stage] = {"count":  len(values),
+                              "p50_ms": round(float(p50), 2),
+                              "p95_ms": round(float(p95), 2),
+                              "p99_ms": round(float(p99), 2),
+                              "max_ms": round(float(ms.max()), 2)}
+        return {"traces": len(traces), "stages": summary}
@@ -0,0 +1,147 @@
+"""
+未登録人物のクラスタリング（重複保存の抑制）
+
+unknown と判定された顔の特徴ベクトルを、直近 window_sec の間に
+見た未登録人物（クラスタ）とその場で照合する。
+
+    新しいクラスタ            → 画像を保存する
+    既存クラスタと同一人物    → 品質スコアが保存済みの better_ratio 倍以上で、
+                                前回の保存から cooldown_sec 以上たっていれば保存し直す
+                                それ以外は保存しない（回数だけ数える）
+
+1人の配達員が立っている間に何十枚も保存されていたのを、
+ほぼ「1人1〜2枚」に減らす。クラスタごとの集計は summary() で取れる。
+
+品質スコア:
+    顔の大きさ × sqrt(シャープネス) ÷ 横向き度合い
+    品質ゲートの指標が無いとき（ゲート無効）は顔枠の面積を使う。
+
+クラスタ ID（u0001, u0002, ...）は画像のファイル名に入る。再起動で u0001 に
+戻って別人と同じ名前にならないよう、image_dir の既存の unknown 画像の
+最大の番号の続きから振る。
+"""
+
+import glob
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+def quality_score(quality: dict, face_loc: tuple | None) -> float:
+    if quality.get("sharpness") is not None:
+        return (quality.get("size", 0) * float(np.sqrt(max(quality["sharpness"], 0.0)))
+                / max(quality.get("yaw_ratio", 1.0), 1.0))
+    if face_loc is None:
+        return 0.0
+    top, right, bottom, left = face_loc
+    return float((bottom - top) * (right - left))
+
+
+class UnknownClusterer:
+    def __init__(self, window_sec: float = 600, cluster_distance: float = 0.5,
+                 better_ratio: float = 1.5, cooldown_sec: float = 5, history: int = 200,
+                 image_dir: str | None = None):
+        self.window           = timedelta(seconds=window_sec)
+        self.cluster_distance = cluster_distance
+        self.better_ratio     = better_ratio
+        self.cooldown         = timedelta(seconds=cooldown_sec)
+        self.history          = history
+
+        self._lock    = threading.Lock()
+        self._active: list[dict] = []
+        self._closed: list[dict] = []   # ウィンドウを過ぎたクラスタ（新しい順に history 件）
+        self._next_id = self._last_saved_id(image_dir) + 1
+        self.stats = {"observed": 0, "saved": 0, "suppressed": 0}
+
+    @staticmethod
+    def _last_saved_id(image_dir: str | None) -> int:
+        """image_dir/<日付>/unknown/unknown_uNNNN_*.jpg の最大の NNNN（無ければ 0）"""
+        if not image_dir:
+            return 0
+        pattern = re.compile(r"unknown_u(\d+)_")
+        ids = [int(m.group(1))
+               for path in glob.glob(os.path.join(image_dir, "*", "unknown", "unknown_u*.jpg"))
+               if (m := pattern.match(os.path.basename(path)))]
+        return max(ids, default=0)
+
+    def observe(self, encoding: np.ndarray, score: float,
+                now: datetime) -> tuple[str, bool]:
+        """
+        Returns:
+            (クラスタ ID, 画像を保存すべきか)
+        """
+        with self._lock:
+            self._expire(now)
+            self.stats["observed"] += 1
+
+            cluster, dist = self._nearest(encoding)
+            if cluster is None or dist > self.cluster_distance:
+                cluster = {
+                    "id":         f"u{self._next_id:04d}",
+                    "centroid":   np.asarray(encoding, dtype=np.float64),
+                    "first_seen": now,
+                    "last_seen":  now,
+                    "sightings":  1,
+                    "saved":      1,
+                    "saved_at":   now,
+                    "best_score": score,
+                }
+                self._next_id += 1
+                self._active.append(cluster)
+                self.stats["saved"] += 1
+                return cluster["id"], True
+
+            # 重心を逐次平均で更新
+            n = cluster["sightings"]
+            cluster["centroid"]  = (cluster["centroid"] * n + encoding) / (n + 1)
+            cluster["sightings"] = n + 1
+            cluster["last_seen"] = now
+
+            if (score >= cluster["best_score"] * self.better_ratio
+                    and now - cluster["saved_at"] >= self.cooldown):
+                cluster["best_score"] = score
+                cluster["saved"]     += 1
+                cluster["saved_at"]   = now
+                self.stats["saved"]  += 1
+                return cluster["id"], True
+
+            self.stats["suppressed"] += 1
+            return cluster["id"], False
+
+    def _nearest(self, encoding: np.ndarray) -> tuple[dict | None, float]:
+        if not self._active:
+            return None, float("inf")
+        centroids = np.stack([c["centroid"] for c in self._active])
+        dists     = np.linalg.norm(centroids - encoding, axis=1)
+        idx       = int(np.argmin(dists))
+        return self._active[idx], float(dists[idx])
+
+    def _expire(self, now: datetime):
+        keep = []
+        for c in self._active:
+            if now - c["last_seen"] > self.window:
+                self._closed.insert(0, c)
+                print(f"[Unknown] {c['id']}: {c['sightings']} 回検出 / {c['saved']} 枚保存 "
+                      f"({c['first_seen']:%H:%M:%S}〜{c['last_seen']:%H:%M:%S})")
+            else:
+                keep.append(c)
+        self._active = keep
+        del self._closed[self.history:]
+
+    def summary(self) -> dict:
+        with self._lock:
+            self._expire(datetime.now())
+            row = lambda c, active: {
+                "id":         c["id"],
+                "active":     active,
+                "first_seen": c["first_seen"].strftime("%Y-%m-%d %H:%M:%S"),
+                "last_seen":  c["last_seen"].strftime("%Y-%m-%d %H:%M:%S"),
+                "sightings":  c["sightings"],
+                "saved":      c["saved"],
+            }
+            clusters = ([row(c, True) for c in reversed(self._active)] +
+                        [row(c, False) for c in self._closed])
+            return {**self.stats, "clusters": clusters}